@@ -0,0 +1,201 @@
+"""
+Controle de admissão e orçamentos de concorrência por etapa.
+
+Cada Budget limita quantos trabalhos de um tipo rodam ao mesmo tempo
+(sessões, turnos em andamento, chamadas ao LLM, sínteses de TTS). Acima do
+limite o pedido entra numa fila curta ordenada por prioridade (menor número
+= atendido primeiro) e, se a fila estiver cheia ou a espera passar do tempo
+máximo, é recusado na hora com Overloaded: preferimos recusar o 101º cliente
+a degradar os outros 100.
+
+Limites configuráveis por variáveis de ambiente, ex. para "sessions":
+    MAX_SESSIONS, SESSIONS_QUEUE_SIZE, SESSIONS_QUEUE_TIMEOUT
+
+O trabalho bloqueante roda em pools de threads dimensionados pelos
+orçamentos: o LLM (que segura uma thread durante todo o streaming) tem o
+seu próprio pool, com uma thread por vaga, e não disputa as threads do STT
+e da decodificação de áudio.
+"""
+import os
+import hmac
+import time
+import heapq
+import asyncio
+import functools
+import itertools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+
+from metrics import REGISTRY
+
+ADMISSIONS = REGISTRY.counter(
+    "voicebot_admission_total",
+    "Pedidos por orçamento e resultado (admitted, queued, rejected, timeout)",
+    ["budget", "result"],
+)
+QUEUE_WAIT = REGISTRY.histogram(
+    "voicebot_admission_queue_wait_seconds",
+    "Tempo de espera na fila de admissão",
+    ["budget"],
+)
+IN_USE = REGISTRY.gauge("voicebot_budget_in_use", "Vagas ocupadas por orçamento", ["budget"])
+LIMIT = REGISTRY.gauge("voicebot_budget_limit", "Limite de concorrência por orçamento", ["budget"])
+QUEUED = REGISTRY.gauge("voicebot_budget_queue_length", "Pedidos aguardando vaga por orçamento", ["budget"])
+
+
+class Overloaded(Exception):
+    """Pedido recusado porque o orçamento e a fila estão cheios (ou a espera expirou)."""
+
+    def __init__(self, budget, reason):
+        super().__init__(f"{budget}: {reason}")
+        self.budget = budget
+        self.reason = reason
+
+
+class Budget:
+    """Semáforo assíncrono com fila de prioridade limitada e tempo máximo de espera."""
+
+    def __init__(self, name, limit, queue_size=0, queue_timeout=0.0):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.in_use = 0
+        self._waiters = []
+        self._seq = itertools.count()
+        LIMIT.set(limit, budget=name)
+        self._update_gauges()
+
+    @classmethod
+    def from_env(cls, name, limit, queue_size, queue_timeout):
+        prefix = name.upper()
+        return cls(
+            name,
+            int(os.getenv(f"MAX_{prefix}", str(limit))),
+            int(os.getenv(f"{prefix}_QUEUE_SIZE", str(queue_size))),
+            float(os.getenv(f"{prefix}_QUEUE_TIMEOUT", str(queue_timeout))),
+        )
+
+    def _update_gauges(self):
+        IN_USE.set(self.in_use, budget=self.name)
+        QUEUED.set(self.queued, budget=self.name)
+
+    @property
+    def queued(self):
+        return sum(1 for *_, fut in self._waiters if not fut.done())
+
+    def available(self):
+        return self.in_use < self.limit and not self.queued
+
+    async def acquire(self, priority=0):
+        if self.available():
+            self.in_use += 1
+            ADMISSIONS.inc(budget=self.name, result="admitted")
+            self._update_gauges()
+            return
+        if self.queued >= self.queue_size:
+            ADMISSIONS.inc(budget=self.name, result="rejected")
+            raise Overloaded(self.name, "fila cheia")
+
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        ADMISSIONS.inc(budget=self.name, result="queued")
+        self._update_gauges()
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(fut, self.queue_timeout or None)
+        except asyncio.TimeoutError:
+            ADMISSIONS.inc(budget=self.name, result="timeout")
+            raise Overloaded(self.name, f"sem vaga em {self.queue_timeout:.1f}s")
+        except asyncio.CancelledError:
+            # A vaga pode ter sido entregue no mesmo instante do cancelamento
+            if fut.done() and not fut.cancelled():
+                self.release()
+            raise
+        finally:
+            QUEUE_WAIT.observe(time.perf_counter() - start, budget=self.name)
+            self._update_gauges()
+
+    def release(self):
+        # Entrega a vaga diretamente ao próximo da fila (in_use não muda)
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(True)
+                self._update_gauges()
+                return
+        self.in_use -= 1
+        self._update_gauges()
+
+    @asynccontextmanager
+    async def slot(self, priority=0):
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+SESSIONS = Budget.from_env("sessions", limit=100, queue_size=10, queue_timeout=3.0)
+TURNS = Budget.from_env("turns", limit=64, queue_size=32, queue_timeout=5.0)
+LLM = Budget.from_env("llm", limit=32, queue_size=64, queue_timeout=15.0)
+TTS = Budget.from_env("tts", limit=16, queue_size=256, queue_timeout=15.0)
+
+# Prioridades (menor = atendido primeiro)
+PRIORITY_LIVE = 0
+PRIORITY_DEFAULT = 1
+PRIORITY_PREFETCH = 2
+
+# Token que autoriza o cliente a escolher a prioridade (/ws?priority=0&priority_token=...).
+# Sem ele configurado, toda conexão entra com PRIORITY_DEFAULT.
+PRIORITY_TOKEN = os.getenv("ADMISSION_PRIORITY_TOKEN", "")
+
+
+def client_priority(requested, token):
+    """Prioridade da conexão: a pedida pelo cliente só vale com o token correto."""
+    if not requested or not requested.isdigit() or not PRIORITY_TOKEN:
+        return PRIORITY_DEFAULT
+    if not token or not hmac.compare_digest(token, PRIORITY_TOKEN):
+        return PRIORITY_DEFAULT
+    return int(requested)
+
+
+# Uma thread por vaga de LLM: streams e classificações não esgotam as threads das outras etapas
+LLM_EXECUTOR = ThreadPoolExecutor(max_workers=LLM.limit, thread_name_prefix="llm")
+# Pool padrão do event loop (STT, decodificação, cache): um turno em andamento ou síntese por thread
+BLOCKING_WORKERS = int(os.getenv("BLOCKING_WORKERS", str(TURNS.limit + TTS.limit)))
+
+
+def blocking_executor():
+    """Pool instalado como executor padrão do event loop pelo servidor (asyncio.to_thread usa esse pool)."""
+    return ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="blocking")
+
+
+# Event loop do servidor, onde os orçamentos vivem; None fora do servidor (simulador), sem orçamento
+_loop = None
+
+
+def bind_loop(loop):
+    global _loop
+    _loop = loop
+
+
+@contextmanager
+def thread_slot(budget, priority=0):
+    """Budget.slot para código síncrono rodando numa thread do pool: bloqueia a thread até a vaga sair."""
+    if _loop is None:
+        yield
+        return
+    asyncio.run_coroutine_threadsafe(budget.acquire(priority), _loop).result()
+    try:
+        yield
+    finally:
+        _loop.call_soon_threadsafe(budget.release)
+
+
+async def run_llm(fn, *args):
+    """Roda fn no pool do LLM, com o contexto atual (spans), como asyncio.to_thread."""
+    loop = asyncio.get_running_loop()
+    call = functools.partial(contextvars.copy_context().run, fn, *args)
+    return await loop.run_in_executor(LLM_EXECUTOR, call)
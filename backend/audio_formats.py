@@ -0,0 +1,73 @@
+"""
+Formatos de saída do áudio sintetizado.
+
+O cliente declara os formatos que aceita (em ordem de preferência) ao conectar,
+pelo parâmetro ?formats=opus_webm,mp3 do /ws ou pela mensagem
+{"type": "set_audio_format", "formats": [...]}; o servidor usa o primeiro que
+suportar. "mp3" é o padrão e mantém o áudio do Edge-TTS (24 kHz mono).
+"""
+import io
+
+# frame_rate/channels None = mantém o áudio de origem.
+# codec/bitrate são repassados ao ffmpeg na exportação; raw=True dispensa o encoder.
+OUTPUT_FORMATS = {
+    "mp3": {"container": "mp3", "mime": "audio/mpeg", "frame_rate": None, "channels": None},
+    "mp3_low": {"container": "mp3", "mime": "audio/mpeg", "frame_rate": 16000, "channels": 1, "bitrate": "32k"},
+    "opus_webm": {"container": "webm", "mime": "audio/webm; codecs=opus", "frame_rate": 16000, "channels": 1,
+                  "codec": "libopus", "bitrate": "24k"},
+    "opus_ogg": {"container": "ogg", "mime": "audio/ogg; codecs=opus", "frame_rate": 16000, "channels": 1,
+                 "codec": "libopus", "bitrate": "24k"},
+    # Telefonia: PCM linear 16 bits little-endian, sem cabeçalho
+    "pcm_s16le_8k": {"container": "raw", "mime": "audio/L16; rate=8000", "frame_rate": 8000, "channels": 1, "raw": True},
+    "pcm_s16le_16k": {"container": "raw", "mime": "audio/L16; rate=16000", "frame_rate": 16000, "channels": 1, "raw": True},
+    "mulaw_8k": {"container": "mulaw", "mime": "audio/basic", "frame_rate": 8000, "channels": 1, "codec": "pcm_mulaw"},
+}
+
+DEFAULT_FORMAT = "mp3"
+
+# Formato entregue pelo Edge-TTS: pode ser enviado sem decodificar/reencodar
+SOURCE_FORMAT = "mp3"
+
+
+def negotiate(requested):
+    """Primeiro formato da lista do cliente que o servidor suporta (ou o padrão)."""
+    if isinstance(requested, str):
+        requested = [f.strip() for f in requested.split(",")]
+    for name in requested or []:
+        if name in OUTPUT_FORMATS:
+            return name
+    return DEFAULT_FORMAT
+
+
+def describe(name):
+    """Mensagem enviada ao cliente confirmando o formato escolhido."""
+    spec = OUTPUT_FORMATS[name]
+    return {
+        "type": "audio_format",
+        "format": name,
+        "mime": spec["mime"],
+        "sample_rate": spec["frame_rate"],
+        "channels": spec["channels"],
+    }
+
+
+def conform(segment, name):
+    """Ajusta taxa de amostragem, canais e largura de amostra ao formato de saída."""
+    spec = OUTPUT_FORMATS[name]
+    if spec["frame_rate"] and segment.frame_rate != spec["frame_rate"]:
+        segment = segment.set_frame_rate(spec["frame_rate"])
+    if spec["channels"] and segment.channels != spec["channels"]:
+        segment = segment.set_channels(spec["channels"])
+    if spec.get("raw") and segment.sample_width != 2:
+        segment = segment.set_sample_width(2)
+    return segment
+
+
+def encode(segment, name):
+    """Codifica um AudioSegment (já conformado) nos bytes do formato de saída."""
+    spec = OUTPUT_FORMATS[name]
+    if spec.get("raw"):
+        return segment.raw_data
+    buffer = io.BytesIO()
+    segment.export(buffer, format=spec["container"], codec=spec.get("codec"), bitrate=spec.get("bitrate"))
+    return buffer.getvalue()
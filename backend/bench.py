@@ -0,0 +1,309 @@
+"""
+Micro-benchmarks do caminho quente do motor da árvore.
+
+Mede get_tree_response (com a classificação do LLM substituída pelo classificador
+local de stubs.py e a consulta de dívida em memória), get_next_possible_responses,
+get_template_vars, apply_template, valor_por_extenso e a segmentação estática/dinâmica
+das mensagens do TREE_FLOW_DATA, além de fluxos sintéticos com milhares de nós
+para observar como o custo escala com o tamanho do fluxo.
+
+Os resultados são gravados em bench_results/<commit>.json e podem ser comparados:
+    python bench.py                         # roda tudo e grava o resultado do commit atual
+    python bench.py -k tree_response        # apenas benchmarks cujo nome contém o filtro
+    python bench.py --compare <commit|arquivo.json> [--threshold 0.10]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+import subprocess
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime
+
+import stubs
+import prefetch
+import tree_service
+from flow_data import TREE_FLOW_DATA
+from utils import valor_por_extenso
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_results")
+SYNTHETIC_SIZES = (100, 1000, 5000)
+
+DEBT = {"nome": "João Silva", "valor": 1250.50, "empresa": "Banco Alpha", "score": 750, "status": "em_atraso"}
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def register(fn):
+        BENCHMARKS[name] = fn
+        return fn
+    return register
+
+
+def measure(fn, min_time=0.2, repeat=5):
+    """Calibra o número de iterações (como o timeit.autorange) e retorna segundos por operação em cada rodada."""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / repeat:
+            break
+        number *= 2 if elapsed == 0 else max(2, min(10, int(min_time / repeat / elapsed) + 1))
+    rounds = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        rounds.append((time.perf_counter() - start) / number)
+    return rounds, number
+
+
+@contextmanager
+def stubbed_engine(flow=None):
+    """Troca LLM, consulta de dívida e (opcionalmente) o fluxo do tree_service durante o benchmark."""
+    original = (tree_service.classify_with_llm, tree_service.mock_api_query, tree_service.TREE_FLOW_DATA, tree_service.FLOW_INDEX)
+    tree_service.classify_with_llm = stubs.classify_locally
+    tree_service.mock_api_query = lambda cpf: DEBT
+    if flow is not None:
+        tree_service.TREE_FLOW_DATA = flow
+        tree_service.FLOW_INDEX = tree_service.FlowIndex(flow)
+    try:
+        yield
+    finally:
+        (tree_service.classify_with_llm, tree_service.mock_api_query,
+         tree_service.TREE_FLOW_DATA, tree_service.FLOW_INDEX) = original
+
+
+def session(**extra):
+    data = {"history": [], "mode": "tree", "tree_state": "START", "debt_info": DEBT, "nome_cliente": DEBT["nome"]}
+    data.update(extra)
+    return data
+
+
+def make_synthetic_flow(n_nodes, branching=3, seed=0):
+    """
+    Gera um fluxo com ~n_nodes nós no formato do TREE_FLOW_DATA: blocos de um
+    DECISION com branching opções, cada uma passando por INFO -> ACTION ->
+    VALIDATION até a decisão de outro bloco, com mensagens estáticas e templates.
+    """
+    rng = random.Random(seed)
+    templates = [
+        "Certo. O valor atualizado é {{valor_divida}}.",
+        "Entendi, {{nome}}. Vamos seguir com a próxima etapa da negociação.",
+        "Cada parcela ficará no valor de {{valor_parcela}}, na condição de {{condicao}}.",
+        "Perfeito, registramos a sua escolha. Podemos continuar?",
+    ]
+    n_blocks = max(1, round(n_nodes / (1 + 3 * branching)))
+    nodes = {}
+    for i in range(n_blocks):
+        decision_id = f"decisao_{i}"
+        nodes[decision_id] = {"type": "DECISION", "message": rng.choice(templates), "options": {}}
+        for b in range(branching):
+            target = f"decisao_{(i * branching + b + 1) % n_blocks}"
+            info_id, action_id, validation_id = f"{decision_id}_info_{b}", f"{decision_id}_acao_{b}", f"{decision_id}_valida_{b}"
+            nodes[info_id] = {"type": "INFO", "message": rng.choice(templates), "next": action_id}
+            nodes[action_id] = {"type": "ACTION", "next": validation_id}
+            nodes[validation_id] = {"type": "VALIDATION", "rules": {}, "on_success": target, "on_fail": decision_id}
+            nodes[decision_id]["options"][f"opcao_{b}"] = info_id
+    return {"flow_id": f"sintetico_{n_nodes}", "start_node": "decisao_0", "nodes": nodes}
+
+
+# --- Benchmarks do fluxo real ---
+
+@benchmark("valor_por_extenso")
+def bench_valor_por_extenso():
+    values = [0.5, 1, 15.75, 100, 1250.50, 98765.43, 999999.99]
+    return lambda: [valor_por_extenso(v) for v in values]
+
+
+@benchmark("get_template_vars")
+def bench_get_template_vars():
+    data = session(agreement_type="parcelado", num_parcelas="3")
+    return lambda: tree_service.get_template_vars(data)
+
+
+@benchmark("apply_template")
+def bench_apply_template():
+    template = TREE_FLOW_DATA["nodes"]["confirmar_acordo"]["message"]
+    vars = tree_service.get_template_vars(session())
+    return lambda: tree_service.apply_template(template, vars)
+
+
+@benchmark("split_message.all_nodes")
+def bench_split_message():
+    messages = [n["message"] for n in TREE_FLOW_DATA["nodes"].values() if "message" in n]
+    vars = tree_service.get_template_vars(session())
+    return lambda: [tree_service.split_message(m, vars) for m in messages]
+
+
+@benchmark("get_next_possible_responses.all_nodes")
+def bench_next_possible_responses():
+    data = session()
+    node_ids = list(TREE_FLOW_DATA["nodes"])
+    return lambda: [tree_service.get_next_possible_responses(n, data) for n in node_ids]
+
+
+@benchmark("PrefetchScheduler.candidates.all_nodes")
+def bench_prefetch_candidates():
+    data = session()
+    scheduler = prefetch.PrefetchScheduler(None, prefetch.TransitionStats(path=None))
+    node_ids = list(TREE_FLOW_DATA["nodes"])
+    return lambda: [scheduler.candidates(n, data) for n in node_ids]
+
+
+@benchmark("FlowIndex.build")
+def bench_flow_index_build():
+    return lambda: tree_service.FlowIndex(TREE_FLOW_DATA)
+
+
+# Turnos representativos: (estado atual, fala do usuário)
+TREE_TURNS = [
+    ("START", "alô"),
+    ("identificar_intencao", "quero negociar a minha dívida"),
+    ("escolher_tipo_negociacao", "quero parcelar"),
+    ("informar_parcelas", "em 3 vezes"),
+    ("confirmar_acordo", "sim pode confirmar"),
+]
+
+
+@benchmark("get_tree_response.turns")
+def bench_tree_response():
+    def run():
+        for state, text in TREE_TURNS:
+            tree_service.get_tree_response(text, session(tree_state=state))
+    return run
+
+
+@benchmark("get_tree_response.cpf_to_intent")
+def bench_tree_response_cpf():
+    # Atravessa validar_cpf -> verificar_necessidade_api -> API -> capturar_nome numa única chamada
+    return lambda: tree_service.get_tree_response("meu cpf é 12345678901", session(tree_state="capturar_cpf"))
+
+
+# --- Benchmarks de escala (fluxos sintéticos) ---
+
+def _register_synthetic(size):
+    flow = make_synthetic_flow(size)
+    decisions = [n for n, node in flow["nodes"].items() if node["type"] == "DECISION"]
+
+    @benchmark(f"synthetic_{size}.get_next_possible_responses")
+    def bench_next():
+        data = session()
+        sample = decisions[:50]
+        return lambda: [tree_service.get_next_possible_responses(n, data) for n in sample]
+
+    @benchmark(f"synthetic_{size}.get_tree_response")
+    def bench_turn():
+        sample = decisions[:50]
+        return lambda: [tree_service.get_tree_response("opcao", session(tree_state=n)) for n in sample]
+
+    @benchmark(f"synthetic_{size}.FlowIndex.build")
+    def bench_index():
+        return lambda: tree_service.FlowIndex(flow)
+
+    bench_next.flow = bench_turn.flow = bench_index.flow = flow
+
+
+for _size in SYNTHETIC_SIZES:
+    _register_synthetic(_size)
+
+
+# --- Execução, armazenamento e comparação ---
+
+def git_commit():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+        dirty = subprocess.call(["git", "diff", "--quiet", "HEAD"], stderr=subprocess.DEVNULL) != 0
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(filter_text=None, min_time=0.2, repeat=5):
+    results = {}
+    for name, factory in BENCHMARKS.items():
+        if filter_text and filter_text not in name:
+            continue
+        # Os prints de diagnóstico do motor iriam poluir a saída e o tempo medido
+        with stubbed_engine(getattr(factory, "flow", None)), open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            fn = factory()
+            fn()  # aquecimento
+            rounds, number = measure(fn, min_time, repeat)
+        results[name] = {
+            "min_s": min(rounds),
+            "median_s": statistics.median(rounds),
+            "stdev_s": statistics.stdev(rounds) if len(rounds) > 1 else 0.0,
+            "iterations": number,
+        }
+        print(f"{name:<48} {format_time(results[name]['median_s']):>10}  (min {format_time(results[name]['min_s'])}, {number} it x {repeat})")
+    return results
+
+
+def format_time(seconds):
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("µs", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f}{unit}"
+    return f"{seconds / 1e-9:.0f}ns"
+
+
+def load_results(ref):
+    path = ref if ref.endswith(".json") else os.path.join(RESULTS_DIR, f"{ref}.json")
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare(baseline, current, threshold):
+    """Imprime a variação da mediana por benchmark; retorna True se houve regressão acima do limite."""
+    print(f"\nComparação com {baseline['commit']} ({baseline['date']}):")
+    regressed = False
+    for name, result in current["benchmarks"].items():
+        before = baseline["benchmarks"].get(name)
+        if not before:
+            print(f"  {name:<48} (novo)")
+            continue
+        ratio = result["median_s"] / before["median_s"]
+        flag = ""
+        if ratio > 1 + threshold:
+            flag, regressed = "  <-- REGRESSÃO", True
+        elif ratio < 1 - threshold:
+            flag = "  (melhora)"
+        print(f"  {name:<48} {format_time(before['median_s']):>10} -> {format_time(result['median_s']):>10}  x{ratio:.2f}{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks do motor da árvore")
+    parser.add_argument("-k", dest="filter", help="Roda apenas benchmarks cujo nome contém este texto")
+    parser.add_argument("--min-time", type=float, default=0.2, help="Tempo mínimo de medição por benchmark (s)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--compare", help="Commit (em bench_results/) ou arquivo JSON para comparar")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Variação considerada regressão (0.10 = 10%%)")
+    parser.add_argument("--no-save", action="store_true", help="Não grava o resultado em bench_results/")
+    args = parser.parse_args()
+
+    current = {
+        "commit": git_commit(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "benchmarks": run(args.filter, args.min_time, args.repeat),
+    }
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{current['commit']}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(current, f, indent=2)
+        print(f"\nResultado gravado em {path}")
+    if args.compare and compare(load_results(args.compare), current, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""
+Gravação e reprodução (record/replay) das chamadas à OpenAI e ao Edge-TTS.
+
+Modos, escolhidos por VOICE_BOT_CASSETTE:
+    record  -> chama os serviços reais e grava requisição, resposta e tempos
+    replay  -> serve as respostas gravadas sem acessar a rede
+
+VOICE_BOT_CASSETTE_DIR define onde ficam as gravações (padrão: backend/cassettes)
+e VOICE_BOT_REPLAY_SPEED controla o ritmo do replay: "recorded" reproduz as
+latências gravadas (inclusive entre os chunks do stream) e "fast" responde na hora.
+
+Cada interação é identificada por um hash da requisição normalizada, então o
+replay só funciona para conversas que percorrem os mesmos prompts da gravação.
+"""
+import os
+import json
+import time
+import asyncio
+import hashlib
+import shutil
+from types import SimpleNamespace
+
+CASSETTE_MODE = os.getenv("VOICE_BOT_CASSETTE", "").lower()
+CASSETTE_DIR = os.getenv("VOICE_BOT_CASSETTE_DIR") or os.path.join(os.path.dirname(__file__), "cassettes")
+REPLAY_SPEED = os.getenv("VOICE_BOT_REPLAY_SPEED", "recorded").lower()
+
+# No replay a rede não é usada, mas o modo IA só responde se houver uma chave configurada
+if CASSETTE_MODE == "replay":
+    os.environ.setdefault("OPENAI_API_KEY", "replay")
+
+
+class CassetteMiss(Exception):
+    """Requisição sem gravação correspondente no modo replay."""
+
+
+def _normalize_message(msg):
+    # Mensagens podem ser dicts (histórico) ou objetos da SDK (resposta anexada ao contexto)
+    get = msg.get if isinstance(msg, dict) else (lambda key, default=None: getattr(msg, key, default))
+    normalized = {"role": get("role"), "content": get("content")}
+    tool_calls = get("tool_calls")
+    if tool_calls:
+        calls = []
+        for call in tool_calls:
+            if isinstance(call, dict):
+                calls.append([call.get("id"), call["function"]["name"], call["function"]["arguments"]])
+            else:
+                calls.append([call.id, call.function.name, call.function.arguments])
+        normalized["tool_calls"] = calls
+    for key in ("tool_call_id", "name"):
+        if get(key):
+            normalized[key] = get(key)
+    return normalized
+
+
+def request_key(kind, payload):
+    data = json.dumps({"kind": kind, **payload}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def _path(kind, key, suffix=".json"):
+    return os.path.join(CASSETTE_DIR, kind, key + suffix)
+
+
+def _save(kind, key, record):
+    path = _path(kind, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(record, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+
+def _load(kind, key):
+    path = _path(kind, key)
+    if not os.path.exists(path):
+        raise CassetteMiss(f"Sem gravação para {kind} ({key[:12]}...)")
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _wait(seconds):
+    if REPLAY_SPEED == "recorded" and seconds > 0:
+        time.sleep(seconds)
+
+
+# --- Objetos com a mesma forma das respostas da SDK ---
+
+def _tool_call_object(data):
+    function = SimpleNamespace(name=data["function"]["name"], arguments=data["function"]["arguments"])
+    call = SimpleNamespace(id=data["id"], type=data.get("type", "function"), function=function)
+    call.model_dump = lambda: {"id": call.id, "type": call.type, "function": {"name": function.name, "arguments": function.arguments}}
+    return call
+
+
+def _message_object(data):
+    tool_calls = [_tool_call_object(tc) for tc in data.get("tool_calls") or []] or None
+    return SimpleNamespace(role="assistant", content=data.get("content"), tool_calls=tool_calls)
+
+
+def _chunk_object(content, tool_calls=None):
+    deltas = None
+    if tool_calls:
+        deltas = [
+            SimpleNamespace(index=tc["index"], id=tc.get("id"), type=tc.get("type"),
+                            function=SimpleNamespace(name=tc["function"].get("name"), arguments=tc["function"].get("arguments")))
+            for tc in tool_calls
+        ]
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content, tool_calls=deltas))])
+
+
+def _tool_call_deltas(delta):
+    """Fragmentos de tool_calls de um chunk do stream em formato serializável (ou None)."""
+    if not delta or not getattr(delta, "tool_calls", None):
+        return None
+    return [
+        {"index": tc.index, "id": tc.id, "type": tc.type,
+         "function": {"name": tc.function.name if tc.function else None,
+                      "arguments": tc.function.arguments if tc.function else None}}
+        for tc in delta.tool_calls
+    ]
+
+
+# --- OpenAI ---
+
+class _Responses:
+    def __init__(self, real):
+        self._real = real
+
+    def parse(self, model, input, text_format, **kwargs):
+        key = request_key("responses.parse", {
+            "model": model,
+            "input": [_normalize_message(m) for m in input],
+            "text_format": text_format.__name__,
+        })
+        if CASSETTE_MODE == "replay":
+            record = _load("openai", key)
+            _wait(record["latency"])
+            return SimpleNamespace(output_parsed=text_format.model_validate(record["output_parsed"]))
+        start = time.perf_counter()
+        response = self._real.responses.parse(model=model, input=input, text_format=text_format, **kwargs)
+        _save("openai", key, {
+            "kind": "responses.parse",
+            "latency": time.perf_counter() - start,
+            "output_parsed": response.output_parsed.model_dump(),
+        })
+        return response
+
+
+class _Completions:
+    def __init__(self, real):
+        self._real = real
+
+    def create(self, model, messages, stream=False, **kwargs):
+        key = request_key("chat.completions", {
+            "model": model,
+            "messages": [_normalize_message(m) for m in messages],
+            "tools": kwargs.get("tools"),
+            "tool_choice": kwargs.get("tool_choice"),
+            "stream": stream,
+        })
+        if CASSETTE_MODE == "replay":
+            record = _load("openai", key)
+            if stream:
+                return self._replay_stream(record)
+            _wait(record["latency"])
+            return SimpleNamespace(choices=[SimpleNamespace(message=_message_object(record["message"]))])
+
+        start = time.perf_counter()
+        response = self._real.chat.completions.create(model=model, messages=messages, stream=stream, **kwargs)
+        if stream:
+            return self._record_stream(key, response, start)
+        message = response.choices[0].message
+        _save("openai", key, {
+            "kind": "chat.completions",
+            "latency": time.perf_counter() - start,
+            "message": {
+                "content": message.content,
+                "tool_calls": [tc.model_dump() for tc in message.tool_calls or []],
+            },
+        })
+        return response
+
+    def _record_stream(self, key, response, start):
+        # Guarda o conteúdo (e os fragmentos de tool_calls) de cada chunk com o instante relativo ao início
+        chunks = []
+        for chunk in response:
+            delta = chunk.choices[0].delta if chunk.choices else None
+            chunks.append([time.perf_counter() - start, delta.content if delta else None, _tool_call_deltas(delta)])
+            yield chunk
+        _save("openai", key, {"kind": "chat.completions.stream", "chunks": chunks})
+
+    def _replay_stream(self, record):
+        elapsed = 0.0
+        for offset, content, *tool_calls in record["chunks"]:
+            _wait(offset - elapsed)
+            elapsed = offset
+            # Gravações antigas têm só [instante, conteúdo]
+            yield _chunk_object(content, tool_calls[0] if tool_calls else None)
+
+
+class CassetteOpenAI:
+    """Envolve um cliente OpenAI (ou nenhum, no replay) gravando ou reproduzindo as chamadas."""
+
+    def __init__(self, real=None):
+        self.responses = _Responses(real)
+        self.chat = SimpleNamespace(completions=_Completions(real))
+
+
+# --- Edge-TTS ---
+
+def wrap_tts(synthesize, voice, rate):
+    """Envolve uma função async synthesize(text, path) com gravação/reprodução do MP3 gerado."""
+
+    async def cassette_synthesize(text, path):
+        key = request_key("tts", {"text": text, "voice": voice, "rate": rate})
+        audio_path = _path("tts", key, ".mp3")
+        if CASSETTE_MODE == "replay":
+            record = _load("tts", key)
+            if REPLAY_SPEED == "recorded":
+                await asyncio.sleep(record["latency"])
+            shutil.copyfile(audio_path, path)
+            return
+        start = time.perf_counter()
+        await synthesize(text, path)
+        latency = time.perf_counter() - start
+        os.makedirs(os.path.dirname(audio_path), exist_ok=True)
+        shutil.copyfile(path, audio_path)
+        _save("tts", key, {"kind": "tts", "text": text, "voice": voice, "rate": rate, "latency": latency})
+
+    return cassette_synthesize
+
+
+def install(synthesize, voice, rate):
+    """Aplica o modo configurado aos clientes dos serviços e retorna a função de TTS a ser usada."""
+    if CASSETTE_MODE not in ("record", "replay"):
+        raise ValueError(f"VOICE_BOT_CASSETTE inválido: {CASSETTE_MODE!r} (use record ou replay)")
+    import clients
+    # O cliente real (ou o simulador, se instalado antes) só é criado para gravar
+    clients.override("openai", CassetteOpenAI(None if CASSETTE_MODE == "replay" else clients.openai()))
+    print(f"[CASSETTE] Modo {CASSETTE_MODE} em {CASSETTE_DIR} (ritmo do replay: {REPLAY_SPEED})")
+    return wrap_tts(synthesize, voice, rate)
@@ -0,0 +1,94 @@
+"""
+Registro compartilhado dos clientes externos, criados sob demanda.
+
+Importar os serviços não lê o .env nem abre conexões: os clientes (OpenAI e
+API de dívidas) são construídos uma única vez, no primeiro uso ou no lifespan
+do servidor, e compartilhados por tree_service e llm_service. Simuladores (stubs.py) e o
+gravador de chamadas (cassette.py) trocam o cliente com override().
+"""
+import os
+import threading
+
+from dotenv import load_dotenv
+
+# Reentrante: as fábricas chamam load_env() com o lock de get() já tomado
+_lock = threading.RLock()
+_env_loaded = False
+_clients = {}
+
+
+def load_env():
+    """Carrega as variáveis do arquivo .env (uma vez por processo)."""
+    global _env_loaded
+    if not _env_loaded:
+        with _lock:
+            if not _env_loaded:
+                load_dotenv()
+                _env_loaded = True
+
+
+def openai_configured():
+    load_env()
+    return bool(os.getenv("OPENAI_API_KEY"))
+
+
+def _create_openai():
+    from openai import OpenAI
+    load_env()
+    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+
+def _create_debt_api():
+    import httpx
+    load_env()
+    # API de dívidas (a API Mock, por padrão); lida depois do .env, como a chave da OpenAI
+    url = os.getenv("DEBT_API_URL", "http://localhost:8001")
+    timeout = float(os.getenv("DEBT_API_TIMEOUT", "2.0"))
+    # Conexões reaproveitadas entre consultas (antes cada consulta abria uma conexão nova)
+    return httpx.Client(base_url=url, timeout=timeout,
+                        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32))
+
+
+FACTORIES = {
+    "openai": _create_openai,
+    "debt_api": _create_debt_api,
+}
+
+
+def get(name):
+    """Cliente compartilhado pelo nome, criado na primeira chamada."""
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = FACTORIES[name]()
+    return client
+
+
+def openai():
+    return get("openai")
+
+
+def debt_api():
+    return get("debt_api")
+
+
+def override(name, client):
+    """Substitui um cliente (simuladores, gravação/reprodução)."""
+    with _lock:
+        _clients[name] = client
+
+
+def close_all():
+    """Fecha as conexões dos clientes criados; o próximo uso cria clientes novos."""
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        close = getattr(client, "close", None)
+        if close:
+            try:
+                close()
+            except Exception as e:
+                print(f"[CLIENTS] Erro ao fechar cliente: {e}")
@@ -0,0 +1,217 @@
+"""
+Janela de contexto do modo IA com orçamento de tokens.
+
+O histórico da sessão é agrupado em turnos atômicos: cada fala do usuário com
+tudo o que veio depois dela (chamadas de ferramenta, resultados e resposta).
+Um corte nunca separa um "tool_calls" dos seus resultados.
+
+O prompt leva o resumo acumulado da conversa e os turnos mais recentes que
+cabem em MAX_PROMPT_TOKENS. Quando o histórico guardado passa de
+MAX_HISTORY_TOKENS, os turnos mais antigos saem da sessão e ficam pendentes
+até serem incorporados ao resumo por uma chamada em segundo plano, feita
+depois que a resposta do turno já foi entregue. Enquanto o resumo não fica
+pronto, os turnos pendentes continuam disponíveis para o prompt.
+"""
+import os
+import threading
+
+from metrics import REGISTRY
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken é opcional; sem ele os tokens são estimados (~4 caracteres por token)
+    tiktoken = None
+
+MAX_PROMPT_TOKENS = int(os.getenv("MAX_PROMPT_TOKENS", "1500"))
+MAX_HISTORY_TOKENS = int(os.getenv("MAX_HISTORY_TOKENS", "3000"))
+MAX_SUMMARY_TOKENS = int(os.getenv("MAX_SUMMARY_TOKENS", "250"))
+# Custo fixo de cada mensagem no formato de chat (papel, separadores)
+MESSAGE_OVERHEAD = 4
+CHARS_PER_TOKEN = 4
+
+PROMPT_TOKENS = REGISTRY.histogram(
+    "voicebot_llm_prompt_tokens",
+    "Tokens do prompt enviado ao LLM no modo IA",
+    buckets=(100, 250, 500, 750, 1000, 1500, 2000, 3000, 4000, 8000),
+)
+COMPACTIONS = REGISTRY.counter(
+    "voicebot_context_compactions_total",
+    "Turnos antigos incorporados ao resumo da conversa por origem do resumo (llm, local, discarded)",
+    ["result"],
+)
+
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None and tiktoken is not None:
+        try:
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception as e:  # ex: sem rede para baixar o vocabulário
+            print(f"[CONTEXT] tiktoken indisponível, estimando tokens: {e}")
+            _encoding = False
+    return _encoding or None
+
+
+def count_tokens(text):
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def truncate_tokens(text, limit, keep_end=False):
+    """Corta o texto em até limit tokens (mantendo o início, ou o fim com keep_end)."""
+    if count_tokens(text) <= limit:
+        return text
+    encoding = _get_encoding()
+    if encoding:
+        tokens = encoding.encode(text)
+        return encoding.decode(tokens[-limit:] if keep_end else tokens[:limit])
+    chars = limit * CHARS_PER_TOKEN
+    return text[-chars:] if keep_end else text[:chars]
+
+
+def message_tokens(msg):
+    """Tokens de uma mensagem do histórico da sessão (texto, conteúdo de ferramenta e argumentos)."""
+    tokens = MESSAGE_OVERHEAD + count_tokens(msg.get("text") or msg.get("content") or "")
+    for call in msg.get("tool_calls") or []:
+        tokens += count_tokens(call["function"]["name"]) + count_tokens(call["function"]["arguments"])
+    return tokens
+
+
+def turn_tokens(turn):
+    return sum(message_tokens(msg) for msg in turn)
+
+
+def group_turns(history):
+    """Agrupa o histórico em turnos: cada fala do usuário e as mensagens seguintes até a próxima."""
+    turns = []
+    for msg in history:
+        if msg["role"] == "user" or not turns:
+            turns.append([msg])
+        else:
+            turns[-1].append(msg)
+    return turns
+
+
+def to_openai(turn):
+    """Converte um turno para o formato da OpenAI, sem tool_calls sem resultado nem resultados órfãos."""
+    answered = {msg["tool_call_id"] for msg in turn if msg["role"] == "tool"}
+    called = set()
+    messages = []
+    for msg in turn:
+        if "tool_calls" in msg:
+            ids = {call["id"] for call in msg["tool_calls"]}
+            if not ids <= answered:
+                continue  # turno interrompido antes dos resultados: a API recusaria a chamada
+            called |= ids
+            # content None quando vazio para evitar erros na API
+            messages.append({"role": "assistant", "content": msg.get("text") or None, "tool_calls": msg["tool_calls"]})
+        elif msg["role"] == "tool":
+            if msg["tool_call_id"] in called:
+                messages.append({"role": "tool", "tool_call_id": msg["tool_call_id"], "name": msg["name"], "content": msg["content"]})
+        else:
+            role = "assistant" if msg["role"] in ["assistant", "ai"] else "user"
+            messages.append({"role": role, "content": msg["text"]})
+    return messages
+
+
+def local_summary(summary, messages):
+    """Resumo sem LLM: os últimos resultados de ferramenta e o final da conversa, dentro do limite de tokens."""
+    facts = {}
+    lines = [summary] if summary else []
+    for msg in messages:
+        if msg["role"] == "tool":
+            facts[msg["name"]] = msg["content"]
+        elif msg.get("text"):
+            lines.append(f"{'Cliente' if msg['role'] == 'user' else 'Atendente'}: {msg['text']}")
+    facts_text = " ".join(f"[{name}] {content}" for name, content in facts.items())
+    budget = max(MAX_SUMMARY_TOKENS - count_tokens(facts_text), 0)
+    return " ".join(part for part in (facts_text, truncate_tokens(" ".join(lines), budget, keep_end=True)) if part)
+
+
+class ConversationContext:
+    """Resumo acumulado e turnos pendentes de resumo de uma sessão do modo IA."""
+
+    def __init__(self, max_prompt_tokens=MAX_PROMPT_TOKENS, max_history_tokens=MAX_HISTORY_TOKENS):
+        self.max_prompt_tokens = max_prompt_tokens
+        self.max_history_tokens = max_history_tokens
+        self.summary = ""
+        # Turnos já retirados do histórico que ainda não entraram no resumo
+        self.pending = []
+        self.summarizing = False
+        self.last_prompt_tokens = 0
+        self._lock = threading.Lock()
+
+    def build_messages(self, system_prompt, history, text):
+        """Mensagens do prompt: sistema, resumo, turnos mais recentes que cabem no orçamento e a fala atual."""
+        messages = [{"role": "system", "content": system_prompt}]
+        with self._lock:
+            summary, pending = self.summary, list(self.pending)
+        if summary:
+            messages.append({"role": "system", "content": f"Resumo da conversa até aqui: {summary}"})
+        user_msg = {"role": "user", "content": text}
+
+        used = sum(MESSAGE_OVERHEAD + count_tokens(msg["content"]) for msg in messages + [user_msg])
+        selected = []
+        for turn in reversed(pending + group_turns(history)):
+            cost = turn_tokens(turn)
+            if used + cost > self.max_prompt_tokens:
+                break
+            selected.append(turn)
+            used += cost
+        for turn in reversed(selected):
+            messages.extend(to_openai(turn))
+        messages.append(user_msg)
+
+        self.last_prompt_tokens = used
+        PROMPT_TOKENS.observe(used)
+        return messages
+
+    def compact(self, history, summarize=True):
+        """
+        Retira do histórico (no lugar) os turnos mais antigos quando ele passa de max_history_tokens,
+        deixando-o em metade do limite. Com summarize, os turnos ficam pendentes para o resumo;
+        sem, são descartados. Retorna True se há turnos aguardando resumo.
+        """
+        turns = group_turns(history)
+        total = sum(turn_tokens(turn) for turn in turns)
+        if total > self.max_history_tokens:
+            removed, count = [], 0
+            # O turno mais recente sempre fica
+            while len(turns) > 1 and total > self.max_history_tokens // 2:
+                turn = turns.pop(0)
+                total -= turn_tokens(turn)
+                removed.append(turn)
+                count += len(turn)
+            del history[:count]
+            if summarize:
+                with self._lock:
+                    self.pending.extend(removed)
+            else:
+                COMPACTIONS.inc(len(removed), result="discarded")
+        return bool(self.pending)
+
+    def summarize(self, summarizer):
+        """Incorpora os turnos pendentes ao resumo. Bloqueante: deve rodar fora do caminho crítico."""
+        with self._lock:
+            turns = list(self.pending)
+            summary = self.summary
+        if not turns:
+            return
+        messages = [msg for turn in turns for msg in turn]
+        result = "llm" if summarizer is not local_summary else "local"
+        try:
+            new_summary = summarizer(summary, messages)
+        except Exception as e:
+            print(f"[CONTEXT] Falha ao resumir a conversa, usando resumo local: {e}")
+            new_summary, result = local_summary(summary, messages), "local"
+        with self._lock:
+            self.summary = truncate_tokens(new_summary.strip(), MAX_SUMMARY_TOKENS)
+            del self.pending[:len(turns)]
+        COMPACTIONS.inc(len(turns), result=result)
+        print(f"[CONTEXT] {len(turns)} turnos incorporados ao resumo ({result}, {count_tokens(self.summary)} tokens)")
@@ -0,0 +1,189 @@
+"""
+Base de clientes gerada para a API Mock de Dívidas, em SQLite no disco.
+
+Cada cliente é derivado do seu índice (0..N-1): cpf_for_index(i) sempre devolve
+o mesmo CPF válido e debt_for_index(i) os mesmos dados. Assim o simulador e os
+testes de carga sorteiam CPFs existentes sem consultar a base. A consulta usa o
+índice único do CPF; a memória fica limitada ao cache de páginas do SQLite
+(MOCK_DEBTS_CACHE_MB), seja qual for o tamanho da base.
+
+    python debt_store.py --count 5000000      # gera (ou regera) a base
+"""
+import os
+import time
+import math
+import sqlite3
+import argparse
+from statistics import NormalDist
+
+DB_PATH = os.getenv("MOCK_DEBTS_DB") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock_debts.db")
+# 100 mil clientes geram em ~1s; bases maiores (milhões) são pedidas explicitamente
+DATASET_SIZE = int(os.getenv("MOCK_DEBTS_COUNT", "100000"))
+CACHE_MB = int(os.getenv("MOCK_DEBTS_CACHE_MB", "8"))
+# Muda quando a geração muda, para bases antigas serem refeitas
+DATASET_VERSION = "1"
+
+# Clientes fixos usados nas demonstrações e no README
+FIXED_DEBTS = {
+    "12345678901": {"nome": "João Silva", "valor": 1250.50, "empresa": "Banco Alpha", "score": 750, "status": "em_atraso"},
+    "98765432100": {"nome": "Maria Oliveira", "valor": 450.00, "empresa": "Loja Beta", "score": 420, "status": "em_atraso"},
+}
+
+# Retorno padrão para CPFs não encontrados (simulando um cliente novo ou genérico)
+DEFAULT_DEBT = {
+    "nome": "Cliente",
+    "valor": 100.00,
+    "empresa": "Empresa Parceira",
+    "score": 500,
+    "status": "regular"
+}
+
+FIRST_NAMES = ["Ana", "Bruno", "Carla", "Daniel", "Eduarda", "Felipe", "Gabriela", "Henrique", "Isabela", "João",
+               "Juliana", "Lucas", "Mariana", "Nicolas", "Patrícia", "Rafael", "Sofia", "Thiago", "Vanessa", "Vitor"]
+LAST_NAMES = ["Almeida", "Barbosa", "Cardoso", "Costa", "Ferreira", "Gomes", "Lima", "Martins", "Oliveira", "Pereira",
+              "Ribeiro", "Rocha", "Santos", "Silva", "Souza"]
+COMPANIES = ["Banco Alpha", "Loja Beta", "Financeira Gama", "Telecom Delta", "Cartões Ômega", "Varejo Sigma"]
+STATUSES = ["em_atraso"] * 6 + ["regular"] * 3 + ["negociado"]
+
+# Multiplicador coprimo com 10^9: índices distintos viram bases de CPF distintas e espalhadas
+_STRIDE = 387_420_489
+_OFFSET = 104_729
+
+
+_MASK = (1 << 64) - 1
+# Quantis de uma lognormal (mediana ~R$ 490): maioria de dívidas pequenas, cauda longa de valores altos
+_VALUE_QUANTILES = [round(math.exp(6.2 + 0.9 * NormalDist().inv_cdf((k + 0.5) / 1024)), 2) for k in range(1024)]
+
+
+def _weighted_sums(group, shift):
+    """Somas ponderadas (1º e 2º dígito verificador) de um grupo de 3 dígitos na posição shift (0 = final)."""
+    first = second = 0
+    for k in range(3):
+        digit = group // 10 ** k % 10
+        weight = 2 + shift + k
+        first += digit * weight
+        second += digit * (weight + 1)
+    return first, second
+
+
+# Somas dos dígitos verificadores pré-calculadas por grupo de 3 dígitos da base (milhões, milhares, unidades)
+_SUMS = [[_weighted_sums(group, shift) for group in range(1000)] for shift in (6, 3, 0)]
+
+
+def cpf_for_index(i):
+    """CPF válido (com dígitos verificadores) do cliente de índice i."""
+    base = (i * _STRIDE + _OFFSET) % 1_000_000_000
+    high, rest = divmod(base, 1_000_000)
+    mid, low = divmod(rest, 1000)
+    (f1, s1), (f2, s2), (f3, s3) = _SUMS[0][high], _SUMS[1][mid], _SUMS[2][low]
+    dv1 = (f1 + f2 + f3) * 10 % 11 % 10
+    dv2 = (s1 + s2 + s3 + dv1 * 2) * 10 % 11 % 10
+    return f"{base:09d}{dv1}{dv2}"
+
+
+def _mix(i):
+    """Hash de 64 bits do índice (splitmix64): atributos reproduzíveis sem um gerador por cliente."""
+    x = (i + 0x9E3779B97F4A7C15) & _MASK
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASK
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASK
+    return x ^ (x >> 31)
+
+
+def _row_for_index(i):
+    """(cpf, nome, valor, empresa, score, status) do cliente de índice i."""
+    h = _mix(i)
+    h, first = divmod(h, len(FIRST_NAMES))
+    h, last = divmod(h, len(LAST_NAMES))
+    h, company = divmod(h, len(COMPANIES))
+    h, status = divmod(h, len(STATUSES))
+    h, value = divmod(h, 1024)
+    h, has_score = divmod(h, 5)
+    # Parte dos clientes (1 em 5) não tem score e exige a consulta ao bureau no fluxo
+    score = 300 + h % 651 if has_score else None
+    return (cpf_for_index(i), f"{FIRST_NAMES[first]} {LAST_NAMES[last]}", _VALUE_QUANTILES[value],
+            COMPANIES[company], score, STATUSES[status])
+
+
+def _as_debt(row):
+    return {"nome": row[1], "valor": row[2], "empresa": row[3], "score": row[4], "status": row[5]}
+
+
+def debt_for_index(i):
+    return _as_debt(_row_for_index(i))
+
+
+def generate(path=DB_PATH, count=DATASET_SIZE, batch_size=50_000):
+    """Gera a base com count clientes (mais os fixos) num arquivo temporário e o troca pelo atual."""
+    start = time.time()
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.unlink(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("CREATE TABLE debts (cpf TEXT NOT NULL, nome TEXT, valor REAL, empresa TEXT, score INTEGER, status TEXT)")
+    conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+    insert = "INSERT INTO debts VALUES (?, ?, ?, ?, ?, ?)"
+    for offset in range(0, count, batch_size):
+        rows = map(_row_for_index, range(offset, min(offset + batch_size, count)))
+        conn.executemany(insert, (row for row in rows if row[0] not in FIXED_DEBTS))
+    conn.executemany(insert, [(cpf, d["nome"], d["valor"], d["empresa"], d["score"], d["status"])
+                              for cpf, d in FIXED_DEBTS.items()])
+    # O índice é criado depois da carga: ordenar uma vez é bem mais rápido que inserir em ordem aleatória
+    conn.execute("CREATE UNIQUE INDEX debts_cpf ON debts (cpf)")
+    conn.executemany("INSERT INTO meta VALUES (?, ?)", [("count", str(count)), ("version", DATASET_VERSION)])
+    conn.commit()
+    conn.close()
+    os.replace(tmp_path, path)
+    print(f"[DEBTS] Base com {count} clientes gerada em {time.time() - start:.1f}s ({os.path.getsize(path) / 1e6:.0f} MB): {path}")
+
+
+def ensure_dataset(path=DB_PATH, count=DATASET_SIZE):
+    """Gera a base se ela não existir ou tiver outro tamanho/versão."""
+    if os.path.exists(path):
+        try:
+            conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+            meta = dict(conn.execute("SELECT key, value FROM meta"))
+            conn.close()
+            if meta.get("count") == str(count) and meta.get("version") == DATASET_VERSION:
+                return
+        except sqlite3.Error as e:
+            print(f"[DEBTS] Base {path} ilegível, gerando de novo: {e}")
+    generate(path, count)
+
+
+class DebtStore:
+    """Consulta somente leitura à base; uma conexão por instância, usada por uma thread (o event loop)."""
+
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        self.conn.execute(f"PRAGMA cache_size=-{CACHE_MB * 1024}")
+        self.count = int(dict(self.conn.execute("SELECT key, value FROM meta"))["count"])
+
+    def get(self, cpf):
+        row = self.conn.execute("SELECT * FROM debts WHERE cpf = ?", (cpf,)).fetchone()
+        return _as_debt(row) if row else None
+
+    def get_many(self, cpfs):
+        """Dict cpf -> dados dos CPFs encontrados."""
+        found = {}
+        unique = list(dict.fromkeys(cpfs))
+        # Limite de parâmetros por consulta do SQLite
+        for start in range(0, len(unique), 500):
+            chunk = unique[start:start + 500]
+            query = f"SELECT * FROM debts WHERE cpf IN ({','.join('?' * len(chunk))})"
+            for row in self.conn.execute(query, chunk):
+                found[row[0]] = _as_debt(row)
+        return found
+
+    def close(self):
+        self.conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gera a base de clientes da API Mock de Dívidas")
+    parser.add_argument("--count", type=int, default=DATASET_SIZE)
+    parser.add_argument("--db", default=DB_PATH)
+    args = parser.parse_args()
+    generate(args.db, args.count)
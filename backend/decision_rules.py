@@ -0,0 +1,134 @@
+"""
+Regras locais para as decisões automáticas dos nós ACTION com "options".
+
+Em vez de perguntar ao LLM, o nó declara regras avaliadas sobre os dados da
+sessão (inclusive o que foi obtido no mesmo turno, como debt_info):
+
+    "verificar_necessidade_api": {
+      "type": "ACTION",
+      "options": {"consultar_score": "api_consultar_score", "prosseguir_direto": "capturar_nome"},
+      "rules": [
+        {"when": {"debt_info.score": {"exists": false}, "debt_info.valor": {"gte": 500}}, "then": "consultar_score"}
+      ],
+      "default": "prosseguir_direto",
+      "llm_fallback": false
+    }
+
+Cada regra tem "when" (todas as condições precisam valer) ou "any" (lista de
+"when", basta um valer) e "then" (uma chave de options). A primeira regra que
+casar decide. Sem regra aplicável, o LLM só é consultado se o nó pedir
+("llm_fallback": true); caso contrário vale "default" (ou a primeira opção).
+"""
+from metrics import REGISTRY
+
+AUTO_DECISIONS = REGISTRY.counter(
+    "voicebot_auto_decisions_total",
+    "Decisões automáticas dos nós ACTION por origem (rule, default, llm)",
+    ["node", "source"],
+)
+
+_MISSING = object()
+
+OPERATORS = {
+    "eq": lambda value, arg: value == arg,
+    "ne": lambda value, arg: value != arg,
+    "lt": lambda value, arg: value is not None and value < arg,
+    "lte": lambda value, arg: value is not None and value <= arg,
+    "gt": lambda value, arg: value is not None and value > arg,
+    "gte": lambda value, arg: value is not None and value >= arg,
+    "in": lambda value, arg: value in arg,
+    "not_in": lambda value, arg: value not in arg,
+}
+
+
+def resolve(context, path):
+    """Valor de um caminho com pontos (ex: debt_info.score) no contexto; _MISSING se não existir."""
+    value = context
+    for key in path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return _MISSING
+        value = value[key]
+    return value
+
+
+def matches(when, context):
+    for path, condition in when.items():
+        value = resolve(context, path)
+        # Valor literal equivale a {"eq": valor}
+        if not isinstance(condition, dict):
+            condition = {"eq": condition}
+        for op, arg in condition.items():
+            if op == "exists":
+                if (value is not _MISSING and value is not None) != bool(arg):
+                    return False
+                continue
+            if value is _MISSING:
+                return False
+            try:
+                if not OPERATORS[op](value, arg):
+                    return False
+            except TypeError:
+                # Tipos incomparáveis (ex: texto vs número) não casam
+                return False
+    return True
+
+
+def decide(node_id, node, context):
+    """
+    Escolhe o próximo nó de uma decisão automática sem chamar o LLM.
+    Retorna (próximo nó, origem) ou (None, "llm") quando o nó pede o LLM como fallback;
+    nesse caso quem consulta o LLM registra a decisão com resolve_llm().
+    """
+    options = node["options"]
+    for rule in node.get("rules", []):
+        alternatives = rule.get("any") or [rule.get("when", {})]
+        if any(matches(when, context) for when in alternatives):
+            AUTO_DECISIONS.inc(node=node_id, source="rule")
+            return options[rule["then"]], "rule"
+    if node.get("llm_fallback"):
+        return None, "llm"
+    AUTO_DECISIONS.inc(node=node_id, source="default")
+    return default_option(node), "default"
+
+
+def default_option(node):
+    default = node.get("default")
+    options = node["options"]
+    return options[default] if default else next(iter(options.values()))
+
+
+def resolve_llm(node_id, node, decided):
+    """
+    Valida a escolha do LLM (um dos destinos do nó) e registra a origem real da decisão.
+    Resposta inválida ou erro do LLM (que devolve o próprio nó) cai no default.
+    """
+    if decided in node["options"].values():
+        AUTO_DECISIONS.inc(node=node_id, source="llm")
+        return decided, "llm"
+    AUTO_DECISIONS.inc(node=node_id, source="default")
+    return default_option(node), "default"
+
+
+def validate_rules(node_id, node):
+    """Erros de definição das regras de um nó (usado na validação do fluxo)."""
+    errors = []
+    options = node.get("options") or {}
+    rules = node.get("rules", [])
+    if not isinstance(rules, list):
+        return [f"{node_id}: 'rules' deve ser uma lista"]
+    for i, rule in enumerate(rules):
+        if rule.get("then") not in options:
+            errors.append(f"{node_id}: regra {i} aponta para opção inexistente '{rule.get('then')}'")
+        alternatives = rule.get("any") or [rule.get("when")]
+        for when in alternatives:
+            if not isinstance(when, dict) or not when:
+                errors.append(f"{node_id}: regra {i} sem condições ('when' ou 'any')")
+                continue
+            for path, condition in when.items():
+                if isinstance(condition, dict):
+                    unknown = set(condition) - set(OPERATORS) - {"exists"}
+                    if unknown:
+                        errors.append(f"{node_id}: regra {i} usa operador desconhecido {sorted(unknown)} em '{path}'")
+    if node.get("default") is not None and node["default"] not in options:
+        errors.append(f"{node_id}: default '{node['default']}' não é uma opção")
+    return errors
@@ -0,0 +1,277 @@
+"""
+Extratores locais e determinísticos para os nós INPUT.
+
+O nó declara o tipo do dado esperado e a fala do usuário é interpretada aqui,
+sem chamar o LLM; ele só é usado quando a extração falha:
+
+    "capturar_cpf":       {"type": "INPUT", "extract": {"type": "cpf"}, ...}
+    "informar_parcelas":  {"type": "INPUT", "extract": {"type": "integer"}, ...}
+    "informar_nova_data": {"type": "INPUT", "extract": {"type": "date"}, ...}
+
+Tipos:
+    cpf      -> 11 dígitos (falados ou escritos) com dígitos verificadores válidos
+    integer  -> número inteiro em algarismos ou por extenso ("três vezes", "vinte e quatro")
+    date     -> data absoluta ou relativa em pt-BR ("15/11", "dia 5 do mês que vem",
+                "amanhã", "daqui a duas semanas", "próxima sexta"), em ISO (AAAA-MM-DD)
+"""
+import re
+import calendar
+import unicodedata
+from datetime import date, timedelta
+
+from metrics import REGISTRY
+
+EXTRACTIONS = REGISTRY.counter(
+    "voicebot_extractions_total",
+    "Extrações locais nos nós INPUT por tipo e resultado (hit, miss)",
+    ["type", "result"],
+)
+
+
+def normalize(text):
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+# --- Números por extenso ---
+
+UNITS = {
+    "zero": 0, "um": 1, "uma": 1, "dois": 2, "duas": 2, "tres": 3, "quatro": 4, "cinco": 5,
+    "seis": 6, "meia": 6, "sete": 7, "oito": 8, "nove": 9, "dez": 10, "onze": 11, "doze": 12,
+    "treze": 13, "quatorze": 14, "catorze": 14, "quinze": 15, "dezesseis": 16, "dezasseis": 16,
+    "dezessete": 17, "dezoito": 18, "dezenove": 19,
+}
+TENS = {"vinte": 20, "trinta": 30, "quarenta": 40, "cinquenta": 50, "sessenta": 60,
+        "setenta": 70, "oitenta": 80, "noventa": 90}
+HUNDREDS = {"cem": 100, "cento": 100, "duzentos": 200, "duzentas": 200, "trezentos": 300,
+            "trezentas": 300, "quatrocentos": 400, "quatrocentas": 400, "quinhentos": 500,
+            "quinhentas": 500, "seiscentos": 600, "seiscentas": 600, "setecentos": 700,
+            "setecentas": 700, "oitocentos": 800, "oitocentas": 800, "novecentos": 900, "novecentas": 900}
+NUMBER_WORDS = {**UNITS, **TENS, **HUNDREDS}
+ORDINALS = {"primeiro": 1, "primeira": 1}
+
+# Palavras que indicam que o número é a quantidade pedida (e não um artigo "um/uma")
+COUNT_UNITS = ("x", "vez", "vezes", "parcela", "parcelas", "prestacao", "prestacoes", "mes", "meses")
+
+
+def _tokens(text):
+    return re.findall(r"\d+|[a-z]+", normalize(text))
+
+
+def _read_numbers(tokens):
+    """Números (valor, posição inicial, posição final) numa lista de tokens, juntando "vinte e quatro" etc."""
+    numbers = []
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token.isdigit():
+            numbers.append((int(token), i, i + 1))
+            i += 1
+            continue
+        if token not in NUMBER_WORDS and token != "mil":
+            i += 1
+            continue
+        total, current, start = 0, 0, i
+        last_value = None
+        while i < len(tokens):
+            token = tokens[i]
+            if token in NUMBER_WORDS:
+                value = NUMBER_WORDS[token]
+                # "vinte e quatro" soma; "três quatro" são dois números distintos
+                if last_value is not None and value >= last_value:
+                    break
+                current += value
+                # Só centenas e dezenas redondas podem ser seguidas de um número menor
+                last_value = value if value >= 20 else 0
+                i += 1
+            elif token == "mil":
+                total += (current or 1) * 1000
+                current, last_value = 0, 1000
+                i += 1
+            elif token == "e" and i + 1 < len(tokens) and tokens[i + 1] in NUMBER_WORDS and last_value is not None:
+                i += 1
+            else:
+                break
+        numbers.append((total + current, start, i))
+    return numbers
+
+
+def extract_integer(text, config=None):
+    # "3x" vira os tokens "3", "x"
+    tokens = _tokens(text)
+    numbers = _read_numbers(tokens)
+    if not numbers:
+        return None
+    for value, _, end in numbers:
+        if end < len(tokens) and tokens[end] in COUNT_UNITS:
+            return str(value)
+    # Sem unidade explícita: ignora "um/uma" que provavelmente é artigo ("um parcelamento em seis")
+    for value, start, end in numbers:
+        if not (end - start == 1 and tokens[start] in ("um", "uma")):
+            return str(value)
+    # Só "um/uma" sem unidade ("um boleto", "um momento") é ambíguo: fica para o LLM
+    return None
+
+
+# --- CPF ---
+
+DIGIT_WORDS = {"zero": "0", "um": "1", "uma": "1", "dois": "2", "duas": "2", "tres": "3", "quatro": "4",
+               "cinco": "5", "seis": "6", "meia": "6", "sete": "7", "oito": "8", "nove": "9"}
+
+
+def cpf_is_valid(cpf):
+    if len(cpf) != 11 or not cpf.isdigit() or cpf == cpf[0] * 11:
+        return False
+    digits = [int(d) for d in cpf]
+    for size in (9, 10):
+        total = sum(d * w for d, w in zip(digits[:size], range(size + 1, 1, -1)))
+        check = (total * 10) % 11 % 10
+        if digits[size] != check:
+            return False
+    return True
+
+
+def extract_cpf(text, config=None):
+    """CPF falado dígito a dígito ("um dois três...") ou escrito, com ou sem pontuação."""
+    check = (config or {}).get("check_digits", True)
+    runs, current = [], ""
+    for token in _tokens(text):
+        if token.isdigit() or token in DIGIT_WORDS:
+            current += token if token.isdigit() else DIGIT_WORDS[token]
+        elif token not in ("ponto", "traco", "hifen", "barra"):
+            runs.append(current)
+            current = ""
+    runs.append(current)
+    for run in runs:
+        # Sequências maiores que 11 dígitos: procura uma janela com dígitos verificadores válidos
+        windows = [run] if len(run) == 11 else [run[i:i + 11] for i in range(len(run) - 10)] if check else []
+        for candidate in windows:
+            if len(candidate) == 11 and (not check or cpf_is_valid(candidate)):
+                return candidate
+    return None
+
+
+# --- Datas ---
+
+MONTHS = {"janeiro": 1, "fevereiro": 2, "marco": 3, "abril": 4, "maio": 5, "junho": 6, "julho": 7,
+          "agosto": 8, "setembro": 9, "outubro": 10, "novembro": 11, "dezembro": 12}
+WEEKDAYS = {"segunda": 0, "terca": 1, "quarta": 2, "quinta": 3, "sexta": 4, "sabado": 5, "domingo": 6}
+
+
+def _add_months(day, months, target_day=None):
+    month_index = day.month - 1 + months
+    year, month = day.year + month_index // 12, month_index % 12 + 1
+    target_day = target_day or day.day
+    return date(year, month, min(target_day, calendar.monthrange(year, month)[1]))
+
+
+def _spoken_day(tokens, start):
+    """Dia do mês a partir de tokens[start:] ("15", "quinze", "primeiro", "vinte e cinco")."""
+    if start >= len(tokens):
+        return None
+    if tokens[start] in ORDINALS:
+        return ORDINALS[tokens[start]]
+    numbers = _read_numbers(tokens[start:])
+    if numbers and numbers[0][1] == 0 and 1 <= numbers[0][0] <= 31:
+        return numbers[0][0]
+    return None
+
+
+def extract_date(text, config=None, today=None):
+    today = today or date.today()
+    norm = normalize(text)
+    tokens = _tokens(text)
+
+    # dd/mm[/aaaa] ou dd-mm[-aaaa]
+    match = re.search(r"\b(\d{1,2})[/\-.](\d{1,2})(?:[/\-.](\d{2,4}))?\b", norm)
+    if match:
+        day, month = int(match.group(1)), int(match.group(2))
+        year = int(match.group(3)) if match.group(3) else today.year
+        if year < 100:
+            year += 2000
+        try:
+            result = date(year, month, day)
+        except ValueError:
+            return None
+        if not match.group(3) and result < today:
+            result = date(year + 1, month, day)
+        return result.isoformat()
+
+    if "depois de amanha" in norm:
+        return (today + timedelta(days=2)).isoformat()
+    if "amanha" in norm:
+        return (today + timedelta(days=1)).isoformat()
+    if re.search(r"\bhoje\b", norm):
+        return today.isoformat()
+    if re.search(r"\b(fim|final) do mes\b", norm):
+        return date(today.year, today.month, calendar.monthrange(today.year, today.month)[1]).isoformat()
+
+    # "daqui a 10 dias", "em duas semanas", "daqui a um mês"
+    for value, start, end in _read_numbers(tokens):
+        if end < len(tokens):
+            unit = tokens[end]
+            if unit in ("dia", "dias"):
+                # "dia 15" é data absoluta; "15 dias" é relativa
+                if start == 0 or tokens[start - 1] != "dia":
+                    return (today + timedelta(days=value)).isoformat()
+            elif unit in ("semana", "semanas"):
+                return (today + timedelta(weeks=value)).isoformat()
+            elif unit in ("mes", "meses"):
+                return _add_months(today, value).isoformat()
+    if re.search(r"\b(semana que vem|proxima semana)\b", norm):
+        return (today + timedelta(weeks=1)).isoformat()
+
+    # "15 de novembro", "quinze de novembro [de 2026]", "primeiro de dezembro"
+    days = [(ORDINALS[t], i, i + 1) for i, t in enumerate(tokens) if t in ORDINALS] + _read_numbers(tokens)
+    for day, _, end in sorted(days, key=lambda item: item[1]):
+        if end + 1 < len(tokens) and tokens[end] == "de" and tokens[end + 1] in MONTHS:
+            month = MONTHS[tokens[end + 1]]
+            explicit_year = end + 3 < len(tokens) and tokens[end + 2] == "de" and tokens[end + 3].isdigit()
+            year = int(tokens[end + 3]) if explicit_year else today.year
+            try:
+                result = date(year, month, day)
+                if result < today and not explicit_year:
+                    result = date(year + 1, month, day)
+            except ValueError:
+                return None
+            return result.isoformat()
+
+    # "próxima sexta", "na segunda-feira"
+    for token in tokens:
+        if token in WEEKDAYS:
+            ahead = (WEEKDAYS[token] - today.weekday()) % 7 or 7
+            return (today + timedelta(days=ahead)).isoformat()
+
+    # "dia 15", "dia quinze do mês que vem", "no dia primeiro"
+    for i, token in enumerate(tokens):
+        if token == "dia":
+            day = _spoken_day(tokens, i + 1)
+            if not day:
+                continue
+            if re.search(r"\b(mes que vem|proximo mes)\b", norm):
+                return _add_months(today, 1, day).isoformat()
+            result = _add_months(today, 0, day)
+            if result <= today:
+                result = _add_months(today, 1, day)
+            return result.isoformat()
+    return None
+
+
+EXTRACTORS = {
+    "cpf": extract_cpf,
+    "integer": extract_integer,
+    "date": extract_date,
+}
+
+
+def extract_for_node(node, text, record=True):
+    """Valor extraído localmente conforme o "extract" do nó INPUT, ou None se não houver/não for possível."""
+    config = node.get("extract")
+    if not config:
+        return None
+    if isinstance(config, str):
+        config = {"type": config}
+    value = EXTRACTORS[config["type"]](text or "", config)
+    if record:
+        EXTRACTIONS.inc(type=config["type"], result="hit" if value is not None else "miss")
+    return value
@@ -0,0 +1,193 @@
+"""
+Fluxos versionados com recarga a quente.
+
+O fluxo ativo vem de um arquivo JSON/YAML (flow_data.FLOW_FILE). Quando o
+arquivo muda, a nova versão é validada e compilada (FlowIndex), as frases
+estáticas que ela introduz são pré-sintetizadas em segundo plano e só então
+ela substitui a anterior, numa única atribuição. Cada sessão fixa a versão
+com que começou (session_data["flow_version"]) e a mantém até o fim da
+conversa, então a troca não afeta chamadas em andamento.
+"""
+import os
+import json
+import time
+import asyncio
+import hashlib
+
+import tree_service
+import decision_rules
+import extractors
+from flow_data import FLOW_FILE, load_flow_file
+from metrics import REGISTRY
+
+# Intervalo (s) da verificação de alterações no arquivo do fluxo; 0 desliga a recarga automática
+FLOW_RELOAD_INTERVAL = float(os.getenv("FLOW_RELOAD_INTERVAL", "2"))
+
+FLOW_RELOADS = REGISTRY.counter(
+    "voicebot_flow_reloads_total",
+    "Tentativas de recarga do fluxo por resultado (swapped, unchanged, invalid)",
+    ["result"],
+)
+
+NODE_TYPES = ("START", "INPUT", "INFO", "ACTION", "API", "INTENT", "DECISION",
+              "VALIDATION", "CONFIRMATION", "END_SUCCESS", "END_FAIL")
+# Campos que apontam para outros nós
+TARGET_FIELDS = ("next", "on_success", "on_fail", "on_available", "on_unavailable")
+TEMPLATE_VARS = set(tree_service.get_template_vars({}))
+
+
+class FlowValidationError(Exception):
+    """Definição de fluxo inválida; errors lista todos os problemas encontrados."""
+
+    def __init__(self, errors):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+
+def validate_flow(flow):
+    """Confere estrutura, tipos de nó, destinos e variáveis de template. Levanta FlowValidationError."""
+    errors = []
+    if not isinstance(flow, dict):
+        raise FlowValidationError(["o fluxo deve ser um objeto"])
+    nodes = flow.get("nodes")
+    if not isinstance(nodes, dict) or not nodes:
+        raise FlowValidationError(["'nodes' ausente ou vazio"])
+    if not flow.get("flow_id"):
+        errors.append("'flow_id' ausente")
+    if flow.get("start_node") not in nodes:
+        errors.append(f"start_node '{flow.get('start_node')}' não existe")
+
+    for node_id, node in nodes.items():
+        node_type = node.get("type")
+        if node_type not in NODE_TYPES:
+            errors.append(f"{node_id}: tipo desconhecido '{node_type}'")
+        targets = [node[field] for field in TARGET_FIELDS if node.get(field)]
+        for field in ("options", "intents"):
+            if field in node:
+                if not isinstance(node[field], dict) or not node[field]:
+                    errors.append(f"{node_id}: '{field}' deve ser um objeto não vazio")
+                    continue
+                targets.extend(node[field].values())
+        for target in targets:
+            if target not in nodes:
+                errors.append(f"{node_id}: destino '{target}' não existe")
+        if node_type == "VALIDATION" and not (node.get("on_success") and node.get("on_fail")):
+            errors.append(f"{node_id}: VALIDATION exige on_success e on_fail")
+        if node_type in ("INTENT", "DECISION") and not (node.get("intents") or node.get("options")):
+            errors.append(f"{node_id}: {node_type} exige intents ou options")
+        # Em VALIDATION, "rules" são os limites do valor; regras de decisão só existem com "options"
+        if "options" in node and ("rules" in node or "default" in node):
+            errors.extend(decision_rules.validate_rules(node_id, node))
+        if node_type == "INPUT" and not node.get("next"):
+            errors.append(f"{node_id}: INPUT exige next")
+        if "extract" in node:
+            extract = node["extract"]
+            extract_type = extract if isinstance(extract, str) else extract.get("type") if isinstance(extract, dict) else None
+            if extract_type not in extractors.EXTRACTORS:
+                errors.append(f"{node_id}: extrator desconhecido '{extract_type}' (use {', '.join(extractors.EXTRACTORS)})")
+        for kind, value in tree_service.compile_message(node.get("message", "")):
+            if kind == "dynamic" and value not in TEMPLATE_VARS:
+                errors.append(f"{node_id}: variável de template desconhecida '{{{{{value}}}}}'")
+    if errors:
+        raise FlowValidationError(errors)
+
+
+class FlowVersion:
+    """Uma versão imutável do fluxo, já validada e compilada."""
+
+    def __init__(self, flow, source=None):
+        validate_flow(flow)
+        self.flow = flow
+        self.source = source
+        self.digest = hashlib.sha1(json.dumps(flow, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+        self.version = f"{flow.get('version', '0')}-{self.digest[:8]}"
+        self.flow_id = flow["flow_id"]
+        self.index = tree_service.FlowIndex(flow)
+        self.loaded_at = time.time()
+        self.static_texts = {
+            text for parts in self.index.parts.values() for kind, text in parts
+            if kind == "static" and text.strip()
+        }
+
+    def describe(self):
+        return {"flow_id": self.flow_id, "version": self.version, "source": self.source,
+                "nodes": len(self.flow["nodes"]), "loaded_at": self.loaded_at}
+
+
+class FlowRegistry:
+    """
+    Mantém a versão ativa do fluxo e recarrega o arquivo quando ele muda.
+
+    prewarm(texts) é a corrotina que garante o áudio das frases estáticas novas
+    antes da troca (no main.py, a síntese para o cache persistente).
+    """
+
+    def __init__(self, path=FLOW_FILE, prewarm=None):
+        self.path = path
+        self.prewarm = prewarm
+        self._mtime = os.path.getmtime(path)
+        self._lock = asyncio.Lock()
+        self._current = None
+
+    @property
+    def current(self):
+        """Versão ativa. A inicial (o fluxo carregado pelo tree_service) é validada e compilada no primeiro acesso."""
+        if self._current is None:
+            self._activate(FlowVersion(tree_service.TREE_FLOW_DATA, self.path))
+        return self._current
+
+    def _activate(self, version):
+        self._current = version
+        # Sessões sem versão fixada (e ferramentas como bench/simulator) usam os globais do tree_service
+        tree_service.TREE_FLOW_DATA = version.flow
+        tree_service.FLOW_INDEX = version.index
+
+    def pin(self, session_data):
+        """Fixa a versão ativa na sessão (início de conversa)."""
+        session_data["flow_version"] = self.current
+        return self.current
+
+    async def reload(self):
+        """Recarrega o arquivo; retorna a nova versão ativa ou None se nada mudou."""
+        async with self._lock:
+            self._mtime = os.path.getmtime(self.path)
+            try:
+                flow = await asyncio.to_thread(load_flow_file, self.path)
+                version = await asyncio.to_thread(FlowVersion, flow, self.path)
+            except Exception as e:
+                FLOW_RELOADS.inc(result="invalid")
+                print(f"[FLOW] Nova versão de {self.path} rejeitada, mantendo {self.current.version}: {e}")
+                if isinstance(e, FlowValidationError):
+                    raise
+                raise FlowValidationError([f"não foi possível ler o arquivo: {e}"]) from e
+            if version.digest == self.current.digest:
+                FLOW_RELOADS.inc(result="unchanged")
+                return None
+
+            new_texts = version.static_texts - self.current.static_texts
+            if new_texts and self.prewarm:
+                start = time.time()
+                await self.prewarm(sorted(new_texts))
+                print(f"[FLOW] {len(new_texts)} frases novas pré-sintetizadas em {time.time() - start:.2f}s")
+            previous = self.current
+            self._activate(version)
+            FLOW_RELOADS.inc(result="swapped")
+            print(f"[FLOW] Fluxo '{version.flow_id}' trocado: {previous.version} -> {version.version}")
+            return version
+
+    async def watch(self, interval=FLOW_RELOAD_INTERVAL):
+        """Verifica periodicamente o arquivo do fluxo e recarrega quando ele muda."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                changed = os.path.getmtime(self.path) != self._mtime
+            except OSError:
+                continue  # arquivo momentaneamente ausente (editor salvando)
+            if not changed:
+                continue
+            try:
+                await self.reload()
+            except FlowValidationError:
+                pass  # já registrado em reload(); segue com a versão atual
+            except Exception as e:
+                print(f"[FLOW] Erro ao recarregar o fluxo: {e}")
@@ -0,0 +1,116 @@
+"""
+Protocolo compacto do /ws: eventos e áudio agrupados em mensagens binárias.
+
+No protocolo padrão cada evento vai numa mensagem JSON e cada áudio numa
+mensagem binária (um turno da árvore = 3 mensagens). Com o protocolo compacto,
+negociado na conexão, o servidor junta os quadros de um mesmo trecho (texto,
+áudio e fim do turno) numa única mensagem binária.
+
+O cliente escolhe o protocolo pelo subprotocolo do WebSocket
+(Sec-WebSocket-Protocol: voicebot.frames.v1) ou, onde não puder enviar o
+cabeçalho, pelo parâmetro ?protocol=voicebot.frames.v1. Sem nenhum dos dois
+a conexão continua no protocolo padrão.
+
+Cada quadro tem um cabeçalho de 10 bytes (big-endian) seguido do conteúdo:
+
+    tipo (1 byte)    1 = evento JSON (UTF-8), 2 = áudio no formato negociado
+    flags (1 byte)   bit 0 = conteúdo comprimido com deflate puro (RFC 1951)
+    seq (4 bytes)    número de sequência por conexão, começa em 0
+    tamanho (4 bytes)
+
+Os quadros chegam em ordem de seq; um salto indica mensagem perdida. Com
+voicebot.frames-deflate.v1, eventos JSON maiores que COMPRESS_MIN_BYTES são
+comprimidos um a um (o áudio já é comprimido e vai como está).
+"""
+import os
+import json
+import zlib
+import struct
+
+from metrics import REGISTRY
+
+FRAME_JSON = 1
+FRAME_AUDIO = 2
+FLAG_DEFLATE = 0x01
+
+HEADER = struct.Struct("!BBII")
+
+# Subprotocolo -> comprime eventos JSON
+PROTOCOLS = {
+    "voicebot.frames.v1": False,
+    "voicebot.frames-deflate.v1": True,
+}
+
+# Eventos curtos ficam maiores comprimidos: só comprime a partir deste tamanho
+COMPRESS_MIN_BYTES = int(os.getenv("WS_COMPRESS_MIN_BYTES", "256"))
+
+MESSAGES = REGISTRY.counter(
+    "voicebot_ws_messages_total",
+    "Mensagens enviadas pelo /ws por protocolo (json = padrão, frames = compacto)",
+    ["protocol"],
+)
+FRAMES = REGISTRY.counter("voicebot_ws_frames_total", "Quadros enviados no protocolo compacto por tipo", ["kind"])
+
+
+def negotiate(subprotocols, requested=None):
+    """
+    Protocolo compacto pedido pelo cliente: o primeiro subprotocolo suportado ou o parâmetro ?protocol=.
+    Retorna (nome, veio_do_cabeçalho) ou (None, False) para o protocolo padrão.
+    """
+    for name in subprotocols or []:
+        if name in PROTOCOLS:
+            return name, True
+    if requested in PROTOCOLS:
+        return requested, False
+    return None, False
+
+
+class FrameWriter:
+    """Acumula os quadros de uma conexão até o próximo envio; um por conexão (não é thread-safe)."""
+
+    def __init__(self, protocol):
+        self.protocol = protocol
+        self.compress = PROTOCOLS[protocol]
+        self.seq = 0
+        self.pending = []
+
+    def add(self, payload):
+        """Enfileira um evento (dict) ou áudio (bytes) como um quadro."""
+        flags = 0
+        if isinstance(payload, bytes):
+            kind, data = FRAME_AUDIO, payload
+        else:
+            kind = FRAME_JSON
+            data = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            if self.compress and len(data) >= COMPRESS_MIN_BYTES:
+                compressor = zlib.compressobj(wbits=-15)
+                packed = compressor.compress(data) + compressor.flush()
+                if len(packed) < len(data):
+                    data, flags = packed, FLAG_DEFLATE
+        self.pending.append(HEADER.pack(kind, flags, self.seq, len(data)))
+        self.pending.append(data)
+        self.seq = (self.seq + 1) & 0xFFFFFFFF
+        FRAMES.inc(kind="audio" if kind == FRAME_AUDIO else "json")
+
+    def take(self):
+        """Mensagem binária com os quadros acumulados (None se não houver nenhum)."""
+        if not self.pending:
+            return None
+        message = b"".join(self.pending)
+        self.pending = []
+        return message
+
+
+def decode(message):
+    """Quadros de uma mensagem binária como (seq, evento dict ou áudio bytes). Usado por clientes Python."""
+    frames = []
+    offset = 0
+    while offset < len(message):
+        kind, flags, seq, length = HEADER.unpack_from(message, offset)
+        offset += HEADER.size
+        data = message[offset:offset + length]
+        offset += length
+        if flags & FLAG_DEFLATE:
+            data = zlib.decompress(data, wbits=-15)
+        frames.append((seq, json.loads(data) if kind == FRAME_JSON else data))
+    return frames
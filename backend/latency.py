@@ -0,0 +1,39 @@
+"""
+Distribuições de latência simulada, descritas por uma string "tipo:param1:param2".
+
+Formatos aceitos: "const:s", "uniform:min:max", "normal:media:desvio" e
+"lognormal:mediana:sigma" (segundos). Usado pelos simuladores (stubs.py) e
+pelas falhas injetadas da API Mock (mock_api.py); não importa nada do backend.
+"""
+import os
+import math
+import random
+
+
+class Latency:
+    """Distribuição de latência parametrizada por uma string "tipo:param1:param2"."""
+
+    def __init__(self, spec):
+        self.spec = spec
+        kind, *params = spec.split(":")
+        self.kind = kind
+        self.params = [float(p) for p in params]
+        expected = {"const": 1, "uniform": 2, "normal": 2, "lognormal": 2}
+        if kind not in expected or len(self.params) != expected[kind]:
+            raise ValueError(f"Distribuição de latência inválida: {spec!r}")
+
+    def sample(self):
+        if self.kind == "const":
+            value = self.params[0]
+        elif self.kind == "uniform":
+            value = random.uniform(*self.params)
+        elif self.kind == "normal":
+            value = random.gauss(*self.params)
+        else:
+            median, sigma = self.params
+            value = random.lognormvariate(math.log(median), sigma) if median > 0 else 0.0
+        return max(0.0, value)
+
+    @classmethod
+    def from_env(cls, name, default):
+        return cls(os.getenv(name, default))
@@ -1,15 +1,11 @@
-import os
 import json
 import time
-import httpx
-from openai import OpenAI
-from dotenv import load_dotenv
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+import clients
+from metrics import span, STAGE_SECONDS
+from context_window import ConversationContext, MAX_SUMMARY_TOKENS
 
-# Carrega as variáveis do arquivo .env
-load_dotenv()
-
-# Configuração da OpenAI
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 SYSTEM_PROMPT = """
 Você é um atendente telefônico de cobrança brasileiro profissional.
@@ -33,14 +29,40 @@ FERRAMENTAS:
 - `fechar_acordo`: Registra o fechamento do acordo.
 """
 
+SUMMARY_PROMPT = """
+Você resume conversas de cobrança para o atendente continuar o atendimento.
+Atualize o resumo com os novos trechos em até 80 palavras, em Português Brasileiro.
+Mantenha sempre: CPF, nome do cliente, valor e empresa da dívida, dificuldades relatadas,
+propostas feitas e o que foi aceito ou recusado. Não invente informações.
+"""
+
+def summarize_history(summary, messages):
+    """Incorpora mensagens antigas do histórico ao resumo da conversa (chamado em segundo plano)."""
+    lines = []
+    for msg in messages:
+        if msg["role"] == "tool":
+            lines.append(f"Resultado de {msg['name']}: {msg['content']}")
+        elif msg.get("text"):
+            lines.append(f"{'Cliente' if msg['role'] == 'user' else 'Atendente'}: {msg['text']}")
+    with span("llm", "summary"):
+        response = clients.openai().chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": f"Resumo atual: {summary or '(vazio)'}\n\nNovos trechos:\n" + "\n".join(lines)},
+            ],
+            max_tokens=MAX_SUMMARY_TOKENS,
+        )
+    return response.choices[0].message.content or summary
+
 def get_debt_info(cpf: str):
-    """Consulta informações de dívida na API Mock."""
-    clean_cpf = "".join(filter(str.isdigit, cpf))
+    """Consulta informações de dívida na API Mock, pelo cliente compartilhado (clients.debt_api)."""
+    clean_cpf = "".join(filter(str.isdigit, cpf or ""))
     try:
-        with httpx.Client() as h_client:
-            response = h_client.get(f"http://localhost:8001/debts/{clean_cpf}", timeout=2.0)
-            if response.status_code == 200:
-                return response.json()
+        with span("debt_lookup"):
+            response = clients.debt_api().get(f"/debts/{clean_cpf}")
+        if response.status_code == 200:
+            return response.json()
     except Exception as e:
         print(f"[LLM-TOOL ERROR] {e}")
     return {"error": "Não foi possível localizar os dados para este CPF."}
@@ -50,6 +72,54 @@ def fechar_acordo(cpf: str, condicao: str):
     print(f"[LLM-TOOL] ACORDO FECHADO: CPF {cpf} em condição {condicao}")
     return {"status": "sucesso", "mensagem": "Acordo registrado com sucesso!"}
 
+TOOL_FUNCTIONS = {
+    "get_debt_info": get_debt_info,
+    "fechar_acordo": fechar_acordo,
+}
+
+# Ferramentas de um mesmo turno rodam em paralelo (o gerador do LLM já está numa thread, fora do event loop)
+TOOL_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="tools")
+
+def execute_tool_calls(tool_calls):
+    """
+    Executa as chamadas de ferramenta do turno (bloqueante); as consultas usam o cliente HTTP
+    compartilhado, que reaproveita as conexões. Retorna os resultados na mesma ordem.
+    """
+    def run(call):
+        name = call["function"]["name"]
+        try:
+            args = json.loads(call["function"]["arguments"] or "{}")
+        except json.JSONDecodeError:
+            return {"error": "Argumentos inválidos."}
+        print(f"[TOOL_CALL] Função: {name} | Argumentos: {args}")
+        if name not in TOOL_FUNCTIONS:
+            return {"error": f"Ferramenta desconhecida: {name}"}
+        try:
+            result = TOOL_FUNCTIONS[name](**args)
+        except TypeError as e:
+            result = {"error": f"Argumentos inválidos: {e}"}
+        print(f"[TOOL_RESULT] {name}: {result}\n")
+        return result
+
+    with span("tools", str(len(tool_calls))):
+        if len(tool_calls) == 1:
+            return [run(tool_calls[0])]
+        # Cada thread leva uma cópia do contexto para os spans entrarem no trace do turno
+        futures = [TOOL_EXECUTOR.submit(contextvars.copy_context().run, run, call) for call in tool_calls]
+        return [future.result() for future in futures]
+
+def merge_tool_call_deltas(pending, deltas):
+    """Acumula os fragmentos de tool_calls do stream (id, nome e argumentos chegam em pedaços, por índice)."""
+    for delta in deltas:
+        call = pending.setdefault(delta.index, {"id": "", "type": "function", "function": {"name": "", "arguments": ""}})
+        if delta.id:
+            call["id"] = delta.id
+        if delta.function:
+            if delta.function.name:
+                call["function"]["name"] += delta.function.name
+            if delta.function.arguments:
+                call["function"]["arguments"] += delta.function.arguments
+
 tools = [
     {
         "type": "function",
@@ -82,111 +152,91 @@ tools = [
     }
 ]
 
-def generate_reply_stream(text, history=[]):
-    if not os.getenv("OPENAI_API_KEY"):
+def stream_sentences(response, request_start, pending_calls=None):
+    """Entrega o texto do stream em frases; fragmentos de tool_calls vão para pending_calls."""
+    sentence = ""
+    first_token = True
+    for chunk in response:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if getattr(delta, "tool_calls", None) and pending_calls is not None:
+            merge_tool_call_deltas(pending_calls, delta.tool_calls)
+        if delta.content:
+            if first_token:
+                # Tempo até o primeiro token (TTFT), desde o envio da requisição
+                STAGE_SECONDS.observe(time.perf_counter() - request_start, stage="llm", detail="first_token")
+                first_token = False
+            sentence += delta.content
+            if any(punct in delta.content for punct in [".", "!", "?", ",", "\n"]):
+                if sentence.strip():
+                    yield sentence.strip()
+                    sentence = ""
+    if sentence.strip():
+        yield sentence.strip()
+
+def generate_reply_stream(text, history=[], context=None):
+    if not clients.openai_configured():
         yield "Erro: Chave da OpenAI não configurada."
         return
 
-    # Prepara as mensagens para a OpenAI
-    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
-    
-    # Converte o histórico para o formato da OpenAI
-    for msg in history[-10:]:
-        if "tool_calls" in msg:
-            # Garante que content seja None se estiver vazio para evitar erros na API
-            content = msg.get("text") or None
-            messages.append({"role": "assistant", "content": content, "tool_calls": msg["tool_calls"]})
-        elif msg["role"] == "tool":
-            messages.append({"role": "tool", "tool_call_id": msg["tool_call_id"], "name": msg["name"], "content": msg["content"]})
-        else:
-            role = "assistant" if msg["role"] in ["assistant", "ai"] else "user"
-            messages.append({"role": role, "content": msg["text"]})
-    
-    # Adiciona a mensagem atual do usuário
-    user_msg = {"role": "user", "content": text}
-    messages.append(user_msg)
+    # Prepara as mensagens para a OpenAI: resumo + turnos recentes dentro do orçamento de tokens
+    context = context or ConversationContext()
+    messages = context.build_messages(SYSTEM_PROMPT, history, text)
     
-    print(f"[LLM-CONTEXT] Enviando {len(messages)} mensagens no contexto.")
+    print(f"[LLM-CONTEXT] Enviando {len(messages)} mensagens no contexto (~{context.last_prompt_tokens} tokens).")
     
     # Adiciona ao histórico mutável para persistência (apenas se não for repetido)
     history.append({"role": "user", "text": text})
 
     try:
-        # 1. Primeira chamada para verificar se precisa de ferramenta
-        response = client.chat.completions.create(
+        # Uma única chamada em stream: o texto é falado assim que chega; tool_calls chegam como deltas
+        request_start = time.perf_counter()
+        response = clients.openai().chat.completions.create(
             model="gpt-4o-mini",
             messages=messages,
             tools=tools,
-            tool_choice="auto"
+            tool_choice="auto",
+            stream=True
         )
-        
-        response_message = response.choices[0].message
-        tool_calls = response_message.tool_calls
+        pending_calls = {}
+        full_ai_text = ""
+        for sentence in stream_sentences(response, request_start, pending_calls):
+            full_ai_text += sentence + " "
+            yield sentence
+
+        if pending_calls:
+            print(f"\n[TOOL_CALL] O Agente decidiu chamar {len(pending_calls)} função(ões)!")
+            tool_calls = [pending_calls[i] for i in sorted(pending_calls)]
 
-        if tool_calls:
-            print(f"\n[TOOL_CALL] O Agente decidiu chamar uma função!")
-            
             # Adiciona a chamada ao contexto e ao histórico
-            messages.append(response_message)
-            history.append({
-                "role": "assistant", 
-                "text": response_message.content, 
-                "tool_calls": [tc.model_dump() for tc in tool_calls]
-            })
-
-            for tool_call in tool_calls:
-                function_name = tool_call.function.name
-                function_args = json.loads(tool_call.function.arguments)
-                
-                tool_result = {}
-                if function_name == "get_debt_info":
-                    cpf = function_args.get('cpf')
-                    print(f"[TOOL_CALL] Função: {function_name} | Argumentos: {function_args}")
-                    tool_result = get_debt_info(cpf)
-                    print(f"[TOOL_RESULT] Resultado da API: {tool_result}\n")
-                elif function_name == "fechar_acordo":
-                    print(f"[TOOL_CALL] Função: {function_name} | Argumentos: {function_args}")
-                    tool_result = fechar_acordo(function_args.get("cpf"), function_args.get("condicao"))
-                    print(f"[TOOL_RESULT] Resultado: {tool_result}\n")
-
-                # Adiciona o resultado ao contexto e ao histórico
+            assistant_msg = {"role": "assistant", "content": full_ai_text.strip() or None, "tool_calls": tool_calls}
+            messages.append(assistant_msg)
+            history.append({"role": "assistant", "text": full_ai_text.strip() or None, "tool_calls": tool_calls})
+
+            results = execute_tool_calls(tool_calls)
+            for call, tool_result in zip(tool_calls, results):
                 tool_msg = {
-                    "tool_call_id": tool_call.id,
+                    "tool_call_id": call["id"],
                     "role": "tool",
-                    "name": function_name,
+                    "name": call["function"]["name"],
                     "content": json.dumps(tool_result)
                 }
                 messages.append(tool_msg)
                 history.append(tool_msg)
-            
-            # 2. Segunda chamada com o resultado da ferramenta (agora com stream)
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=messages,
-                stream=True
-            )
-        else:
-            response = client.chat.completions.create(
+
+            # Segunda chamada (em stream) com os resultados das ferramentas
+            request_start = time.perf_counter()
+            response = clients.openai().chat.completions.create(
                 model="gpt-4o-mini",
                 messages=messages,
                 stream=True
             )
+            full_ai_text = ""
+            for sentence in stream_sentences(response, request_start):
+                full_ai_text += sentence + " "
+                yield sentence
 
-        sentence = ""
-        full_ai_text = ""
-        for chunk in response:
-            if chunk.choices[0].delta.content:
-                content = chunk.choices[0].delta.content
-                sentence += content
-                full_ai_text += content
-                if any(punct in content for punct in [".", "!", "?", ",", "\n"]):
-                    if sentence.strip():
-                        yield sentence.strip()
-                        sentence = ""
-        
-        if sentence.strip():
-            yield sentence.strip()
-            
         # Adiciona a resposta final da IA ao histórico
         history.append({"role": "assistant", "text": full_ai_text.strip()})
             
@@ -0,0 +1,414 @@
+"""
+Gerador de carga: simula muitos clientes simultâneos conversando pelo /ws.
+
+Cada cliente abre uma conexão, escolhe o modo (árvore ou IA) e reproduz as falas
+de um cenário, medindo o tempo até o primeiro áudio e a duração de cada turno.
+Para rodar sem serviços externos, suba o backend com os simuladores locais
+(VOICE_BOT_STUBS=1, ver stubs.py) ou use --spawn-server.
+
+Exemplos:
+    python loadtest.py --spawn-server --callers 200 --concurrency 50
+    python loadtest.py --url ws://localhost:8000/ws --scenarios cenarios.json --audio-dir gravacoes/
+    python loadtest.py --spawn-server --callers 50 --fail-on-p95 3.0   # para CI
+    python loadtest.py --spawn-server --protocol voicebot.frames.v1    # protocolo compacto (framing.py)
+"""
+import os
+import io
+import sys
+import json
+import math
+import time
+import wave
+import random
+import signal
+import asyncio
+import hashlib
+import argparse
+import tempfile
+import subprocess
+
+import httpx
+import websockets
+
+import framing
+from stubs import fingerprint_pcm
+
+# Cenários padrão: conversas completas nos dois modos.
+# "audio" (opcional) aponta para uma gravação real relativa a --audio-dir.
+DEFAULT_SCENARIOS = [
+    {
+        "name": "arvore_parcelamento",
+        "mode": "tree",
+        "weight": 3,
+        "turns": [
+            {"text": "alô"},
+            {"text": "meu cpf é 12345678901"},
+            {"text": "quero negociar a minha dívida"},
+            {"text": "quero parcelar"},
+            {"text": "em 3 vezes"},
+            {"text": "sim pode confirmar"},
+        ],
+    },
+    {
+        "name": "arvore_consulta_valor",
+        "mode": "tree",
+        "weight": 1,
+        "turns": [
+            {"text": "bom dia"},
+            {"text": "o cpf é 98765432100"},
+            {"text": "quero consultar o valor"},
+            {"text": "quero quitar tudo à vista"},
+            {"text": "pode confirmar"},
+        ],
+    },
+    {
+        "name": "ia_negociacao",
+        "mode": "ai",
+        "weight": 2,
+        "turns": [
+            {"text": "alô, quem fala?"},
+            {"text": "meu cpf é 12345678901"},
+            {"text": "consigo pagar em algumas parcelas"},
+            {"text": "pode registrar o acordo"},
+        ],
+    },
+]
+
+
+def synthetic_wav(text, sample_rate=16000):
+    """Gera um WAV curto com ruído baixo, único para cada texto (substitui gravações ausentes)."""
+    rng = random.Random(hashlib.md5(text.encode()).hexdigest())
+    n_samples = int(sample_rate * max(0.6, len(text) * 0.06))
+    frames = bytearray()
+    for _ in range(n_samples):
+        frames += rng.randint(-300, 300).to_bytes(2, "little", signed=True)
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(bytes(frames))
+    return buffer.getvalue(), fingerprint_pcm(bytes(frames))
+
+
+def recorded_audio(path):
+    """Lê uma gravação e calcula a impressão digital do PCM do mesmo jeito que o servidor decodifica."""
+    from pydub import AudioSegment
+    with open(path, "rb") as f:
+        data = f.read()
+    return data, fingerprint_pcm(AudioSegment.from_file(path).raw_data)
+
+
+def prepare_utterances(scenarios, audio_dir, transcripts_path):
+    """Carrega/gera o áudio de cada fala e grava o manifesto de transcrições lido pelo STT simulado."""
+    utterances = {}
+    manifest = {}
+    for scenario in scenarios:
+        for turn in scenario["turns"]:
+            key = (turn["text"], turn.get("audio"))
+            if key in utterances:
+                continue
+            if turn.get("audio"):
+                audio, fingerprint = recorded_audio(os.path.join(audio_dir or ".", turn["audio"]))
+            else:
+                audio, fingerprint = synthetic_wav(turn["text"])
+            utterances[key] = audio
+            manifest[fingerprint] = turn["text"]
+    with open(transcripts_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    return utterances
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, math.ceil(p / 100 * len(ordered)) - 1)
+    return ordered[rank]
+
+
+class Busy(Exception):
+    """O servidor recusou o turno por falta de capacidade (controle de admissão)."""
+
+
+class Results:
+    def __init__(self):
+        self.turns = []           # (modo, segundos até ai_text_complete)
+        self.first_audio = []     # (modo, segundos até o primeiro áudio do turno)
+        self.call_first_audio = []
+        self.calls_completed = 0
+        self.calls_failed = 0
+        self.calls_rejected = 0
+        self.turns_rejected = 0
+        self.timeouts = 0
+        self.errors = []
+        self.audio_bytes = 0
+        self.messages = 0         # mensagens WebSocket recebidas nos turnos concluídos
+
+    def summary(self, elapsed):
+        def stats(values):
+            return {
+                "count": len(values),
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+                "max": max(values) if values else None,
+            }
+
+        by_mode = {}
+        for mode in sorted({m for m, _ in self.turns}):
+            by_mode[mode] = {
+                "turn": stats([v for m, v in self.turns if m == mode]),
+                "first_audio": stats([v for m, v in self.first_audio if m == mode]),
+            }
+        return {
+            "elapsed_s": elapsed,
+            "calls_completed": self.calls_completed,
+            "calls_failed": self.calls_failed,
+            "calls_rejected": self.calls_rejected,
+            "turns_rejected": self.turns_rejected,
+            "turns": len(self.turns),
+            "timeouts": self.timeouts,
+            "throughput_turns_per_s": len(self.turns) / elapsed if elapsed else 0,
+            "throughput_calls_per_s": self.calls_completed / elapsed if elapsed else 0,
+            "audio_mb": self.audio_bytes / 1e6,
+            "messages_per_turn": self.messages / len(self.turns) if self.turns else 0,
+            "turn": stats([v for _, v in self.turns]),
+            "first_audio": stats([v for _, v in self.first_audio]),
+            "call_first_audio": stats(self.call_first_audio),
+            "by_mode": by_mode,
+            "errors": self.errors[:20],
+        }
+
+
+def unpack(message, framed):
+    """Eventos (dict) e áudios (bytes) de uma mensagem, no protocolo padrão ou no compacto."""
+    if not isinstance(message, bytes):
+        return [json.loads(message)]
+    if framed:
+        return [payload for _, payload in framing.decode(message)]
+    return [message]
+
+
+async def run_turn(ws, audio, timeout):
+    """Envia uma fala e espera o ai_text_complete. Retorna (tempo até 1º áudio, tempo total, bytes, mensagens)."""
+    start = time.perf_counter()
+    first_audio = None
+    received = 0
+    messages = 0
+    framed = ws.subprotocol in framing.PROTOCOLS
+    await ws.send(audio)
+    deadline = start + timeout
+    while True:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            raise asyncio.TimeoutError()
+        message = await asyncio.wait_for(ws.recv(), remaining)
+        messages += 1
+        for item in unpack(message, framed):
+            if isinstance(item, bytes):
+                received += len(item)
+                if first_audio is None:
+                    first_audio = time.perf_counter() - start
+                continue
+            if item.get("type") == "busy":
+                raise Busy(item.get("scope"))
+            if item.get("type") == "ai_text_complete":
+                return first_audio, time.perf_counter() - start, received, messages
+
+
+async def run_call(caller_id, scenario, utterances, args, results):
+    call_first_audio = None
+    try:
+        subprotocols = [args.protocol] if args.protocol != "json" else None
+        async with websockets.connect(args.url, max_size=None, open_timeout=args.turn_timeout,
+                                      subprotocols=subprotocols) as ws:
+            await ws.send(json.dumps({"type": "set_mode", "mode": scenario["mode"]}))
+            if args.audio_format:
+                await ws.send(json.dumps({"type": "set_audio_format", "formats": args.audio_format.split(",")}))
+            for turn in scenario["turns"]:
+                audio = utterances[(turn["text"], turn.get("audio"))]
+                try:
+                    first_audio, total, received, messages = await run_turn(ws, audio, args.turn_timeout)
+                except asyncio.TimeoutError:
+                    results.timeouts += 1
+                    raise
+                except Busy:
+                    results.turns_rejected += 1
+                    continue
+                results.turns.append((scenario["mode"], total))
+                results.audio_bytes += received
+                results.messages += messages
+                if first_audio is not None:
+                    results.first_audio.append((scenario["mode"], first_audio))
+                    if call_first_audio is None:
+                        call_first_audio = first_audio
+                if args.think_time:
+                    await asyncio.sleep(random.uniform(0, 2 * args.think_time))
+        results.calls_completed += 1
+        if call_first_audio is not None:
+            results.call_first_audio.append(call_first_audio)
+    except websockets.ConnectionClosed as e:
+        # 1013 (try again later): chamada recusada pelo controle de admissão do servidor
+        if e.rcvd is not None and e.rcvd.code == 1013:
+            results.calls_rejected += 1
+        else:
+            results.calls_failed += 1
+            results.errors.append(f"caller {caller_id} ({scenario['name']}): {type(e).__name__} {e}")
+    except Exception as e:
+        results.calls_failed += 1
+        results.errors.append(f"caller {caller_id} ({scenario['name']}): {type(e).__name__} {e}")
+
+
+async def run_load(scenarios, utterances, args):
+    results = Results()
+    semaphore = asyncio.Semaphore(args.concurrency)
+    weights = [scenario.get("weight", 1) for scenario in scenarios]
+    rng = random.Random(args.seed)
+
+    async def caller(i):
+        # Rampa: distribui o início das chamadas ao longo de --ramp segundos
+        if args.ramp:
+            await asyncio.sleep(args.ramp * i / args.callers)
+        async with semaphore:
+            await run_call(i, rng.choices(scenarios, weights)[0], utterances, args, results)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(caller(i) for i in range(args.callers)))
+    return results.summary(time.perf_counter() - start)
+
+
+def spawn_server(args, transcripts_path):
+    """Sobe o backend com os simuladores locais e espera ficar pronto (/ready)."""
+    env = dict(
+        os.environ,
+        VOICE_BOT_STUBS="1",
+        SPAWN_MOCK_API=os.getenv("SPAWN_MOCK_API", "1"),
+        STUB_TRANSCRIPTS=transcripts_path,
+        TTS_CACHE_DIR=tempfile.mkdtemp(prefix="voicebot_tts_"),
+        PYTHONUNBUFFERED="1",
+    )
+    for name in ("stt_latency", "tts_latency", "llm_latency", "llm_token_latency"):
+        value = getattr(args, name)
+        if value:
+            env[f"STUB_{name.upper()}"] = value
+    log = open(args.server_log, "w") if args.server_log else subprocess.DEVNULL
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(args.port)],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        stdout=log,
+        stderr=subprocess.STDOUT,
+        start_new_session=True,  # permite encerrar também a API mock iniciada pelo main
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("O servidor encerrou durante a inicialização (veja --server-log).")
+        try:
+            # /ready responde 503 até o aquecimento do servidor terminar
+            if httpx.get(f"http://127.0.0.1:{args.port}/ready", timeout=1.0).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.3)
+    stop_server(process)
+    raise RuntimeError("O servidor não respondeu em 30s.")
+
+
+def stop_server(process):
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=10)
+    except (ProcessLookupError, subprocess.TimeoutExpired):
+        os.killpg(process.pid, signal.SIGKILL)
+
+
+def format_stats(label, stats):
+    if not stats["count"]:
+        return f"  {label:<22} -"
+    return (f"  {label:<22} n={stats['count']:<6} p50={stats['p50']:.3f}s  p95={stats['p95']:.3f}s  "
+            f"p99={stats['p99']:.3f}s  max={stats['max']:.3f}s")
+
+
+def print_report(report):
+    print("\n=== Resultado do teste de carga ===")
+    print(f"  Duração:               {report['elapsed_s']:.1f}s")
+    print(f"  Chamadas:              {report['calls_completed']} ok / {report['calls_failed']} falhas / "
+          f"{report['calls_rejected']} recusadas")
+    print(f"  Turnos:                {report['turns']} ({report['timeouts']} timeouts, {report['turns_rejected']} recusados)")
+    print(f"  Vazão:                 {report['throughput_turns_per_s']:.2f} turnos/s, "
+          f"{report['throughput_calls_per_s']:.2f} chamadas/s")
+    print(f"  Áudio recebido:        {report['audio_mb']:.1f} MB")
+    print(f"  Mensagens por turno:   {report['messages_per_turn']:.1f}")
+    print(format_stats("Turno", report["turn"]))
+    print(format_stats("1º áudio do turno", report["first_audio"]))
+    print(format_stats("1º áudio da chamada", report["call_first_audio"]))
+    for mode, stats in report["by_mode"].items():
+        print(format_stats(f"Turno [{mode}]", stats["turn"]))
+        print(format_stats(f"1º áudio [{mode}]", stats["first_audio"]))
+    for error in report["errors"]:
+        print(f"  ERRO: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga do /ws com chamadas simuladas")
+    parser.add_argument("--url", default=None, help="URL do WebSocket (padrão: ws://127.0.0.1:PORT/ws)")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--callers", type=int, default=20, help="Total de chamadas")
+    parser.add_argument("--concurrency", type=int, default=10, help="Chamadas simultâneas")
+    parser.add_argument("--ramp", type=float, default=5.0, help="Segundos para iniciar todas as chamadas")
+    parser.add_argument("--think-time", type=float, default=0.5, help="Pausa média do cliente entre turnos (s)")
+    parser.add_argument("--turn-timeout", type=float, default=30.0)
+    parser.add_argument("--mode", choices=["tree", "ai", "mixed"], default="mixed")
+    parser.add_argument("--audio-format", help="Formatos de áudio pedidos ao servidor, ex: opus_webm,mp3")
+    parser.add_argument("--protocol", choices=["json", *framing.PROTOCOLS], default="json",
+                        help="Protocolo do /ws: json (padrão) ou um dos subprotocolos compactos de framing.py")
+    parser.add_argument("--scenarios", help="JSON com a lista de cenários (padrão: cenários embutidos)")
+    parser.add_argument("--audio-dir", help="Diretório das gravações referenciadas nos cenários")
+    parser.add_argument("--transcripts", default=os.path.join(tempfile.gettempdir(), "voicebot_transcripts.json"),
+                        help="Manifesto de transcrições compartilhado com o STT simulado")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Grava o relatório em JSON")
+    parser.add_argument("--fail-on-p95", type=float, help="Sai com código 1 se o p95 do turno passar deste valor (s)")
+    parser.add_argument("--spawn-server", action="store_true", help="Sobe o backend local com VOICE_BOT_STUBS=1")
+    parser.add_argument("--server-log", help="Arquivo para o log do servidor iniciado com --spawn-server")
+    parser.add_argument("--stt-latency", help="Distribuição do STT simulado, ex: lognormal:0.35:0.3")
+    parser.add_argument("--tts-latency", help="Distribuição do TTS simulado")
+    parser.add_argument("--llm-latency", help="Distribuição do LLM simulado (resposta/1º token)")
+    parser.add_argument("--llm-token-latency", help="Distribuição entre tokens do LLM simulado")
+    args = parser.parse_args()
+    args.url = args.url or f"ws://127.0.0.1:{args.port}/ws"
+
+    if args.scenarios:
+        with open(args.scenarios, encoding="utf-8") as f:
+            scenarios = json.load(f)
+    else:
+        scenarios = DEFAULT_SCENARIOS
+    if args.mode != "mixed":
+        scenarios = [s for s in scenarios if s["mode"] == args.mode]
+    if not scenarios:
+        parser.error("Nenhum cenário para o modo escolhido.")
+
+    utterances = prepare_utterances(scenarios, args.audio_dir, args.transcripts)
+    print(f"[LOAD] {len(utterances)} falas preparadas; manifesto em {args.transcripts}")
+
+    server = spawn_server(args, args.transcripts) if args.spawn_server else None
+    try:
+        print(f"[LOAD] {args.callers} chamadas, {args.concurrency} simultâneas -> {args.url}")
+        report = asyncio.run(run_load(scenarios, utterances, args))
+    finally:
+        if server:
+            stop_server(server)
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if args.fail_on_p95 is not None and (report["turn"]["p95"] or 0) > args.fail_on_p95:
+        print(f"[LOAD] p95 do turno acima do limite de {args.fail_on_p95:.2f}s")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
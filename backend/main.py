@@ -1,27 +1,56 @@
 import asyncio
+import io
 import os
 import tempfile
 import json
 import time
 import hashlib
 import subprocess
+import threading
+from collections import OrderedDict
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, JSONResponse
 import speech_recognition as sr
 from pydub import AudioSegment
 import logging
 from datetime import datetime
 import edge_tts
 import sys
-from llm_service import generate_reply_stream
-from tree_service import get_tree_response, get_next_possible_responses
+import socket
+from contextlib import asynccontextmanager
+
+# Simuladores locais de STT/TTS/LLM para testes de carga (ver stubs.py).
+# Importado antes dos serviços para dispensar a chave real da OpenAI.
+STUBS_ENABLED = os.getenv("VOICE_BOT_STUBS") == "1"
+if STUBS_ENABLED:
+    import stubs
+
+# Gravação/reprodução das chamadas externas (ver cassette.py)
+CASSETTE_ENABLED = bool(os.getenv("VOICE_BOT_CASSETTE"))
+if CASSETTE_ENABLED:
+    import cassette
+
+from llm_service import generate_reply_stream, summarize_history
+from context_window import ConversationContext, local_summary
+from tree_service import get_tree_response
+from prefetch import PrefetchScheduler, TransitionStats
+from metrics import REGISTRY, TURNS, TurnTrace, span, record_cache
+import audio_formats
+import framing
+import clients
+import admission
+import flows
+from admission import Overloaded
+from audio_formats import DEFAULT_FORMAT
 
 # Configuração de Logging
-LOG_FILE = os.path.join(os.path.dirname(__file__), "conversation.log")
+LOG_FILE = os.getenv("CONVERSATION_LOG") or os.path.join(os.path.dirname(__file__), "conversation.log")
 
-# Limpa o arquivo de log ao iniciar o servidor
-with open(LOG_FILE, "w", encoding="utf-8") as f:
-    f.write(f"--- Nova Sessão de Log: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ---\n")
+def start_log():
+    """Marca o início de uma sessão de log. Não trunca: vários workers podem escrever no mesmo arquivo."""
+    with open(LOG_FILE, "a", encoding="utf-8") as f:
+        f.write(f"--- Nova Sessão de Log: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} (pid {os.getpid()}) ---\n")
 
 def log_conversation(client_id, role, message, duration=None):
     timestamp = datetime.now().strftime("%H:%M:%S")
@@ -35,12 +64,73 @@ def log_conversation(client_id, role, message, duration=None):
     with open(LOG_FILE, "a", encoding="utf-8") as f:
         f.write(log_entry)
 
-app = FastAPI()
+# API Mock de Dívidas: iniciada pelo servidor só com SPAWN_MOCK_API=1 (os scripts de início e o
+# docker-compose ligam) e se ninguém já estiver na porta
+SPAWN_MOCK_API = os.getenv("SPAWN_MOCK_API", "0") == "1"
+MOCK_API_PORT = 8001
+# Espera máxima pela API Mock no aquecimento: na primeira execução ela gera a base antes de abrir a porta
+MOCK_API_START_TIMEOUT = float(os.getenv("MOCK_API_START_TIMEOUT", "120"))
+# Pré-síntese e decodificação das frases estáticas do fluxo antes de reportar pronto em /ready
+PREWARM_ON_START = os.getenv("PREWARM_ON_START", "0") == "1"
+
+def port_in_use(port, host="127.0.0.1"):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.settimeout(0.2)
+        return s.connect_ex((host, port)) == 0
+
+def start_mock_api():
+    """Sobe a API Mock num processo filho; retorna o processo ou None se ela já estiver no ar ou desativada."""
+    if not SPAWN_MOCK_API:
+        return None
+    if port_in_use(MOCK_API_PORT):
+        print(f"[INIT] API Mock já está na porta {MOCK_API_PORT}")
+        return None
+    print(f"[INIT] Iniciando API Mock de Dívidas na porta {MOCK_API_PORT}...")
+    mock_api_path = os.path.join(os.path.dirname(__file__), "mock_api.py")
+    return subprocess.Popen([sys.executable, mock_api_path])
+
+def stop_mock_api(process):
+    if process is None or process.poll() is not None:
+        return
+    process.terminate()
+    try:
+        process.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        process.kill()
+    print("[SHUTDOWN] API Mock encerrada")
 
-# Inicia a API Mock em um processo separado
-print("[INIT] Iniciando API Mock de Dívidas na porta 8001...")
-mock_api_path = os.path.join(os.path.dirname(__file__), "mock_api.py")
-subprocess.Popen([sys.executable, mock_api_path])
+# Estado de prontidão exposto em /ready
+readiness = {"ready": False, "stage": "starting", "started_at": None, "ready_in": None}
+
+@asynccontextmanager
+async def lifespan(app):
+    """Inicializa os recursos do servidor (log, cache, API Mock, clientes, recarga do fluxo) e os libera no fim."""
+    readiness["started_at"] = time.time()
+    # STT e decodificação num pool do tamanho dos orçamentos; o LLM tem o seu (ver admission.py)
+    asyncio.get_running_loop().set_default_executor(admission.blocking_executor())
+    # A árvore toma a vaga de LLM só ao classificar, de dentro da thread (admission.thread_slot)
+    admission.bind_loop(asyncio.get_running_loop())
+    start_log()
+    os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+    print(f"[INIT] Cache de áudio persistente em: {TTS_CACHE_DIR}")
+    mock_api = start_mock_api()
+    print(f"[INIT] Fluxo '{flow_registry.current.flow_id}' versão {flow_registry.current.version}")
+    watcher = asyncio.create_task(flow_registry.watch()) if flows.FLOW_RELOAD_INTERVAL > 0 else None
+    # O aquecimento roda depois que o servidor já aceita conexões; /ready responde 503 até ele terminar
+    warmup = asyncio.create_task(warm_up(mock_api))
+    try:
+        yield
+    finally:
+        readiness.update(ready=False, stage="stopping")
+        for task in (watcher, warmup):
+            if task:
+                task.cancel()
+        await prefetcher.stop()
+        transition_stats.flush()
+        stop_mock_api(mock_api)
+        clients.close_all()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -58,198 +148,591 @@ TTS_VOICE = "pt-BR-AntonioNeural"
 TTS_RATE = "+20%" # Aumenta a velocidade em 20%
 
 # Pasta de Cache Permanente para Áudios
-TTS_CACHE_DIR = os.path.join(os.path.dirname(__file__), "tts_cache")
-if not os.path.exists(TTS_CACHE_DIR):
-    os.makedirs(TTS_CACHE_DIR)
-print(f"[INIT] Cache de áudio persistente em: {TTS_CACHE_DIR}")
+# Com os simuladores o cache vai para outra pasta, para não misturar silêncio com falas reais
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR") or os.path.join(os.path.dirname(__file__), "tts_cache_stub" if STUBS_ENABLED else "tts_cache")
+
+# Locks por frase para evitar que múltiplas requisições gerem o mesmo áudio estático simultaneamente
+# (um lock global serializaria todas as sínteses, inclusive as do pré-carregamento)
+tts_locks = {}
+
+# Cache em memória dos áudios dinâmicos (MP3), preenchido pelas falas e pelo pré-carregamento
+DYNAMIC_AUDIO_CACHE_SIZE = int(os.getenv("DYNAMIC_AUDIO_CACHE_SIZE", "512"))
+dynamic_audio_cache = OrderedDict()
 
-# Lock para evitar que múltiplas requisições tentem gerar o mesmo áudio estático simultaneamente
-tts_lock = asyncio.Lock()
+# Cache em memória dos segmentos já decodificados e convertidos para cada formato de saída,
+# para não decodificar o MP3 de cada segmento a cada turno
+DECODED_CACHE_MAX_BYTES = int(os.getenv("DECODED_AUDIO_CACHE_MB", "64")) * 1024 * 1024
+decoded_cache = OrderedDict()
+decoded_cache_bytes = 0
+
+# Cache da fala final pronta para envio, chaveado pela lista ordenada de segmentos,
+# voz, velocidade e formato: uma fala já ouvida vira uma consulta ao dict e um send_bytes
+UTTERANCE_CACHE_MAX_BYTES = int(os.getenv("UTTERANCE_CACHE_MB", "32")) * 1024 * 1024
+utterance_cache = OrderedDict()
+utterance_cache_bytes = 0
 
 # In-memory session data
 sessions = {}
 
-async def get_audio_segment(text, is_static=True):
-    """Retorna um AudioSegment, gerando-o se necessário. Estáticos usam cache persistente."""
+REGISTRY.gauge("voicebot_active_sessions", "Sessões WebSocket ativas", function=lambda: len(sessions))
+REGISTRY.gauge("voicebot_utterance_cache_bytes", "Bytes ocupados pelo cache de falas prontas",
+               function=lambda: utterance_cache_bytes)
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Exposição das métricas no formato texto do Prometheus."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+async def synthesize_speech(text, path):
+    """Sintetiza a fala com o Edge-TTS e grava o MP3 em path."""
+    communicate = edge_tts.Communicate(text, TTS_VOICE, rate=TTS_RATE)
+    await communicate.save(path)
+
+def transcribe_audio(wav_path):
+    """Transcreve um WAV com o reconhecedor do Google; retorna "" se nada for reconhecido."""
+    with sr.AudioFile(wav_path) as source:
+        audio_data = recognizer.record(source)
+        try:
+            return recognizer.recognize_google(audio_data, language="pt-BR")
+        except:
+            return ""
+
+if STUBS_ENABLED:
+    stubs.install()
+    synthesize_speech = stubs.synthesize_speech
+    transcribe_audio = stubs.transcribe_audio
+
+if CASSETTE_ENABLED:
+    synthesize_speech = cassette.install(synthesize_speech, TTS_VOICE, TTS_RATE)
+
+def static_cache_path(text):
+    text_hash = hashlib.md5(f"{text}_{TTS_VOICE}_{TTS_RATE}".encode()).hexdigest()
+    return os.path.join(TTS_CACHE_DIR, f"{text_hash}.mp3")
+
+async def ensure_static_audio(text, priority=admission.PRIORITY_LIVE):
+    """Garante o MP3 da frase estática no cache persistente. Retorna (caminho, hit)."""
+    cache_path = static_cache_path(text)
+    if os.path.exists(cache_path):
+        return cache_path, True
+    lock = tts_locks.setdefault(cache_path, asyncio.Lock())
+    try:
+        async with lock:
+            # Dupla checagem após adquirir o lock
+            if os.path.exists(cache_path):
+                return cache_path, True
+            print(f"[TTS] Gerando estático: \"{text[:30]}...\"")
+            tmp_path = cache_path + ".tmp"
+            async with admission.TTS.slot(priority):
+                await synthesize_speech(text, tmp_path)
+            os.replace(tmp_path, cache_path)
+            return cache_path, False
+    finally:
+        if not lock.locked():
+            tts_locks.pop(cache_path, None)
+
+async def ensure_dynamic_audio(text, priority=admission.PRIORITY_LIVE):
+    """Retorna (mp3, hit) do cache em memória de áudios dinâmicos, sintetizando se necessário."""
+    audio = dynamic_audio_cache.get(text)
+    if audio is not None:
+        dynamic_audio_cache.move_to_end(text)
+        return audio, True
+    print(f"[TTS] Gerando dinâmico: \"{text}\"")
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmp:
+        tmp_path = tmp.name
+    try:
+        async with admission.TTS.slot(priority):
+            await synthesize_speech(text, tmp_path)
+        with open(tmp_path, "rb") as f:
+            audio = f.read()
+    finally:
+        os.unlink(tmp_path)
+    dynamic_audio_cache[text] = audio
+    while len(dynamic_audio_cache) > DYNAMIC_AUDIO_CACHE_SIZE:
+        dynamic_audio_cache.popitem(last=False)
+    return audio, False
+
+def store_decoded(key, segment):
+    global decoded_cache_bytes
+    decoded_cache[key] = segment
+    decoded_cache_bytes += len(segment.raw_data)
+    while decoded_cache_bytes > DECODED_CACHE_MAX_BYTES and len(decoded_cache) > 1:
+        _, evicted = decoded_cache.popitem(last=False)
+        decoded_cache_bytes -= len(evicted.raw_data)
+
+def utterance_key(segments, audio_format):
+    return (tuple((seg["type"], seg["text"]) for seg in segments), TTS_VOICE, TTS_RATE, audio_format)
+
+def store_utterance(key, audio_data):
+    global utterance_cache_bytes
+    if len(audio_data) > UTTERANCE_CACHE_MAX_BYTES:
+        return
+    utterance_cache[key] = audio_data
+    utterance_cache_bytes += len(audio_data)
+    while utterance_cache_bytes > UTTERANCE_CACHE_MAX_BYTES:
+        _, evicted = utterance_cache.popitem(last=False)
+        utterance_cache_bytes -= len(evicted)
+
+async def get_audio_segment(text, is_static=True, audio_format=DEFAULT_FORMAT):
+    """Retorna um AudioSegment no formato de saída, gerando-o se necessário. Estáticos usam cache persistente."""
+    key = (is_static, text, audio_format)
+    with span("tts", "decoded_hit") as tts_span:
+        segment = decoded_cache.get(key)
+        record_cache("tts_decoded", segment is not None)
+        if segment is not None:
+            decoded_cache.move_to_end(key)
+            return segment
+        if is_static:
+            cache_path, hit = await ensure_static_audio(text)
+            tts_span.set_detail("cache_hit" if hit else "cache_miss")
+            record_cache("tts_static", hit)
+            segment = AudioSegment.from_file(cache_path)
+        else:
+            # Dinâmico: cache apenas em memória (valores do cliente não vão para o disco)
+            audio, hit = await ensure_dynamic_audio(text)
+            tts_span.set_detail("dynamic_hit" if hit else "dynamic")
+            record_cache("tts_dynamic", hit)
+            segment = AudioSegment.from_file(io.BytesIO(audio), format="mp3")
+        segment = audio_formats.conform(segment, audio_format)
+        store_decoded(key, segment)
+        return segment
+
+async def get_source_audio(text, is_static=True):
+    """Bytes do MP3 gerado pelo Edge-TTS, sem decodificar."""
     if is_static:
-        text_hash = hashlib.md5(f"{text}_{TTS_VOICE}_{TTS_RATE}".encode()).hexdigest()
-        cache_path = os.path.join(TTS_CACHE_DIR, f"{text_hash}.mp3")
-        
-        if not os.path.exists(cache_path):
-            async with tts_lock:
-                # Dupla checagem após adquirir o lock
-                if not os.path.exists(cache_path):
-                    print(f"[TTS] Gerando estático: \"{text[:30]}...\"")
-                    communicate = edge_tts.Communicate(text, TTS_VOICE, rate=TTS_RATE)
-                    await communicate.save(cache_path)
-        
-        return AudioSegment.from_file(cache_path)
+        cache_path, hit = await ensure_static_audio(text)
+        record_cache("tts_static", hit)
+        with open(cache_path, "rb") as f:
+            return f.read()
+    audio, hit = await ensure_dynamic_audio(text)
+    record_cache("tts_dynamic", hit)
+    return audio
+
+async def prefetch_audio(text, is_static):
+    """Síntese de pré-carregamento: só garante o áudio em cache. Retorna True se precisou sintetizar."""
+    if is_static:
+        _, hit = await ensure_static_audio(text, admission.PRIORITY_PREFETCH)
     else:
-        # Dinâmico: gera na hora sem salvar permanentemente
-        print(f"[TTS] Gerando dinâmico: \"{text}\"")
-        communicate = edge_tts.Communicate(text, TTS_VOICE, rate=TTS_RATE)
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmp:
-            await communicate.save(tmp.name)
-            segment = AudioSegment.from_file(tmp.name)
-            os.unlink(tmp.name)
-            return segment
+        _, hit = await ensure_dynamic_audio(text, admission.PRIORITY_PREFETCH)
+    return not hit
+
+# Backpressure: tempo máximo para o cliente aceitar uma mensagem antes de a conexão ser encerrada
+SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))
+SLOW_CONSUMERS = REGISTRY.counter("voicebot_slow_consumers_total", "Conexões encerradas por não consumirem as mensagens a tempo")
+
+# Conexões no protocolo compacto (ver framing.py): client_id -> quadros aguardando envio
+frame_writers = {}
+
+async def send(websocket, client_id, payload, flush=True):
+    """
+    Envia bytes ou JSON aguardando o cliente drenar o buffer; cliente lento demais é desconectado.
+    No protocolo compacto o payload vira um quadro; com flush=False ele espera o próximo envio
+    e segue na mesma mensagem binária.
+    """
+    writer = frame_writers.get(client_id)
+    if writer is not None:
+        writer.add(payload)
+        if not flush:
+            return
+        payload = writer.take()
+        if payload is None:
+            return
+    framing.MESSAGES.inc(protocol="frames" if writer is not None else "json")
+    try:
+        if isinstance(payload, bytes):
+            await asyncio.wait_for(websocket.send_bytes(payload), SEND_TIMEOUT)
+        else:
+            await asyncio.wait_for(websocket.send_json(payload), SEND_TIMEOUT)
+    except asyncio.TimeoutError:
+        SLOW_CONSUMERS.inc()
+        print(f"[{client_id}] Cliente lento: envio não concluído em {SEND_TIMEOUT:.0f}s, encerrando")
+        raise WebSocketDisconnect(1013)
 
-async def generate_and_send_stitched_audio(segments, websocket, client_id):
-    """Gera áudio concatenado a partir de segmentos estáticos/dinâmicos."""
+async def iterate_in_thread(gen, budget):
+    """
+    Consome um gerador bloqueante numa thread do pool do LLM (ocupando uma vaga de budget) e entrega os itens ao event loop.
+    Se o consumidor parar antes do fim (desconexão, erro no envio), a thread para no próximo item e libera a vaga.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    done = object()
+    stop = threading.Event()
+
+    def pump():
+        try:
+            for item in gen:
+                if stop.is_set():
+                    break
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+        finally:
+            gen.close()
+
+    async def produce():
+        try:
+            async with budget.slot():
+                await admission.run_llm(pump)
+        finally:
+            queue.put_nowait(done)
+
+    task = asyncio.create_task(produce())
+    try:
+        while (item := await queue.get()) is not done:
+            yield item
+        await task
+    finally:
+        stop.set()
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+transition_stats = TransitionStats()
+prefetcher = PrefetchScheduler(prefetch_audio, transition_stats)
+
+async def prewarm_flow(texts, concurrency=4):
+    """Sintetiza para o cache persistente as frases estáticas de uma nova versão do fluxo."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def warm(text):
+        async with semaphore:
+            try:
+                await ensure_static_audio(text, admission.PRIORITY_PREFETCH)
+            except Exception as e:
+                # A frase será sintetizada sob demanda na primeira vez em que for falada
+                print(f"[FLOW] Falha ao pré-sintetizar \"{text[:30]}\": {e}")
+
+    await asyncio.gather(*(warm(text) for text in texts))
+
+flow_registry = flows.FlowRegistry(prewarm=prewarm_flow)
+
+async def warm_up(mock_api):
+    """Cria os clientes compartilhados e, com PREWARM_ON_START, aquece os caches de áudio; então marca pronto."""
+    try:
+        readiness["stage"] = "clients"
+        await asyncio.to_thread(clients.openai)
+        await asyncio.to_thread(clients.debt_api)
+        if mock_api is not None:
+            # A porta só abre depois do lifespan da API Mock (que gera a base, se preciso):
+            # /ready acompanha a geração em vez de reportar pronto com a API fora do ar
+            readiness["stage"] = "mock_api"
+            deadline = time.time() + MOCK_API_START_TIMEOUT
+            while not await asyncio.to_thread(port_in_use, MOCK_API_PORT):
+                if mock_api.poll() is not None:
+                    print(f"[INIT] API Mock encerrou com código {mock_api.returncode}")
+                    break
+                if time.time() > deadline:
+                    print(f"[INIT] API Mock não respondeu em {MOCK_API_START_TIMEOUT:.0f}s")
+                    break
+                await asyncio.sleep(0.1)
+        if PREWARM_ON_START:
+            readiness["stage"] = "prewarm"
+            texts = sorted(flow_registry.current.static_texts)
+            await prewarm_flow(texts)
+            # Deixa os segmentos já decodificados no formato padrão para o primeiro turno
+            for text in texts:
+                cache_path = static_cache_path(text)
+                if os.path.exists(cache_path):
+                    segment = await asyncio.to_thread(AudioSegment.from_file, cache_path)
+                    store_decoded((True, text, DEFAULT_FORMAT), audio_formats.conform(segment, DEFAULT_FORMAT))
+            print(f"[INIT] {len(texts)} frases estáticas aquecidas")
+    except Exception as e:
+        # Falha no aquecimento não impede o atendimento: o áudio é gerado sob demanda
+        print(f"[INIT] Erro no aquecimento: {e}")
+    readiness.update(ready=True, stage="ready", ready_in=round(time.time() - readiness["started_at"], 3))
+    print(f"[INIT] Pronto em {readiness['ready_in']:.2f}s")
+
+@app.get("/ready")
+async def ready_endpoint():
+    """Prontidão para balanceadores e reinícios graduais: 503 até o aquecimento terminar (e ao encerrar)."""
+    return JSONResponse(readiness, status_code=200 if readiness["ready"] else 503)
+
+@app.get("/flow")
+async def flow_status():
+    """Versão ativa do fluxo e quantas sessões ainda usam cada versão."""
+    in_use = {}
+    for session_data in sessions.values():
+        version = session_data["flow_version"].version
+        in_use[version] = in_use.get(version, 0) + 1
+    return {"active": flow_registry.current.describe(), "sessions_by_version": in_use}
+
+@app.post("/flow/reload")
+async def flow_reload():
+    """Força a recarga do arquivo do fluxo (validação + pré-síntese + troca)."""
+    try:
+        version = await flow_registry.reload()
+    except flows.FlowValidationError as e:
+        return JSONResponse({"status": "invalid", "errors": e.errors}, status_code=422)
+    return {"status": "swapped" if version else "unchanged", "active": flow_registry.current.describe()}
+
+def finish_tree_conversation(session_data):
+    """Alimenta as estatísticas de transição com o caminho da conversa encerrada."""
+    path = session_data.get("tree_path") or []
+    if len(path) > 1:
+        transition_stats.record_path(path)
+    session_data["tree_path"] = ["START"]
+
+async def stitch_audio(segments, client_id, audio_format=DEFAULT_FORMAT):
+    """
+    Gera o áudio concatenado a partir de segmentos estáticos/dinâmicos, no formato negociado com o cliente.
+    Ocupa as vagas de TTS necessárias (pode levantar Overloaded) e não envia nada.
+    """
     tts_start = time.time()
     
-    tasks = []
-    for seg in segments:
-        tasks.append(get_audio_segment(seg["text"], is_static=(seg["type"] == "static")))
+    if not segments:
+        return None
     
-    audio_segments = await asyncio.gather(*tasks)
+    key = utterance_key(segments, audio_format)
+    audio_data = utterance_cache.get(key)
+    record_cache("utterance", audio_data is not None)
+    if audio_data is not None:
+        utterance_cache.move_to_end(key)
+        print(f"[{client_id}] Áudio do cache de falas em: {time.time() - tts_start:.4f}s ({audio_format}, {len(audio_data)} bytes)")
+        return audio_data
     
-    if not audio_segments:
-        return
+    # Síntese ao vivo: vaga de TTS com PRIORITY_LIVE, à frente do pré-carregamento na fila
+    if audio_format == audio_formats.SOURCE_FORMAT and len(segments) == 1:
+        # Caminho mais barato: um único segmento já está no formato do Edge-TTS
+        with span("tts", "passthrough"):
+            audio_data = await get_source_audio(segments[0]["text"], is_static=(segments[0]["type"] == "static"))
+    else:
+        tasks = []
+        for seg in segments:
+            tasks.append(get_audio_segment(seg["text"], is_static=(seg["type"] == "static"), audio_format=audio_format))
+        audio_segments = await asyncio.gather(*tasks)
         
-    combined = audio_segments[0]
-    for seg in audio_segments[1:]:
-        combined += seg
+        with span("stitch", audio_format):
+            combined = audio_segments[0]
+            for seg in audio_segments[1:]:
+                combined += seg
+            
+            # Exportar para bytes
+            audio_data = audio_formats.encode(combined, audio_format)
+    store_utterance(key, audio_data)
     
-    # Exportar para bytes
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmp:
-        combined.export(tmp.name, format="mp3")
-        with open(tmp.name, "rb") as f:
-            audio_data = f.read()
-        os.unlink(tmp.name)
-        
-    await websocket.send_bytes(audio_data)
-    print(f"[{client_id}] Áudio montado em: {time.time() - tts_start:.4f}s")
+    print(f"[{client_id}] Áudio montado em: {time.time() - tts_start:.4f}s ({audio_format}, {len(audio_data)} bytes)")
+    return audio_data
 
-async def pre_cache_next_responses(current_state, session_data):
-    """Gera o cache apenas para as partes estáticas das próximas falas."""
-    next_segments_list = get_next_possible_responses(current_state, session_data)
-    if not next_segments_list:
+async def send_audio(websocket, client_id, audio_data, flush=True):
+    if audio_data is None:
         return
+    with span("send", "audio"):
+        await send(websocket, client_id, audio_data, flush)
+
+async def generate_and_send_stitched_audio(segments, websocket, client_id, audio_format=DEFAULT_FORMAT, flush=True):
+    """Gera o áudio concatenado dos segmentos e o envia ao cliente."""
+    audio_data = await stitch_audio(segments, client_id, audio_format)
+    await send_audio(websocket, client_id, audio_data, flush)
+
+# Tarefas em segundo plano (resumos de conversa); a referência evita que sejam coletadas antes do fim
+background_tasks = set()
+
+def compact_history(client_id, session_data):
+    """Limita o histórico guardado; no modo IA, os turnos retirados entram no resumo em segundo plano."""
+    context = session_data["context"]
+    if not context.compact(session_data["history"], summarize=session_data["mode"] == "ai") or context.summarizing:
+        return
+    context.summarizing = True
+    task = asyncio.create_task(summarize_context(client_id, context))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+async def summarize_context(client_id, context):
+    """Resume os turnos pendentes fora do caminho crítico, com a menor prioridade no orçamento de LLM."""
+    try:
+        async with admission.LLM.slot(admission.PRIORITY_PREFETCH):
+            await admission.run_llm(context.summarize, summarize_history)
+    except Overloaded:
+        # Sem vaga para o LLM: resumo local, sem chamada de rede
+        context.summarize(local_summary)
+    except Exception as e:
+        print(f"[{client_id}] Erro ao resumir a conversa: {e}")
+    finally:
+        context.summarizing = False
+
+async def process_audio_turn(websocket, client_id, data):
+    """Processa um turno completo: áudio do usuário -> STT -> resposta (árvore ou IA) -> áudio."""
+    start_time = time.time()
     
-    print(f"[CACHE] Pré-carregando partes estáticas de {len(next_segments_list)} caminhos...")
-    static_texts = []
-    for segments in next_segments_list:
-        for seg in segments:
-            if seg["type"] == "static":
-                static_texts.append(seg["text"])
-    
-    if static_texts:
-        tasks = [get_audio_segment(text, is_static=True) for text in set(static_texts)]
-        await asyncio.gather(*tasks)
-    print(f"[CACHE] Pré-carregamento concluído.")
+    with span("ingest"):
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".webm") as tmp_input:
+            tmp_input.write(data)
+            tmp_input_path = tmp_input.name
+
+    wav_path = tmp_input_path + ".wav"
+
+    try:
+        # Convert WebM to WAV
+        with span("decode"):
+            audio = await asyncio.to_thread(AudioSegment.from_file, tmp_input_path)
+            await asyncio.to_thread(audio.export, wav_path, format="wav")
+
+        # 1. STT: Transcribe
+        stt_start = time.time()
+        with span("stt") as stt_span:
+            user_text = await asyncio.to_thread(transcribe_audio, wav_path)
+            if not user_text:
+                stt_span.set_detail("empty")
+        
+        if not user_text:
+            return
+
+        TURNS.inc(mode=sessions[client_id]["mode"])
+
+        log_conversation(client_id, "user", user_text, duration=time.time() - stt_start)
+        with span("send", "json"):
+            await send(websocket, client_id, {"type": "user_transcript", "content": user_text})
+
+        mode = sessions[client_id]["mode"]
+        session_data = sessions[client_id]
+        
+        if mode == "tree":
+            # MODO ÁRVORE PROFISSIONAL COM STITCHED AUDIO
+            ai_start = time.time()
+            # A árvore roda no pool padrão; só a classificação pelo LLM ocupa uma vaga do orçamento de LLM
+            with span("tree"):
+                segments, next_state, updates = await asyncio.to_thread(get_tree_response, user_text, session_data)
+            
+            # O áudio (e a vaga de TTS) vem antes de avançar a sessão: se o turno for recusado por
+            # Overloaded, o cliente recebe "busy" e a repetição da fala cai no mesmo nó
+            audio_data = await stitch_audio(segments, client_id, session_data["audio_format"])
+            
+            session_data.update(updates)
+            session_data["tree_state"] = next_state
+            full_text = "".join([s["text"] for s in segments])
+            log_conversation(client_id, "ai", full_text, duration=time.time() - ai_start)
+            print(f"[{client_id}] Árvore -> {next_state}")
+            
+            # No protocolo compacto texto, áudio e fim do turno seguem numa única mensagem
+            with span("send", "json"):
+                await send(websocket, client_id, {"type": "ai_text_chunk", "content": full_text}, flush=False)
+            await send_audio(websocket, client_id, audio_data, flush=False)
+            with span("send", "json"):
+                await send(websocket, client_id, {"type": "ai_text_complete", "content": full_text})
+            
+            session_data["history"].append({"role": "user", "text": user_text})
+            session_data["history"].append({"role": "assistant", "text": full_text})
+            session_data.setdefault("tree_path", ["START"]).append(next_state)
+            prefetcher.record_played(segments)
+            
+            prefetcher.schedule(client_id, next_state, session_data, index=session_data["flow_version"].index)
+            
+        else:
+            # MODO IA (Simples, sem stitch por enquanto)
+            history = session_data["history"]
+            full_ai_text = ""
+            sentence_count = 0
+            ai_start = time.time()
+            async for sentence in iterate_in_thread(generate_reply_stream(user_text, history, session_data["context"]), admission.LLM):
+                if not sentence: continue
+                sentence_count += 1
+                full_ai_text += " " + sentence
+                # No protocolo compacto o texto da frase segue junto com o seu áudio
+                with span("send", "json"):
+                    await send(websocket, client_id, {"type": "ai_text_chunk", "content": sentence}, flush=False)
+                
+                # Para o modo IA, usamos o formato antigo de cache simples
+                # mas adaptado para a nova função se necessário. 
+                # Aqui vamos apenas converter a sentença em um segmento estático único.
+                await generate_and_send_stitched_audio([{"type": "static", "text": sentence}], websocket, client_id, session_data["audio_format"])
+            
+            log_conversation(client_id, "ai", full_ai_text.strip(), duration=time.time() - ai_start)
+            with span("send", "json"):
+                await send(websocket, client_id, {"type": "ai_text_complete", "content": full_ai_text.strip()})
+        
+        compact_history(client_id, session_data)
+        print(f"[{client_id}] Ciclo completo em: {time.time() - start_time:.2f}s\n")
+
+    except (WebSocketDisconnect, Overloaded):
+        raise
+    except Exception as e:
+        print(f"[{client_id}] Erro: {e}")
+    finally:
+        if os.path.exists(tmp_input_path): os.unlink(tmp_input_path)
+        if os.path.exists(wav_path): os.unlink(wav_path)
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    await websocket.accept()
+    # Protocolo compacto: subprotocolo voicebot.frames.v1 ou /ws?protocol=voicebot.frames.v1 (ver framing.py)
+    protocol, from_header = framing.negotiate(websocket.scope.get("subprotocols"), websocket.query_params.get("protocol"))
+    await websocket.accept(subprotocol=protocol if from_header else None)
     client_id = str(id(websocket))
+    if protocol:
+        frame_writers[client_id] = framing.FrameWriter(protocol)
+    # Prioridade na fila de admissão (/ws?priority=0, menor = antes) só com ADMISSION_PRIORITY_TOKEN
+    priority = admission.client_priority(websocket.query_params.get("priority"), websocket.query_params.get("priority_token"))
+    if not admission.SESSIONS.available():
+        await send(websocket, client_id, {"type": "queued"})
+    try:
+        await admission.SESSIONS.acquire(priority)
+    except Overloaded as e:
+        print(f"[CONN] Recusado {client_id}: {e}")
+        await send(websocket, client_id, {"type": "busy", "scope": e.budget})
+        await websocket.close(code=1013)
+        frame_writers.pop(client_id, None)
+        return
+
     sessions[client_id] = {
         "history": [],
+        # Resumo e orçamento de tokens do contexto do modo IA
+        "context": ConversationContext(),
         "mode": "ai",
         "tree_state": "START",
         "debt_info": None,
-        "nome_cliente": None
+        "nome_cliente": None,
+        "tree_path": ["START"],
+        # Formatos aceitos pelo cliente podem vir na URL: /ws?formats=opus_webm,mp3
+        "audio_format": audio_formats.negotiate(websocket.query_params.get("formats"))
     }
-    print(f"\n[CONN] Cliente conectado: {client_id}")
+    # A conversa usa a versão do fluxo ativa no início até terminar
+    flow_registry.pin(sessions[client_id])
+    print(f"\n[CONN] Cliente conectado: {client_id} (áudio: {sessions[client_id]['audio_format']}, protocolo: {protocol or 'json'})")
     
     try:
+        if "formats" in websocket.query_params:
+            await send(websocket, client_id, audio_formats.describe(sessions[client_id]["audio_format"]))
+
         while True:
             message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                # receive() devolve a mensagem de desconexão em vez de levantar a exceção
+                raise WebSocketDisconnect(message.get("code", 1000))
             
             if "text" in message:
                 data = json.loads(message["text"])
                 if data.get("type") == "set_mode":
+                    finish_tree_conversation(sessions[client_id])
                     sessions[client_id]["mode"] = data.get("mode", "ai")
                     sessions[client_id]["tree_state"] = "START"
                     sessions[client_id]["history"] = []
+                    sessions[client_id]["context"] = ConversationContext()
                     sessions[client_id]["debt_info"] = None
                     sessions[client_id]["nome_cliente"] = None
+                    flow_registry.pin(sessions[client_id])
                     print(f"[{client_id}] Modo: {sessions[client_id]['mode']}")
+                elif data.get("type") == "set_audio_format":
+                    sessions[client_id]["audio_format"] = audio_formats.negotiate(data.get("formats"))
+                    print(f"[{client_id}] Formato de áudio: {sessions[client_id]['audio_format']}")
+                    await send(websocket, client_id, audio_formats.describe(sessions[client_id]["audio_format"]))
                 continue
 
             if "bytes" not in message:
                 continue
 
-            data = message["bytes"]
-            start_time = time.time()
-            
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".webm") as tmp_input:
-                tmp_input.write(data)
-                tmp_input_path = tmp_input.name
-
-            wav_path = tmp_input_path + ".wav"
-
             try:
-                # Convert WebM to WAV
-                audio = AudioSegment.from_file(tmp_input_path)
-                audio.export(wav_path, format="wav")
-
-                # 1. STT: Transcribe
-                stt_start = time.time()
-                with sr.AudioFile(wav_path) as source:
-                    audio_data = recognizer.record(source)
-                    try:
-                        user_text = recognizer.recognize_google(audio_data, language="pt-BR")
-                    except:
-                        user_text = ""
-                
-                if not user_text:
-                    continue
-
-                log_conversation(client_id, "user", user_text, duration=time.time() - stt_start)
-                await websocket.send_json({"type": "user_transcript", "content": user_text})
-
-                mode = sessions[client_id]["mode"]
-                session_data = sessions[client_id]
-                
-                if mode == "tree":
-                    # MODO ÁRVORE PROFISSIONAL COM STITCHED AUDIO
-                    ai_start = time.time()
-                    segments, next_state, updates = get_tree_response(user_text, session_data)
-                    
-                    session_data.update(updates)
-                    session_data["tree_state"] = next_state
-                    full_text = "".join([s["text"] for s in segments])
-                    log_conversation(client_id, "ai", full_text, duration=time.time() - ai_start)
-                    print(f"[{client_id}] Árvore -> {next_state}")
-                    
-                    await websocket.send_json({"type": "ai_text_chunk", "content": full_text})
-                    await generate_and_send_stitched_audio(segments, websocket, client_id)
-                    await websocket.send_json({"type": "ai_text_complete", "content": full_text})
-                    
-                    session_data["history"].append({"role": "user", "text": user_text})
-                    session_data["history"].append({"role": "assistant", "text": full_text})
-                    
-                    asyncio.create_task(pre_cache_next_responses(next_state, session_data))
-                    
-                else:
-                    # MODO IA (Simples, sem stitch por enquanto)
-                    history = session_data["history"]
-                    full_ai_text = ""
-                    sentence_count = 0
-                    ai_start = time.time()
-                    for sentence in generate_reply_stream(user_text, history):
-                        if not sentence: continue
-                        sentence_count += 1
-                        full_ai_text += " " + sentence
-                        await websocket.send_json({"type": "ai_text_chunk", "content": sentence})
-                        
-                        # Para o modo IA, usamos o formato antigo de cache simples
-                        # mas adaptado para a nova função se necessário. 
-                        # Aqui vamos apenas converter a sentença em um segmento estático único.
-                        await generate_and_send_stitched_audio([{"type": "static", "text": sentence}], websocket, client_id)
-                    
-                    log_conversation(client_id, "ai", full_ai_text.strip(), duration=time.time() - ai_start)
-                    await websocket.send_json({"type": "ai_text_complete", "content": full_ai_text.strip()})
-                
-                print(f"[{client_id}] Ciclo completo em: {time.time() - start_time:.2f}s\n")
-
-            except Exception as e:
-                print(f"[{client_id}] Erro: {e}")
-            finally:
-                if os.path.exists(tmp_input_path): os.unlink(tmp_input_path)
-                if os.path.exists(wav_path): os.unlink(wav_path)
+                async with admission.TURNS.slot():
+                    with TurnTrace(client_id) as trace:
+                        with span("turn", sessions[client_id]["mode"]):
+                            await process_audio_turn(websocket, client_id, message["bytes"])
+                    print(f"[{client_id}] Trace: {trace.summary()}")
+            except Overloaded as e:
+                # Turno descartado: o cliente é avisado e pode repetir a fala
+                print(f"[{client_id}] Turno recusado ({e})")
+                await send(websocket, client_id, {"type": "busy", "scope": e.budget})
 
     except WebSocketDisconnect:
         print(f"[CONN] Desconectado: {client_id}")
-        if client_id in sessions: del sessions[client_id]
+    finally:
+        if client_id in sessions:
+            finish_tree_conversation(sessions[client_id])
+            prefetcher.forget(client_id)
+            del sessions[client_id]
+        frame_writers.pop(client_id, None)
+        admission.SESSIONS.release()
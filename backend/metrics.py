@@ -0,0 +1,301 @@
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Buckets (em segundos) pensados para as etapas de um turno de voz: de
+# lookups em memória (ms) até sínteses e chamadas de LLM lentas (dezenas de s).
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs += list(extra.items())
+    if not pairs:
+        return ""
+    escaped = []
+    for key, value in pairs:
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        escaped.append(f'{key}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: labels esperados {self.labelnames}, recebidos {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+    def _samples(self):
+        return []
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+        # Gauges sem labels podem ser calculados no momento da coleta
+        self._function = function
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def get(self, **labels):
+        if self._function is not None:
+            return self._function()
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        if self._function is not None:
+            return [f"{self.name} {_format_value(self._function())}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            series["counts"][bisect_left(self.buckets, value)] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def quantile(self, q, **labels):
+        """Estimativa do quantil por interpolação linear nos buckets (como o histogram_quantile)."""
+        series = self._series.get(self._key(labels))
+        if not series or not series["count"]:
+            return None
+        rank = q * series["count"]
+        cumulative = 0
+        lower = 0.0
+        for i, upper in enumerate(self.buckets):
+            count = series["counts"][i]
+            if cumulative + count >= rank:
+                if count == 0:
+                    return upper
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+            lower = upper
+        return self.buckets[-1]
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((key, dict(series, counts=list(series["counts"]))) for key, series in self._series.items())
+        lines = []
+        for key, series in items:
+            cumulative = 0
+            for upper, count in zip(self.buckets + (float("inf"),), series["counts"]):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, {"le": _format_value(upper)})
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series['sum'])}")
+            lines.append(f"{self.name}_count{labels} {series['count']}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Métrica duplicada: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        return self._register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "voicebot_stage_duration_seconds",
+    "Duração de cada etapa de um turno (ingest, decode, stt, classify, debt_lookup, tts, stitch, send, turn)",
+    ["stage", "detail"],
+)
+STAGE_ERRORS = REGISTRY.counter(
+    "voicebot_stage_errors_total",
+    "Etapas que terminaram com exceção",
+    ["stage", "detail"],
+)
+CACHE_REQUESTS = REGISTRY.counter(
+    "voicebot_cache_requests_total",
+    "Consultas aos caches, por resultado (hit/miss)",
+    ["cache", "result"],
+)
+TURNS = REGISTRY.counter(
+    "voicebot_turns_total",
+    "Turnos processados por modo",
+    ["mode"],
+)
+
+
+def _cache_hit_ratio_samples():
+    ratios = {}
+    for (cache, result), value in list(CACHE_REQUESTS._values.items()):
+        hits, total = ratios.get(cache, (0, 0))
+        ratios[cache] = (hits + (value if result == "hit" else 0), total + value)
+    return [
+        f'voicebot_cache_hit_ratio{{cache="{cache}"}} {_format_value(hits / total)}'
+        for cache, (hits, total) in sorted(ratios.items()) if total
+    ]
+
+
+class _CacheHitRatio(_Metric):
+    kind = "gauge"
+
+    def _samples(self):
+        return _cache_hit_ratio_samples()
+
+
+REGISTRY._register(_CacheHitRatio("voicebot_cache_hit_ratio", "Taxa de acerto de cada cache desde o início do processo"))
+
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+# Trace do turno corrente. Por ser um ContextVar, é herdado pelas tasks criadas
+# com asyncio (gather/create_task) e por asyncio.to_thread, então funções
+# profundas (TTS, classificação) registram seus spans sem receber parâmetros.
+_current_trace = ContextVar("voicebot_turn_trace", default=None)
+
+
+class TurnTrace:
+    """Agrega os spans de um turno para gerar um resumo legível no log."""
+
+    def __init__(self, client_id):
+        self.client_id = client_id
+        self.spans = []
+        self._token = None
+
+    def add(self, stage, detail, duration):
+        self.spans.append((stage, detail, duration))
+
+    def summary(self):
+        totals = {}
+        for stage, detail, duration in self.spans:
+            name = f"{stage}:{detail}" if detail else stage
+            count, total = totals.get(name, (0, 0.0))
+            totals[name] = (count + 1, total + duration)
+        parts = []
+        for name, (count, total) in totals.items():
+            suffix = f"x{count}" if count > 1 else ""
+            parts.append(f"{name}={total:.3f}s{suffix}")
+        return " ".join(parts)
+
+    def __enter__(self):
+        self._token = _current_trace.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_trace.reset(self._token)
+        return False
+
+
+class Span:
+    def __init__(self, stage, detail=""):
+        self.stage = stage
+        self.detail = detail
+        self.start = None
+        self.duration = None
+
+    def set_detail(self, detail):
+        """Permite definir o detalhe depois de iniciado (ex: hit/miss só é conhecido dentro do span)."""
+        self.detail = detail
+
+
+@contextmanager
+def span(stage, detail=""):
+    """Mede uma etapa e registra no histograma e no trace do turno corrente."""
+    current = Span(stage, detail)
+    current.start = time.perf_counter()
+    try:
+        yield current
+    except BaseException:
+        STAGE_ERRORS.inc(stage=stage, detail=current.detail)
+        raise
+    finally:
+        current.duration = time.perf_counter() - current.start
+        STAGE_SECONDS.observe(current.duration, stage=stage, detail=current.detail)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(stage, current.detail, current.duration)
@@ -1,51 +1,132 @@
+import os
+import random
+import asyncio
+import argparse
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
-from typing import Optional
-
-app = FastAPI(title="Mock Debt API")
-
-# Mock de Banco de Dados de Dívidas
-MOCK_DEBTS = {
-    "12345678901": {
-        "nome": "João Silva", 
-        "valor": 1250.50, 
-        "empresa": "Banco Alpha",
-        "score": 750,
-        "status": "em_atraso"
-    },
-    "98765432100": {
-        "nome": "Maria Oliveira", 
-        "valor": 450.00, 
-        "empresa": "Loja Beta",
-        "score": 420,
-        "status": "em_atraso"
-    }
+from typing import Optional, List
+
+import debt_store
+from latency import Latency
+
+# Falhas injetadas para testes de carga (também ajustáveis em PUT /config):
+#   MOCK_LATENCY       distribuição da latência de cada requisição, ex: lognormal:0.08:0.5
+#   MOCK_ERROR_RATE    fração das requisições respondidas com 503
+#   MOCK_TIMEOUT_RATE  fração das requisições que demoram MOCK_TIMEOUT_SECONDS (estoura o timeout do cliente)
+FAULTS = {
+    "latency": os.getenv("MOCK_LATENCY", "const:0"),
+    "error_rate": float(os.getenv("MOCK_ERROR_RATE", "0")),
+    "timeout_rate": float(os.getenv("MOCK_TIMEOUT_RATE", "0")),
+    "timeout_seconds": float(os.getenv("MOCK_TIMEOUT_SECONDS", "5")),
 }
+latency = Latency(FAULTS["latency"])
+
+BATCH_LIMIT = int(os.getenv("MOCK_BATCH_LIMIT", "1000"))
+
+DEFAULT_DEBT = debt_store.DEFAULT_DEBT
+
+store = None
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global store
+    # A base é gerada na primeira execução (ou quando MOCK_DEBTS_COUNT muda) e reaproveitada depois
+    await asyncio.to_thread(debt_store.ensure_dataset, debt_store.DB_PATH, debt_store.DATASET_SIZE)
+    store = debt_store.DebtStore()
+    print(f"[MOCK] {store.count} clientes em {store.path}")
+    yield
+    store.close()
+
+
+app = FastAPI(title="Mock Debt API", lifespan=lifespan)
+
 
 class DebtResponse(BaseModel):
     nome: str
     valor: float
     empresa: str
-    score: int
+    score: Optional[int]
     status: str
 
+
+class BatchRequest(BaseModel):
+    cpfs: List[str]
+
+
+class FaultConfig(BaseModel):
+    latency: Optional[str] = None
+    error_rate: Optional[float] = None
+    timeout_rate: Optional[float] = None
+    timeout_seconds: Optional[float] = None
+
+
+def clean(cpf):
+    # Remove caracteres não numéricos
+    return "".join(filter(str.isdigit, cpf))
+
+
+async def inject_faults():
+    if FAULTS["timeout_rate"] and random.random() < FAULTS["timeout_rate"]:
+        await asyncio.sleep(FAULTS["timeout_seconds"])
+    delay = latency.sample()
+    if delay:
+        await asyncio.sleep(delay)
+    if FAULTS["error_rate"] and random.random() < FAULTS["error_rate"]:
+        raise HTTPException(status_code=503, detail="Falha injetada")
+
+
 @app.get("/debts/{cpf}", response_model=DebtResponse)
 async def get_debt(cpf: str):
-    # Remove caracteres não numéricos
-    clean_cpf = "".join(filter(str.isdigit, cpf))
-    
-    if clean_cpf in MOCK_DEBTS:
-        return MOCK_DEBTS[clean_cpf]
-    
-    # Retorno padrão para CPFs não encontrados (simulando um cliente novo ou genérico)
-    return {
-        "nome": "Cliente",
-        "valor": 100.00,
-        "empresa": "Empresa Parceira",
-        "score": 500,
-        "status": "regular"
-    }
+    await inject_faults()
+    return store.get(clean(cpf)) or DEFAULT_DEBT
+
+
+@app.post("/debts/batch")
+async def get_debts_batch(request: BatchRequest):
+    """Consulta vários CPFs numa requisição; os não encontrados vêm em not_found."""
+    if len(request.cpfs) > BATCH_LIMIT:
+        raise HTTPException(status_code=413, detail=f"Máximo de {BATCH_LIMIT} CPFs por lote")
+    await inject_faults()
+    cpfs = [clean(cpf) for cpf in request.cpfs]
+    found = store.get_many(cpfs)
+    return {"debts": found, "not_found": [cpf for cpf in dict.fromkeys(cpfs) if cpf not in found]}
+
+
+@app.get("/cpfs/sample")
+async def sample_cpfs(n: int = 10, seed: Optional[int] = None):
+    """CPFs existentes na base, sorteados pelo índice (sem consultar o disco)."""
+    rng = random.Random(seed)
+    return {"cpfs": [debt_store.cpf_for_index(rng.randrange(store.count)) for _ in range(min(n, BATCH_LIMIT))]}
+
+
+@app.get("/config")
+async def get_config():
+    return {**FAULTS, "customers": store.count, "batch_limit": BATCH_LIMIT}
+
+
+@app.put("/config")
+async def update_config(config: FaultConfig):
+    """Ajusta as falhas injetadas sem reiniciar a API."""
+    global latency
+    changes = config.model_dump(exclude_none=True)
+    if "latency" in changes:
+        try:
+            latency = Latency(changes["latency"])
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+    FAULTS.update(changes)
+    print(f"[MOCK] Falhas injetadas: {FAULTS}")
+    return FAULTS
+
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
+    parser = argparse.ArgumentParser(description="API Mock de Dívidas")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--count", type=int, help="Clientes na base gerada (padrão: MOCK_DEBTS_COUNT)")
+    args = parser.parse_args()
+    if args.count:
+        debt_store.DATASET_SIZE = args.count
+    uvicorn.run(app, host="0.0.0.0", port=args.port)
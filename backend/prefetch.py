@@ -0,0 +1,208 @@
+"""
+Pré-carregamento de áudio guiado pelo tráfego.
+
+TransitionStats aprende, a partir das conversas concluídas, quantas vezes cada
+estado de espera levou a cada próximo estado. PrefetchScheduler usa essas
+frequências para ordenar as falas prováveis dos próximos turnos (estáticas e
+dinâmicas, já com os valores do cliente) e sintetiza as mais prováveis primeiro.
+O pré-carregamento usa no máximo PREFETCH_CONCURRENCY vagas do orçamento de TTS
+e entra na fila dele com a menor prioridade: quando falta vaga, as falas ao vivo
+são atendidas antes.
+"""
+import os
+import json
+import time
+import asyncio
+import itertools
+from collections import OrderedDict
+
+import tree_service
+from metrics import REGISTRY
+
+TRANSITION_STATS_FILE = os.getenv("TRANSITION_STATS_FILE") or os.path.join(os.path.dirname(__file__), "transition_stats.json")
+# Sínteses de pré-carregamento em paralelo (a fatia do orçamento de TTS usada pelo prefetch)
+PREFETCH_CONCURRENCY = int(os.getenv("PREFETCH_CONCURRENCY", "2"))
+# Máximo de segmentos agendados por turno (orçamento de TTS do prefetch)
+PREFETCH_BUDGET = int(os.getenv("PREFETCH_BUDGET", "12"))
+# Probabilidade mínima para um segmento valer a síntese antecipada
+PREFETCH_MIN_PROBABILITY = float(os.getenv("PREFETCH_MIN_PROBABILITY", "0.02"))
+# Contagem "fantasma" dada a transições nunca vistas (suavização de Laplace)
+SMOOTHING = 1.0
+
+PREFETCH_JOBS = REGISTRY.counter(
+    "voicebot_prefetch_jobs_total",
+    "Trabalhos do pré-carregamento por resultado (synthesized, already_cached, stale, error)",
+    ["result"],
+)
+PREFETCH_PLAYED = REGISTRY.counter(
+    "voicebot_prefetch_played_total",
+    "Segmentos sintetizados pelo pré-carregamento que depois foram tocados numa fala",
+)
+REGISTRY.gauge(
+    "voicebot_prefetch_played_ratio",
+    "Fração dos segmentos sintetizados pelo pré-carregamento que chegaram a ser tocados",
+    function=lambda: PREFETCH_PLAYED.get() / max(1, PREFETCH_JOBS.get(result="synthesized")),
+)
+
+
+class TransitionStats:
+    """Contagem de transições estado -> próximo estado observadas em conversas concluídas."""
+
+    def __init__(self, path=TRANSITION_STATS_FILE, save_interval=30.0):
+        self.path = path
+        self.save_interval = save_interval
+        self.counts = {}
+        self._dirty = False
+        self._last_save = time.time()
+        if path and os.path.exists(path):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    self.counts = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"[PREFETCH] Não foi possível ler {path}: {e}")
+
+    def record_path(self, states):
+        """Registra a sequência de estados de uma conversa (ex: START, capturar_cpf, identificar_intencao...)."""
+        states = [s for s in states if s]
+        for current, following in zip(states, states[1:]):
+            edges = self.counts.setdefault(current, {})
+            edges[following] = edges.get(following, 0) + 1
+            self._dirty = True
+        if self._dirty and time.time() - self._last_save >= self.save_interval:
+            self.save()
+
+    def probabilities(self, state, candidates):
+        """Probabilidade de cada candidato ser o próximo estado, com suavização para os nunca vistos."""
+        if not candidates:
+            return {}
+        edges = self.counts.get(state, {})
+        total = sum(edges.get(c, 0) for c in candidates) + SMOOTHING * len(candidates)
+        return {c: (edges.get(c, 0) + SMOOTHING) / total for c in candidates}
+
+    def flush(self):
+        """Grava as transições ainda não salvas (encerramento do servidor)."""
+        if self._dirty:
+            self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.counts, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+        self._last_save = time.time()
+
+
+class PrefetchScheduler:
+    """
+    Fila de prioridade de sínteses antecipadas.
+
+    synthesize(text, is_static) é a corrotina que garante o áudio no cache e
+    retorna True se precisou sintetizar (False se já estava em cache).
+    """
+
+    def __init__(self, synthesize, stats, concurrency=PREFETCH_CONCURRENCY, budget=PREFETCH_BUDGET):
+        self.synthesize = synthesize
+        self.stats = stats
+        self.concurrency = concurrency
+        self.budget = budget
+        self._queue = None
+        self._workers = []
+        self._seq = itertools.count()
+        self._generations = {}
+        # Segmentos sintetizados pelo prefetch e ainda não tocados
+        self._prefetched = OrderedDict()
+        REGISTRY.gauge("voicebot_prefetch_queue_size", "Trabalhos aguardando na fila de pré-carregamento",
+                       function=lambda: self._queue.qsize() if self._queue else 0)
+
+    def _start(self):
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        """Cancela os workers e descarta a fila (encerramento do servidor)."""
+        workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        self._queue = None
+        self._generations.clear()
+
+    def candidates(self, state, session_data, depth=None, index=None):
+        """Segmentos prováveis dos próximos turnos com a probabilidade estimada de cada um ser falado."""
+        index = index or tree_service.flow_index()
+        depth = depth or index.depth
+        vars = None
+        rendered = {}
+        scores = {}
+        frontier = [(state, 1.0)]
+        for _ in range(depth):
+            next_frontier = []
+            for current, probability in frontier:
+                # Transições pré-calculadas no índice do fluxo, ponderadas pelas frequências observadas
+                transitions = index.transitions.get(current, {})
+                probabilities = self.stats.probabilities(current, list(transitions))
+                for end, weights in transitions.items():
+                    end_probability = probability * probabilities[end]
+                    for node_id, weight in weights:
+                        if node_id not in rendered:
+                            parts = index.parts.get(node_id, [])
+                            if vars is None and any(kind == "dynamic" for kind, _ in parts):
+                                vars = tree_service.get_template_vars(session_data)
+                            rendered[node_id] = [(seg["type"], seg["text"]) for seg in tree_service.render_message(parts, vars or {})]
+                        for key in rendered[node_id]:
+                            scores[key] = scores.get(key, 0.0) + end_probability * weight
+                    if index.nodes[end]["type"] in tree_service.WAIT_TYPES:
+                        next_frontier.append((end, end_probability))
+            frontier = next_frontier
+        return sorted(scores.items(), key=lambda item: -item[1])
+
+    def schedule(self, client_id, state, session_data, index=None):
+        """Agenda as sínteses mais prováveis a partir de state; trabalhos antigos da sessão ficam obsoletos."""
+        self._start()
+        generation = self._generations.get(client_id, 0) + 1
+        self._generations[client_id] = generation
+        scheduled = 0
+        for (seg_type, text), probability in self.candidates(state, session_data, index=index):
+            if scheduled >= self.budget or probability < PREFETCH_MIN_PROBABILITY:
+                break
+            if not text.strip():
+                continue
+            job = (client_id, generation, text, seg_type == "static")
+            self._queue.put_nowait((-probability, next(self._seq), job))
+            scheduled += 1
+        if scheduled:
+            print(f"[PREFETCH] {scheduled} segmentos agendados a partir de {state}")
+
+    def forget(self, client_id):
+        """Descarta os trabalhos pendentes de uma sessão encerrada."""
+        self._generations.pop(client_id, None)
+
+    async def _worker(self):
+        while True:
+            _, _, (client_id, generation, text, is_static) = await self._queue.get()
+            try:
+                if self._generations.get(client_id) != generation:
+                    PREFETCH_JOBS.inc(result="stale")
+                    continue
+                # A síntese entra no orçamento de TTS com PRIORITY_PREFETCH (ver prefetch_audio no main.py)
+                synthesized = await self.synthesize(text, is_static)
+                if synthesized:
+                    self._prefetched[(is_static, text)] = True
+                    while len(self._prefetched) > 10000:
+                        self._prefetched.popitem(last=False)
+                PREFETCH_JOBS.inc(result="synthesized" if synthesized else "already_cached")
+            except Exception as e:
+                PREFETCH_JOBS.inc(result="error")
+                print(f"[PREFETCH] Erro ao sintetizar \"{text[:30]}\": {e}")
+            finally:
+                self._queue.task_done()
+
+    def record_played(self, segments):
+        """Contabiliza quais segmentos de uma fala tocada vieram do pré-carregamento."""
+        for seg in segments:
+            if self._prefetched.pop((seg["type"] == "static", seg["text"]), None) is not None:
+                PREFETCH_PLAYED.inc()
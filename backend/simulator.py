@@ -0,0 +1,333 @@
+"""
+Simulador em lote de conversas do modo Árvore, só texto (sem áudio).
+
+Conduz get_tree_response por conversas roteirizadas (CPF + falas do usuário)
+e devolve, para cada uma, os nós percorridos, os valores capturados na sessão
+e o tempo de cada passo. Serve para testar regressões após editar o fluxo e
+para medir a vazão do motor numa escala que o caminho com áudio não alcança.
+
+Roteiro (JSON, lista de conversas):
+    [{"name": "parcelamento", "cpf": "12345678901",
+      "utterances": ["quero negociar", "quero parcelar", "em 3 vezes", "sim"],
+      "expect": {"final_state": "final_sucesso", "captured": {"num_parcelas": "3"}}}]
+
+Classificadores (--classifier):
+    local -> classificador por palavras-chave de stubs.py, sem latência
+    stub  -> o mesmo, com a latência simulada de LLM (STUB_LLM_LATENCY)
+    llm   -> classify_with_llm real (OpenAI)
+
+Uso:
+    python simulator.py roteiros.json --workers 8 --output resultado.json
+    python simulator.py --generate 10000 --workers 8        # conversas aleatórias, mede vazão
+    python simulator.py roteiros.json --compare resultado_anterior.json
+    python simulator.py roteiros.json --flow flows/novo.json --compare resultado_anterior.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+from types import SimpleNamespace
+from contextlib import contextmanager, redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
+
+import stubs
+import flows
+import debt_store
+import tree_service
+from flow_data import load_flow_file
+
+CLASSIFIERS = {
+    "local": stubs.classify_locally,
+    "stub": stubs.classify_with_llm,
+    "llm": None,  # mantém tree_service.classify_with_llm
+}
+
+# Chaves da sessão que não são valores capturados na conversa
+SESSION_INTERNAL_KEYS = ("history", "mode", "tree_state", "debt_info")
+
+# calcular_desconto sorteia a disponibilidade pelo relógio; com o relógio
+# congelado o resultado de cada roteiro fica reproduzível (desconto disponível)
+FROZEN_CLOCK = SimpleNamespace(time=lambda: 0.0)
+
+
+def local_debt_lookup(cpf):
+    """Consulta de dívida em memória (sem a API mock): os clientes fixos e o registro padrão da API mock."""
+    digits = "".join(filter(str.isdigit, cpf or ""))
+    return debt_store.FIXED_DEBTS.get(digits, debt_store.DEFAULT_DEBT)
+
+
+def configure_engine(classifier="local", debts="local", deterministic=True, flow_file=None):
+    """Troca classificador, consulta de dívida, relógio e (opcionalmente) o fluxo do tree_service. Retorna a configuração anterior."""
+    original = (tree_service.classify_with_llm, tree_service.mock_api_query, tree_service.time,
+                tree_service.TREE_FLOW_DATA, tree_service.FLOW_INDEX)
+    if CLASSIFIERS[classifier] is not None:
+        tree_service.classify_with_llm = CLASSIFIERS[classifier]
+    if debts == "local":
+        tree_service.mock_api_query = local_debt_lookup
+    if deterministic:
+        tree_service.time = FROZEN_CLOCK
+    if flow_file:
+        # Mesma validação/compilação da recarga a quente: um fluxo inválido nem chega a rodar
+        version = flows.FlowVersion(load_flow_file(flow_file), flow_file)
+        tree_service.TREE_FLOW_DATA, tree_service.FLOW_INDEX = version.flow, version.index
+    return original
+
+
+@contextmanager
+def engine(classifier="local", debts="local", deterministic=True, flow_file=None):
+    """Configura o motor durante a simulação e restaura ao final."""
+    original = configure_engine(classifier, debts, deterministic, flow_file)
+    try:
+        yield
+    finally:
+        (tree_service.classify_with_llm, tree_service.mock_api_query, tree_service.time,
+         tree_service.TREE_FLOW_DATA, tree_service.FLOW_INDEX) = original
+
+
+def new_session():
+    # Mesmo formato da sessão criada pelo websocket_endpoint do main.py
+    return {"history": [], "mode": "tree", "tree_state": "START", "debt_info": None, "nome_cliente": None}
+
+
+def script_turns(script):
+    """Falas da conversa: abertura, CPF (se houver) e as falas roteirizadas."""
+    turns = [script.get("opening", "alô")]
+    if script.get("cpf"):
+        turns.append(f"meu cpf é {script['cpf']}")
+    return turns + list(script.get("utterances", []))
+
+
+def simulate_conversation(script):
+    """Executa um roteiro no motor da árvore (já configurado por engine()) e retorna o resultado."""
+    session = new_session()
+    steps = []
+    path = ["START"]
+    error = None
+    for user_text in script_turns(script):
+        trace = []
+        start = time.perf_counter()
+        try:
+            segments, next_state, updates = tree_service.get_tree_response(user_text, session, trace)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            break
+        elapsed = time.perf_counter() - start
+        bot_text = "".join(s["text"] for s in segments)
+        steps.append({
+            "user": user_text,
+            "from": session["tree_state"],
+            "to": next_state,
+            "nodes": trace,
+            "bot": bot_text,
+            "seconds": elapsed,
+        })
+        session.update(updates)
+        session["tree_state"] = next_state
+        session["history"].append({"role": "user", "text": user_text})
+        session["history"].append({"role": "assistant", "text": bot_text})
+        path.append(next_state)
+        if next_state is None:
+            break
+
+    result = {
+        "name": script.get("name"),
+        "cpf": script.get("cpf"),
+        "path": path,
+        "nodes": [node for step in steps for node in step["nodes"]],
+        "final_state": session["tree_state"],
+        "captured": {k: v for k, v in session.items() if k not in SESSION_INTERNAL_KEYS},
+        "steps": steps,
+        "error": error,
+    }
+    result["failures"] = check_expectations(result, script.get("expect") or {})
+    return result
+
+
+def check_expectations(result, expect):
+    failures = []
+    if "final_state" in expect and result["final_state"] != expect["final_state"]:
+        failures.append(f"final_state: esperado {expect['final_state']}, obtido {result['final_state']}")
+    if "path" in expect and result["path"] != expect["path"]:
+        failures.append(f"path: esperado {expect['path']}, obtido {result['path']}")
+    for node in expect.get("visits", []):
+        if node not in result["nodes"]:
+            failures.append(f"visits: nó {node} não foi visitado")
+    for key, value in expect.get("captured", {}).items():
+        if str(result["captured"].get(key)) != str(value):
+            failures.append(f"captured.{key}: esperado {value}, obtido {result['captured'].get(key)}")
+    if result["error"]:
+        failures.append(f"erro: {result['error']}")
+    return failures
+
+
+# --- Execução em paralelo ---
+
+def _worker_init(classifier, debts, deterministic, flow_file, quiet):
+    # Cada processo configura o motor uma única vez e mantém a configuração até o fim
+    configure_engine(classifier, debts, deterministic, flow_file)
+    if quiet:
+        sys.stdout = open(os.devnull, "w")
+
+
+def run_batch(scripts, classifier="local", debts="local", workers=None, deterministic=True, quiet=True, flow_file=None):
+    """
+    Simula os roteiros e retorna a lista de resultados na mesma ordem.
+    workers=1 roda no processo atual; None usa um processo por CPU.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        with engine(classifier, debts, deterministic, flow_file), open(os.devnull, "w") as devnull, \
+                redirect_stdout(devnull if quiet else sys.stdout):
+            return [simulate_conversation(script) for script in scripts]
+    chunksize = max(1, len(scripts) // (workers * 8))
+    with ProcessPoolExecutor(workers, initializer=_worker_init,
+                             initargs=(classifier, debts, deterministic, flow_file, quiet)) as pool:
+        return list(pool.map(simulate_conversation, scripts, chunksize=chunksize))
+
+
+# --- Roteiros gerados ---
+
+GENERATED_UTTERANCES = [
+    ["quero negociar a minha dívida", "quero parcelar", "em {n} vezes", "sim pode confirmar"],
+    ["quero negociar", "prefiro mudar a data", "dia {d} do mês que vem", "sim"],
+    ["quero consultar o valor", "quero quitar tudo à vista", "pode confirmar"],
+    ["quero negociar", "quero um desconto", "sim confirmo"],
+    ["quero falar com um atendente"],
+]
+
+
+def generate_scripts(count, seed=0, dataset_size=None):
+    """
+    Roteiros aleatórios (CPFs conhecidos e desconhecidos) para medir vazão.
+    Com dataset_size, os CPFs conhecidos são sorteados da base gerada da API Mock (debt_store).
+    """
+    rng = random.Random(seed)
+    known = list(debt_store.FIXED_DEBTS)
+    scripts = []
+    for i in range(count):
+        if rng.random() >= 0.5:
+            cpf = "".join(rng.choice("0123456789") for _ in range(11))
+        elif dataset_size:
+            cpf = debt_store.cpf_for_index(rng.randrange(dataset_size))
+        else:
+            cpf = rng.choice(known)
+        utterances = [u.format(n=rng.randint(2, 12), d=rng.randint(1, 28)) for u in rng.choice(GENERATED_UTTERANCES)]
+        scripts.append({"name": f"gerado_{i}", "cpf": cpf, "utterances": utterances})
+    return scripts
+
+
+# --- Relatório ---
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, int(round(p / 100 * len(ordered))) - 1)]
+
+
+def summarize(results, elapsed):
+    step_times = [step["seconds"] for r in results for step in r["steps"]]
+    final_states = {}
+    for r in results:
+        final_states[r["final_state"]] = final_states.get(r["final_state"], 0) + 1
+    return {
+        "conversations": len(results),
+        "steps": len(step_times),
+        "elapsed_s": elapsed,
+        "conversations_per_s": len(results) / elapsed if elapsed else 0,
+        "steps_per_s": len(step_times) / elapsed if elapsed else 0,
+        "step_p50_s": percentile(step_times, 50),
+        "step_p95_s": percentile(step_times, 95),
+        "step_mean_s": statistics.mean(step_times) if step_times else None,
+        "errors": sum(1 for r in results if r["error"]),
+        "failed_expectations": sum(1 for r in results if r["failures"]),
+        "final_states": dict(sorted(final_states.items(), key=lambda item: -item[1])),
+    }
+
+
+def compare_paths(baseline, results):
+    """Conversas (pelo nome) cujo caminho ou valores capturados mudaram em relação a uma execução anterior."""
+    before = {r["name"]: r for r in baseline}
+    changes = []
+    for r in results:
+        old = before.get(r["name"])
+        if old is None:
+            continue
+        if old["nodes"] != r["nodes"] or old["captured"] != r["captured"]:
+            changes.append((r["name"], old, r))
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulador em lote de conversas do modo Árvore (sem áudio)")
+    parser.add_argument("scripts", nargs="?", help="JSON com a lista de roteiros")
+    parser.add_argument("--generate", type=int, help="Gera N roteiros aleatórios em vez de ler um arquivo")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--classifier", choices=sorted(CLASSIFIERS), default="local")
+    parser.add_argument("--debts", choices=["local", "api"], default="local",
+                        help="local = dados em memória; api = API mock na porta 8001")
+    parser.add_argument("--flow", help="Arquivo de fluxo (JSON/YAML) a testar no lugar do fluxo ativo")
+    parser.add_argument("--workers", type=int, default=None, help="Processos em paralelo (padrão: nº de CPUs)")
+    parser.add_argument("--live-clock", action="store_true", help="Não congela o relógio (calcular_desconto volta a ser aleatório)")
+    parser.add_argument("--verbose", action="store_true", help="Mantém os prints do motor")
+    parser.add_argument("--output", help="Grava os resultados (e o resumo) em JSON")
+    parser.add_argument("--compare", help="Resultado anterior (--output) para apontar conversas com caminho alterado")
+    args = parser.parse_args()
+
+    if args.generate:
+        # Com a API Mock, os CPFs vêm da base gerada (MOCK_DEBTS_COUNT clientes)
+        scripts = generate_scripts(args.generate, args.seed, debt_store.DATASET_SIZE if args.debts == "api" else None)
+    elif args.scripts:
+        with open(args.scripts, encoding="utf-8") as f:
+            scripts = json.load(f)
+    else:
+        parser.error("informe o arquivo de roteiros ou --generate N")
+
+    if args.flow:
+        try:
+            flows.FlowVersion(load_flow_file(args.flow), args.flow)
+        except flows.FlowValidationError as e:
+            print(f"[SIM] Fluxo {args.flow} inválido:")
+            for error in e.errors:
+                print(f"  {error}")
+            sys.exit(2)
+
+    start = time.perf_counter()
+    results = run_batch(scripts, args.classifier, args.debts, args.workers, not args.live_clock, not args.verbose, args.flow)
+    summary = summarize(results, time.perf_counter() - start)
+
+    print(f"[SIM] {summary['conversations']} conversas, {summary['steps']} passos em {summary['elapsed_s']:.2f}s "
+          f"({summary['conversations_per_s']:.0f} conversas/s, {summary['steps_per_s']:.0f} passos/s)")
+    if summary["step_p50_s"] is not None:
+        print(f"[SIM] Passo: p50={summary['step_p50_s'] * 1000:.3f}ms  p95={summary['step_p95_s'] * 1000:.3f}ms")
+    print(f"[SIM] Estados finais: {summary['final_states']}")
+
+    failed = False
+    for r in results:
+        for failure in r["failures"]:
+            failed = True
+            print(f"  FALHA {r['name']}: {failure}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        changes = compare_paths(baseline, results)
+        print(f"[SIM] {len(changes)} conversas com caminho/valores alterados em relação a {args.compare}")
+        for name, old, new in changes[:20]:
+            print(f"  {name}: {' > '.join(old['nodes'])}\n  {' ' * len(name)}  {' > '.join(new['nodes'])}")
+        failed = failed or bool(changes)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "results": results}, f, ensure_ascii=False, indent=1)
+        print(f"[SIM] Resultados gravados em {args.output}")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+Substitutos locais para STT, TTS e LLM, usados em testes de carga.
+
+Ativados com VOICE_BOT_STUBS=1. Cada serviço simula a latência do serviço real
+a partir de uma distribuição configurável por variável de ambiente:
+
+    STUB_STT_LATENCY        (padrão "lognormal:0.35:0.3")
+    STUB_TTS_LATENCY        (padrão "lognormal:0.25:0.3")
+    STUB_LLM_LATENCY        (padrão "lognormal:0.5:0.4")  -> até a resposta/primeiro token
+    STUB_LLM_TOKEN_LATENCY  (padrão "const:0.02")         -> entre tokens do stream
+
+Formatos aceitos: os de latency.py ("const:s", "uniform:min:max",
+"normal:media:desvio" e "lognormal:mediana:sigma", em segundos).
+
+O STT não transcreve de verdade: ele procura a impressão digital do áudio
+recebido no manifesto de transcrições (STUB_TRANSCRIPTS), escrito pelo
+gerador de carga antes de iniciar as chamadas.
+"""
+import os
+import io
+import re
+import json
+import time
+import wave
+import asyncio
+import hashlib
+import unicodedata
+from types import SimpleNamespace
+
+# Com simuladores a chave real é dispensável (o modo IA só confere se há uma configurada)
+os.environ.setdefault("OPENAI_API_KEY", "stub")
+
+from tree_service import TreeAnalysis
+from metrics import span
+from latency import Latency
+
+
+STT_LATENCY = Latency.from_env("STUB_STT_LATENCY", "lognormal:0.35:0.3")
+TTS_LATENCY = Latency.from_env("STUB_TTS_LATENCY", "lognormal:0.25:0.3")
+LLM_LATENCY = Latency.from_env("STUB_LLM_LATENCY", "lognormal:0.5:0.4")
+LLM_TOKEN_LATENCY = Latency.from_env("STUB_LLM_TOKEN_LATENCY", "const:0.02")
+
+
+def normalize_text(text):
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+# --- STT ---
+
+def fingerprint_pcm(frames):
+    """Impressão digital de um áudio a partir das amostras PCM (independe do cabeçalho)."""
+    return hashlib.sha1(frames).hexdigest()
+
+
+def fingerprint_wav(wav_bytes):
+    with wave.open(io.BytesIO(wav_bytes), "rb") as wav:
+        return fingerprint_pcm(wav.readframes(wav.getnframes()))
+
+
+_transcripts = {"mtime": None, "entries": {}}
+
+
+def _load_transcripts():
+    path = os.getenv("STUB_TRANSCRIPTS")
+    if not path or not os.path.exists(path):
+        return _transcripts["entries"]
+    mtime = os.path.getmtime(path)
+    if mtime != _transcripts["mtime"]:
+        with open(path, encoding="utf-8") as f:
+            _transcripts["entries"] = json.load(f)
+        _transcripts["mtime"] = mtime
+    return _transcripts["entries"]
+
+
+def transcribe_audio(wav_path):
+    """STT simulado: devolve a transcrição registrada para o áudio (ou "" se desconhecido)."""
+    time.sleep(STT_LATENCY.sample())
+    with open(wav_path, "rb") as f:
+        fingerprint = fingerprint_wav(f.read())
+    return _load_transcripts().get(fingerprint, "")
+
+
+# --- TTS ---
+
+_silence_cache = {}
+
+
+def _silent_mp3(duration_ms):
+    # Edge-TTS entrega MP3 mono 24 kHz / 48 kbps; reproduzimos o mesmo formato
+    duration_ms = max(100, int(round(duration_ms, -2)))
+    if duration_ms not in _silence_cache:
+        from pydub import AudioSegment
+        buffer = io.BytesIO()
+        AudioSegment.silent(duration=duration_ms, frame_rate=24000).export(buffer, format="mp3", bitrate="48k")
+        _silence_cache[duration_ms] = buffer.getvalue()
+    return _silence_cache[duration_ms]
+
+
+async def synthesize_speech(text, path):
+    """TTS simulado: espera a latência configurada e grava silêncio com a duração aproximada da fala."""
+    await asyncio.sleep(TTS_LATENCY.sample())
+    # ~14 caracteres por segundo com a taxa de fala +20%
+    audio = _silent_mp3(len(text) / 14 * 1000)
+    with open(path, "wb") as f:
+        f.write(audio)
+
+
+# --- LLM (modo árvore) ---
+
+# Palavras extras que indicam cada chave de intents/options além das contidas na própria chave
+KEYWORD_ALIASES = {
+    "confirmar": ["sim", "confirmo", "pode", "fechado", "ok"],
+    "cancelar": ["nao", "desisto"],
+    "alterar": ["mudar", "outra"],
+    "negociar_divida": ["acordo", "pagar"],
+    "falar_com_atendente": ["humano", "pessoa"],
+    "parcelar_divida": ["parcelas", "vezes"],
+    "solicitar_desconto": ["desconto"],
+    "quitar_a_vista": ["tudo", "vista"],
+    "renegociar_data": ["data", "dia", "adiar"],
+}
+
+
+def match_option(user_text, options):
+    """Escolhe a chave de options/intents com mais palavras em comum com a fala do usuário."""
+    words = set(re.findall(r"\w+", normalize_text(user_text)))
+    best_key, best_score = None, 0
+    for key in options:
+        keywords = [w for w in key.split("_") if len(w) > 3] + KEYWORD_ALIASES.get(key, [])
+        score = sum(1 for keyword in keywords if keyword in words)
+        if score > best_score:
+            best_key, best_score = key, score
+    return best_key
+
+
+def classify_locally(user_text, node_id, node_config, history=[]):
+    """Classificador local determinístico, com a mesma interface de classify_with_llm."""
+    options = node_config.get("intents") or node_config.get("options") or {}
+    if node_config.get("type") == "INPUT":
+        digits = re.sub(r"\D", "", user_text)
+        return TreeAnalysis(next_node_id=node_config["next"], captured_value=digits or user_text, reasoning="stub")
+    if options:
+        if user_text.startswith("[SYSTEM]"):
+            return TreeAnalysis(next_node_id=list(options.values())[0], reasoning="stub: decisão automática")
+        key = match_option(user_text, options)
+        if key:
+            return TreeAnalysis(next_node_id=options[key], reasoning=f"stub: {key}")
+        return TreeAnalysis(next_node_id=node_id, reasoning="stub: sem correspondência")
+    return TreeAnalysis(next_node_id=node_config.get("next") or node_id, reasoning="stub")
+
+
+def classify_with_llm(user_text, node_id, node_config, history=[]):
+    """Substituto de tree_service.classify_with_llm: latência de LLM + classificador local."""
+    with span("classify", "system" if user_text.startswith("[SYSTEM]") else "user"):
+        time.sleep(LLM_LATENCY.sample())
+        return classify_locally(user_text, node_id, node_config, history)
+
+
+# --- LLM (modo IA) ---
+
+CANNED_REPLIES = [
+    "Entendo a sua situação. Podemos buscar juntos uma condição que caiba no seu orçamento.",
+    "Certo, vou verificar as opções disponíveis para você. Prefere pagar à vista ou parcelado?",
+    "Perfeito, obrigado pela informação. Posso registrar o acordo agora?",
+]
+
+
+def _tool_call(name, arguments):
+    call_id = "call_" + hashlib.sha1(f"{name}{arguments}{time.time()}".encode()).hexdigest()[:12]
+    function = SimpleNamespace(name=name, arguments=json.dumps(arguments))
+    call = SimpleNamespace(id=call_id, type="function", function=function)
+    call.model_dump = lambda: {"id": call_id, "type": "function", "function": {"name": name, "arguments": function.arguments}}
+    return call
+
+
+def _last_user_text(messages):
+    for msg in reversed(messages):
+        if isinstance(msg, dict) and msg.get("role") == "user":
+            return msg.get("content") or ""
+    return ""
+
+
+def _has_tool_result(messages):
+    return any(isinstance(msg, dict) and msg.get("role") == "tool" for msg in messages)
+
+
+class _FakeCompletions:
+    def create(self, model, messages, tools=None, tool_choice=None, stream=False, **kwargs):
+        time.sleep(LLM_LATENCY.sample())
+        user_text = _last_user_text(messages)
+        cpf = re.sub(r"\D", "", user_text)
+        if not stream:
+            tool_calls = None
+            if tools and len(cpf) == 11 and not _has_tool_result(messages):
+                tool_calls = [_tool_call("get_debt_info", {"cpf": cpf})]
+            message = SimpleNamespace(role="assistant", content=None if tool_calls else CANNED_REPLIES[0], tool_calls=tool_calls)
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+        if tools and len(cpf) == 11 and not _has_tool_result(messages):
+            return self._stream_tool_call(_tool_call("get_debt_info", {"cpf": cpf}))
+        reply = CANNED_REPLIES[int(hashlib.md5(user_text.encode()).hexdigest(), 16) % len(CANNED_REPLIES)]
+        return self._stream(reply)
+
+    def _stream(self, reply):
+        tokens = re.findall(r"\S+\s*", reply)
+        for i, token in enumerate(tokens):
+            if i:
+                time.sleep(LLM_TOKEN_LATENCY.sample())
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token, tool_calls=None))])
+
+    def _stream_tool_call(self, call):
+        # Como na API: o primeiro delta traz id e nome; os argumentos chegam em pedaços
+        arguments = call.function.arguments
+        pieces = [arguments[i:i + 8] for i in range(0, len(arguments), 8)]
+        for i, piece in enumerate(pieces):
+            if i:
+                time.sleep(LLM_TOKEN_LATENCY.sample())
+            function = SimpleNamespace(name=call.function.name if i == 0 else None, arguments=piece)
+            delta = SimpleNamespace(index=0, id=call.id if i == 0 else None, type="function" if i == 0 else None, function=function)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=None, tool_calls=[delta]))])
+
+
+class FakeOpenAI:
+    """Cliente com a mesma superfície do OpenAI usada em llm_service."""
+
+    def __init__(self):
+        self.chat = SimpleNamespace(completions=_FakeCompletions())
+
+
+def install():
+    """Troca os clientes de LLM dos serviços pelos substitutos locais."""
+    import tree_service
+    import clients
+    tree_service.classify_with_llm = classify_with_llm
+    clients.override("openai", FakeOpenAI())
+    print("[STUBS] STT, TTS e LLM substituídos por simuladores locais.")
@@ -0,0 +1,94 @@
+import pytest
+
+import decision_rules
+from decision_rules import decide, matches, resolve, resolve_llm, validate_rules
+
+NODE = {
+    "type": "ACTION",
+    "options": {"consultar": "api_consultar_score", "pular": "capturar_nome"},
+    "rules": [
+        {"when": {"debt_info.score": {"exists": False}}, "then": "consultar"},
+        {"any": [{"debt_info.valor": {"gte": 500}}, {"debt_info.status": "em_atraso"}], "then": "consultar"},
+    ],
+    "default": "pular",
+}
+
+
+def test_resolve_dotted_path():
+    context = {"debt_info": {"score": 0, "nested": {"a": 1}}}
+    assert resolve(context, "debt_info.score") == 0
+    assert resolve(context, "debt_info.nested.a") == 1
+    assert resolve(context, "debt_info.missing") is decision_rules._MISSING
+    assert resolve(context, "debt_info.score.x") is decision_rules._MISSING
+
+
+@pytest.mark.parametrize("when, expected", [
+    ({"valor": 100}, True),
+    ({"valor": {"eq": 100}}, True),
+    ({"valor": {"ne": 100}}, False),
+    ({"valor": {"gt": 99, "lte": 100}}, True),
+    ({"valor": {"lt": 100}}, False),
+    ({"status": {"in": ["regular", "negociado"]}}, True),
+    ({"status": {"not_in": ["regular"]}}, False),
+    ({"score": {"exists": False}}, True),
+    ({"score": {"gte": 500}}, False),        # None não é comparável
+    ({"ausente": {"exists": False}}, True),
+    ({"ausente": {"eq": None}}, False),      # campo inexistente não casa
+    ({"status": {"gt": 3}}, False),          # texto vs número não casa
+])
+def test_matches(when, expected):
+    context = {"valor": 100, "status": "regular", "score": None}
+    assert matches(when, context) is expected
+
+
+def test_decide_first_matching_rule():
+    context = {"debt_info": {"score": None, "valor": 100, "status": "regular"}}
+    assert decide("n", NODE, context) == ("api_consultar_score", "rule")
+
+
+def test_decide_any_alternative():
+    context = {"debt_info": {"score": 700, "valor": 100, "status": "em_atraso"}}
+    assert decide("n", NODE, context) == ("api_consultar_score", "rule")
+
+
+def test_decide_default():
+    context = {"debt_info": {"score": 700, "valor": 100, "status": "regular"}}
+    assert decide("n", NODE, context) == ("capturar_nome", "default")
+    without_default = {**NODE, "default": None}
+    assert decide("n", without_default, context) == ("api_consultar_score", "default")
+
+
+def test_decide_llm_fallback_records_real_source():
+    node = {**NODE, "rules": [], "llm_fallback": True}
+    llm_before = decision_rules.AUTO_DECISIONS.get(node="fb", source="llm")
+    default_before = decision_rules.AUTO_DECISIONS.get(node="fb", source="default")
+    assert decide("fb", node, {}) == (None, "llm")
+    assert decision_rules.AUTO_DECISIONS.get(node="fb", source="llm") == llm_before
+
+    assert resolve_llm("fb", node, "api_consultar_score") == ("api_consultar_score", "llm")
+    assert decision_rules.AUTO_DECISIONS.get(node="fb", source="llm") == llm_before + 1
+    # Erro do LLM devolve o próprio nó: vale o default
+    assert resolve_llm("fb", node, "fb") == ("capturar_nome", "default")
+    assert decision_rules.AUTO_DECISIONS.get(node="fb", source="default") == default_before + 1
+
+
+def test_validate_rules_ok():
+    assert validate_rules("n", NODE) == []
+
+
+def test_validate_rules_errors():
+    node = {
+        "options": {"a": "x"},
+        "rules": [
+            {"when": {"v": {"between": [1, 2]}}, "then": "a"},
+            {"when": {}, "then": "b"},
+        ],
+        "default": "c",
+    }
+    errors = validate_rules("n", node)
+    assert len(errors) == 4
+    assert any("operador desconhecido ['between']" in e for e in errors)
+    assert any("opção inexistente 'b'" in e for e in errors)
+    assert any("sem condições" in e for e in errors)
+    assert any("default 'c'" in e for e in errors)
+    assert validate_rules("n", {"options": {}, "rules": {}}) == ["n: 'rules' deve ser uma lista"]
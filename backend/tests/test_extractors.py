@@ -0,0 +1,115 @@
+from datetime import date
+
+import pytest
+
+import extractors
+from extractors import cpf_is_valid, extract_cpf, extract_date, extract_integer, extract_for_node
+
+TODAY = date(2026, 10, 19)  # segunda-feira
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("em 3x", "3"),
+    ("quero 12 parcelas", "12"),
+    ("vinte e quatro vezes", "24"),
+    ("três vezes", "3"),
+    ("uma vez só", "1"),
+    ("um parcelamento em seis", "6"),
+    ("quero doze", "12"),
+    ("dez parcelas de cem", "10"),
+    ("mil e duzentos", "1200"),
+    ("cento e vinte e cinco", "125"),
+    ("três quatro", "3"),
+])
+def test_extract_integer(text, expected):
+    assert extract_integer(text) == expected
+
+
+@pytest.mark.parametrize("text", ["um boleto", "um momento", "uma", "um", "não sei", ""])
+def test_extract_integer_ambiguous_or_missing(text):
+    assert extract_integer(text) is None
+
+
+@pytest.mark.parametrize("cpf, valid", [
+    ("52998224725", True),
+    ("11144477735", True),
+    ("52998224724", False),
+    ("52998224715", False),
+    ("11111111111", False),
+    ("00000000000", False),
+    ("5299822472", False),
+    ("529982247250", False),
+    ("5299822472a", False),
+])
+def test_cpf_is_valid(cpf, valid):
+    assert cpf_is_valid(cpf) is valid
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("cpf 529.982.247-25", "52998224725"),
+    ("52998224725", "52998224725"),
+    ("cinco dois nove nove oito dois dois quatro sete dois cinco", "52998224725"),
+    ("529 ponto 982 ponto 247 traço 25", "52998224725"),
+    ("xx 0052998224725 yy", "52998224725"),
+])
+def test_extract_cpf(text, expected):
+    assert extract_cpf(text) == expected
+
+
+@pytest.mark.parametrize("text", ["123.456.789-01", "111.111.111-11", "5299822472", "não lembro"])
+def test_extract_cpf_rejects_invalid(text):
+    assert extract_cpf(text) is None
+
+
+def test_extract_cpf_without_check_digits():
+    text = "um dois três quatro cinco seis sete oito nove zero um"
+    assert extract_cpf(text, {"check_digits": False}) == "12345678901"
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("15/11", "2026-11-15"),
+    ("10/10", "2027-10-10"),  # já passou neste ano
+    ("15/11/2027", "2027-11-15"),
+    ("amanhã", "2026-10-20"),
+    ("depois de amanhã", "2026-10-21"),
+    ("hoje", "2026-10-19"),
+    ("daqui a 10 dias", "2026-10-29"),
+    ("em duas semanas", "2026-11-02"),
+    ("daqui a um mês", "2026-11-19"),
+    ("semana que vem", "2026-10-26"),
+    ("fim do mês", "2026-10-31"),
+    ("quinze de novembro", "2026-11-15"),
+    ("primeiro de dezembro", "2026-12-01"),
+    ("15 de novembro de 2027", "2027-11-15"),
+    ("próxima sexta", "2026-10-23"),
+    ("na segunda-feira", "2026-10-26"),
+    ("dia 25", "2026-10-25"),
+    ("dia 10", "2026-11-10"),
+    ("dia 5 do mês que vem", "2026-11-05"),
+    ("no dia primeiro", "2026-11-01"),
+])
+def test_extract_date(text, expected):
+    assert extract_date(text, today=TODAY) == expected
+
+
+@pytest.mark.parametrize("text", ["31 de fevereiro", "30/02", "sei lá"])
+def test_extract_date_invalid(text):
+    assert extract_date(text, today=TODAY) is None
+
+
+def test_extract_date_end_of_month_clamps_day():
+    assert extract_date("daqui a um mês", today=date(2027, 1, 31)) == "2027-02-28"
+
+
+def test_extract_for_node_records_metric():
+    node = {"type": "INPUT", "extract": {"type": "integer"}}
+    before = extractors.EXTRACTIONS.get(type="integer", result="miss")
+    assert extract_for_node(node, "um boleto") is None
+    assert extractors.EXTRACTIONS.get(type="integer", result="miss") == before + 1
+    assert extract_for_node(node, "um boleto", record=False) is None
+    assert extractors.EXTRACTIONS.get(type="integer", result="miss") == before + 1
+
+
+def test_extract_for_node_without_config():
+    assert extract_for_node({"type": "INPUT"}, "3 vezes") is None
+    assert extract_for_node({"type": "INPUT", "extract": "integer"}, "3 vezes") == "3"
@@ -0,0 +1,26 @@
+import asyncio
+
+import pytest
+
+import debt_store
+import mock_api
+from simulator import local_debt_lookup
+
+
+@pytest.fixture
+def mock_store(tmp_path, monkeypatch):
+    # Base pequena só com alguns clientes gerados, além dos fixos
+    path = str(tmp_path / "debts.db")
+    debt_store.generate(path, count=20)
+    store = debt_store.DebtStore(path)
+    monkeypatch.setattr(mock_api, "store", store)
+    monkeypatch.setitem(mock_api.FAULTS, "error_rate", 0)
+    monkeypatch.setitem(mock_api.FAULTS, "timeout_rate", 0)
+    yield store
+    store.close()
+
+
+@pytest.mark.parametrize("cpf", list(debt_store.FIXED_DEBTS) + ["123.456.789-01", "00000000000"])
+def test_local_lookup_matches_mock_api(mock_store, cpf):
+    # O simulador sem a API deve percorrer a árvore com os mesmos dados (inclusive score e status)
+    assert local_debt_lookup(cpf) == asyncio.run(mock_api.get_debt(cpf))
@@ -2,41 +2,40 @@ import os
 import json
 import time
 import re
-import httpx
+import logging
+from datetime import date
 from pydantic import BaseModel
 from typing import Optional, List
-from openai import OpenAI
-from dotenv import load_dotenv
-from utils import valor_por_extenso
+from utils import valor_por_extenso, data_por_extenso
+from metrics import span
+import clients
+import admission
+import debt_store
+import decision_rules
+import extractors
+
+logger = logging.getLogger(__name__)
 
 class TreeAnalysis(BaseModel):
     next_node_id: str
     captured_value: Optional[str] = None
     reasoning: str
 
-# Carrega as variáveis do arquivo .env
-load_dotenv()
-
-# Configuração da OpenAI
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-# Mock de Banco de Dados de Dívidas
-MOCK_DEBTS = {
-    "12345678901": {"nome": "João Silva", "valor": 1250.50, "empresa": "Banco Alpha"},
-    "98765432100": {"nome": "Maria Oliveira", "valor": 450.00, "empresa": "Loja Beta"},
-    "default": {"nome": "Cliente", "valor": 100.00, "empresa": "nossa empresa parceira"}
-}
+# Mock de Banco de Dados de Dívidas: os mesmos registros da API Mock (com score e status),
+# para que as regras de decisão sigam o mesmo caminho quando a API falha
+MOCK_DEBTS = {**debt_store.FIXED_DEBTS, "default": debt_store.DEFAULT_DEBT}
 
 from flow_data import TREE_FLOW_DATA
 
 def mock_api_query(cpf):
     clean_cpf = re.sub(r'\D', '', cpf) if cpf else "default"
     try:
-        # Chama a API Mock que criamos (rodando na porta 8001)
-        with httpx.Client() as client:
-            response = client.get(f"http://localhost:8001/debts/{clean_cpf}", timeout=2.0)
-            if response.status_code == 200:
-                return response.json()
+        # Chama a API de dívidas (a API Mock, na porta 8001, por padrão)
+        with span("debt_lookup"):
+            response = clients.debt_api().get(f"/debts/{clean_cpf}")
+        if response.status_code == 200:
+            return response.json()
+        print(f"[API ERROR] API de dívidas respondeu {response.status_code}")
     except Exception as e:
         print(f"[API ERROR] Falha ao consultar API Mock: {e}")
     
@@ -62,7 +61,7 @@ def get_template_vars(session_data):
         valor_final = valor * 0.8 # 20% de desconto
         condicao = "à vista com desconto"
     elif session_data.get("agreement_type") == "data":
-        condicao = f"pagamento para o dia {session_data.get('nova_data')}"
+        condicao = f"pagamento para o dia {data_por_extenso(session_data.get('nova_data'))}"
 
     return {
         "valor_divida": valor_por_extenso(valor),
@@ -78,6 +77,141 @@ def apply_template(text, vars):
         text = text.replace(f"{{{{{key}}}}}", str(value))
     return text
 
+# Tipos de nó em que o fluxo para e aguarda a próxima fala do usuário
+WAIT_TYPES = ("INTENT", "DECISION", "INPUT", "CONFIRMATION", "END_SUCCESS", "END_FAIL")
+
+# Quantos turnos do usuário à frente o índice de pré-cache alcança
+LOOKAHEAD_DEPTH = int(os.getenv("LOOKAHEAD_DEPTH", "2"))
+
+def compile_message(text):
+    """Pré-processa a mensagem em partes ("static", texto) e ("dynamic", nome_da_variável)."""
+    parts = []
+    for part in re.split(r'(\{\{.*?\}\})', text):
+        if not part: continue
+        if part.startswith("{{") and part.endswith("}}"):
+            parts.append(("dynamic", part[2:-2]))
+        else:
+            parts.append(("static", part))
+    return parts
+
+def render_message(parts, vars):
+    """Converte partes compiladas em segmentos, preenchendo as variáveis dinâmicas."""
+    segments = []
+    for kind, value in parts:
+        if kind == "dynamic":
+            segments.append({"type": "dynamic", "text": str(vars.get(value, f"{{{{{value}}}}}"))})
+        else:
+            segments.append({"type": "static", "text": value})
+    return segments
+
+def split_message(text, vars):
+    """Divide a mensagem em segmentos estáticos (cacheáveis) e dinâmicos (variáveis do template)."""
+    return render_message(compile_message(text), vars)
+
+class FlowIndex:
+    """
+    Índice pré-calculado do fluxo, montado uma vez quando o fluxo é carregado.
+
+    Para cada estado de espera guarda todos os caminhos automáticos que a próxima
+    fala do usuário pode disparar (todos os ramos: intents/options, on_success e
+    on_fail, on_available e on_unavailable, e a repetição do próprio nó quando a
+    fala não é entendida), agrupados pelo estado em que param. O pré-carregamento
+    (prefetch.py) consulta essas transições em vez de percorrer o grafo a cada turno.
+    """
+
+    def __init__(self, flow, depth=LOOKAHEAD_DEPTH):
+        self.flow = flow
+        self.depth = depth
+        self.nodes = flow["nodes"]
+        self.parts = {node_id: compile_message(node["message"]) for node_id, node in self.nodes.items() if "message" in node}
+        self.turn_paths = {}
+        for state in ["START", *self.nodes]:
+            self.turn_paths[state] = [path for target in self._turn_targets(state) for path in self._auto_paths(target)]
+        self.transitions = {state: self._transitions(state) for state in self.turn_paths}
+
+    def _turn_targets(self, state):
+        """Nós para onde a próxima fala do usuário pode levar a partir de state."""
+        if state == "START":
+            return [self.flow["start_node"]]
+        node = self.nodes[state]
+        if node["type"] == "INTENT":
+            targets = list(node.get("intents", {}).values())
+        elif node["type"] in ("DECISION", "CONFIRMATION"):
+            targets = list(node.get("options", {}).values())
+        else:
+            targets = [node["next"]] if node.get("next") else []
+        # Fala não entendida: o classificador mantém o nó atual e ele é repetido
+        if state not in targets and node["type"] not in ("END_SUCCESS", "END_FAIL"):
+            targets.append(state)
+        return targets
+
+    def _auto_successors(self, node):
+        if node["type"] == "VALIDATION":
+            candidates = [node.get("on_success"), node.get("on_fail")]
+        elif node["type"] == "ACTION":
+            candidates = list(node.get("options", {}).values()) + [node.get("on_available"), node.get("on_unavailable"), node.get("next")]
+        else:
+            candidates = [node.get("next")]
+        return list(dict.fromkeys(c for c in candidates if c))
+
+    def _auto_paths(self, start):
+        """Todos os caminhos de transição automática a partir de start, cada um terminando num nó de espera (ou num beco sem saída)."""
+        paths = []
+        stack = [(start, ())]
+        while stack:
+            node_id, path = stack.pop()
+            if node_id not in self.nodes or node_id in path:
+                if path: paths.append(path)
+                continue
+            path = path + (node_id,)
+            node = self.nodes[node_id]
+            successors = [] if node["type"] in WAIT_TYPES else self._auto_successors(node)
+            if not successors:
+                paths.append(path)
+            for successor in reversed(successors):
+                stack.append((successor, path))
+        return paths
+
+    def _transitions(self, state):
+        """
+        Estado de parada -> ((nó, peso), ...) dos caminhos de state até ele; o peso é a fração
+        desses caminhos que passa pelo nó (ramos automáticos são tratados como equiprováveis).
+        """
+        by_end = {}
+        for path in self.turn_paths[state]:
+            by_end.setdefault(path[-1], []).append(path)
+        transitions = {}
+        for end, paths in by_end.items():
+            weights = {}
+            for path in paths:
+                for node_id in path:
+                    weights[node_id] = weights.get(node_id, 0.0) + 1 / len(paths)
+            transitions[end] = tuple(weights.items())
+        return transitions
+
+    def next_states(self, state):
+        """Estados de espera alcançáveis com uma fala do usuário."""
+        return list(dict.fromkeys(path[-1] for path in self.turn_paths.get(state, []) if self.nodes[path[-1]]["type"] in WAIT_TYPES))
+
+# Índice do fluxo ativo: construído no primeiro uso (flow_index()) ou trocado pelo FlowRegistry
+FLOW_INDEX = None
+
+def flow_index():
+    """Índice do fluxo ativo, construído na primeira consulta (importar o módulo não compila o fluxo)."""
+    global FLOW_INDEX
+    if FLOW_INDEX is None:
+        FLOW_INDEX = FlowIndex(TREE_FLOW_DATA)
+        logger.info("Índice de lookahead do fluxo '%s': %d estados, profundidade %d",
+                    TREE_FLOW_DATA["flow_id"], len(FLOW_INDEX.turn_paths), FLOW_INDEX.depth)
+    return FLOW_INDEX
+
+def session_flow(session_data):
+    """(fluxo, índice) da versão fixada na sessão; sem versão fixada, usa o fluxo ativo."""
+    version = session_data.get("flow_version")
+    if version is not None:
+        return version.flow, version.index
+    return TREE_FLOW_DATA, flow_index()
+
 def classify_with_llm(user_text, node_id, node_config, history=[]):
     is_internal = user_text.startswith("[SYSTEM]")
     
@@ -106,11 +240,12 @@ Instruções:
     messages.append({"role": "user", "content": user_text})
 
     try:
-        response = client.responses.parse(
-            model="gpt-4o-mini",
-            input=messages,
-            text_format=TreeAnalysis,
-        )
+        with span("classify", "system" if is_internal else "user"):
+            response = clients.openai().responses.parse(
+                model="gpt-4o-mini",
+                input=messages,
+                text_format=TreeAnalysis,
+            )
         result = response.output_parsed
         # Segurança: Se a IA retornar o mesmo nó em uma decisão automática, forçamos o avanço
         if is_internal and result.next_node_id == node_id:
@@ -122,9 +257,14 @@ Instruções:
         print(f"[LLM ERROR] {e}")
         return TreeAnalysis(next_node_id=node_id, reasoning=f"Erro: {str(e)}")
 
-def get_tree_response(user_text, session_data):
+def get_tree_response(user_text, session_data, trace=None):
+    """
+    Processa a fala do usuário no estado atual e percorre os nós automáticos até o próximo ponto de espera.
+    Retorna (segmentos, próximo estado, atualizações da sessão). Se trace for uma lista, recebe os nós visitados.
+    """
     current_state = session_data.get("tree_state", "START")
     history = session_data.get("history", [])
+    flow, index = session_flow(session_data)
     
     accumulated_segments = []
     updates = {}
@@ -132,36 +272,37 @@ def get_tree_response(user_text, session_data):
     # 1. Se não for START, processar a entrada do usuário para o estado atual
     next_node_id = None
     if current_state == "START":
-        next_node_id = TREE_FLOW_DATA["start_node"]
+        next_node_id = flow["start_node"]
     else:
-        current_node = TREE_FLOW_DATA["nodes"].get(current_state)
+        current_node = flow["nodes"].get(current_state)
         if not current_node:
-            next_node_id = TREE_FLOW_DATA["start_node"]
+            next_node_id = flow["start_node"]
         else:
-            llm_result = classify_with_llm(user_text, current_state, current_node, history)
-            next_node_id = llm_result.next_node_id
-            if llm_result.captured_value:
-                updates["captured_input"] = llm_result.captured_value
+            # INPUT com extrator declarado: o valor tipado é extraído localmente, sem LLM
+            value = extractors.extract_for_node(current_node, user_text) if current_node["type"] == "INPUT" else None
+            if value is not None:
+                next_node_id = current_node["next"]
+                updates["captured_input"] = value
+            else:
+                with admission.thread_slot(admission.LLM):
+                    llm_result = classify_with_llm(user_text, current_state, current_node, history)
+                next_node_id = llm_result.next_node_id
+                if llm_result.captured_value:
+                    # Normaliza o valor do LLM com o mesmo extrator (ex: "15 de novembro" -> data ISO)
+                    updates["captured_input"] = extractors.extract_for_node(current_node, llm_result.captured_value, record=False) or llm_result.captured_value
 
     # 2. Loop de transição automática
     while next_node_id:
-        node = TREE_FLOW_DATA["nodes"].get(next_node_id)
+        node = flow["nodes"].get(next_node_id)
         if not node: break
+        if trace is not None:
+            trace.append(next_node_id)
         
         if "message" in node:
-            vars = get_template_vars({**session_data, **updates})
-            text = node["message"]
-            
-            # Divide o texto em partes estáticas e dinâmicas
-            parts = re.split(r'(\{\{.*?\}\})', text)
-            for part in parts:
-                if not part: continue
-                if part.startswith("{{") and part.endswith("}}"):
-                    var_name = part[2:-2]
-                    val = vars.get(var_name, part)
-                    accumulated_segments.append({"type": "dynamic", "text": str(val)})
-                else:
-                    accumulated_segments.append({"type": "static", "text": part})
+            parts = index.parts[next_node_id]
+            # Variáveis só são calculadas se a mensagem tiver partes dinâmicas
+            vars = get_template_vars({**session_data, **updates}) if any(kind == "dynamic" for kind, _ in parts) else {}
+            accumulated_segments.extend(render_message(parts, vars))
             
         if node["type"] == "VALIDATION":
             val = updates.get("captured_input") or session_data.get("captured_input")
@@ -170,7 +311,10 @@ def get_tree_response(user_text, session_data):
             try:
                 if "min" in rules and int(val) < rules["min"]: is_valid = False
                 if "max" in rules and int(val) > rules["max"]: is_valid = False
-                if "min_days_from_today" in rules and not val: is_valid = False
+                if "min_days_from_today" in rules or "max_days_from_today" in rules:
+                    days = (date.fromisoformat(val) - date.today()).days
+                    if days < rules.get("min_days_from_today", days): is_valid = False
+                    if days > rules.get("max_days_from_today", days): is_valid = False
             except: is_valid = False
                 
             if is_valid:
@@ -204,17 +348,16 @@ def get_tree_response(user_text, session_data):
                 updates["agreement_type"] = "avista"
                 next_node_id = node.get("next")
                 continue
-            elif next_node_id == "verificar_necessidade_api":
-                # Decisão automática da IA baseada no contexto
-                print(f"[AUTO-DECISION] IA decidindo necessidade de API...")
-                llm_result = classify_with_llm("[SYSTEM] O sistema está processando os dados. Decida o próximo passo baseado no histórico e perfil do cliente.", next_node_id, node, history)
-                next_node_id = llm_result.next_node_id
-                print(f"[AUTO-DECISION] IA escolheu: {next_node_id}")
-                continue
             elif "options" in node:
-                # Handler genérico para decisões automáticas da IA
-                llm_result = classify_with_llm("Decisão automática do sistema.", next_node_id, node, history)
-                next_node_id = llm_result.next_node_id
+                # Decisão automática: regras locais sobre os dados da sessão; LLM só se o nó pedir
+                decided, source = decision_rules.decide(next_node_id, node, {**session_data, **updates})
+                if decided is None:
+                    print(f"[AUTO-DECISION] Sem regra aplicável em {next_node_id}, consultando a IA...")
+                    with admission.thread_slot(admission.LLM):
+                        llm_result = classify_with_llm("[SYSTEM] O sistema está processando os dados. Decida o próximo passo baseado no histórico e perfil do cliente.", next_node_id, node, history)
+                    decided, source = decision_rules.resolve_llm(next_node_id, node, llm_result.next_node_id)
+                print(f"[AUTO-DECISION] {next_node_id} -> {decided} ({source})")
+                next_node_id = decided
                 continue
             else:
                 next_node_id = node.get("next")
@@ -234,59 +377,29 @@ def get_tree_response(user_text, session_data):
             next_node_id = node.get("next")
             continue
 
-        if node["type"] in ["INTENT", "DECISION", "INPUT", "CONFIRMATION", "END_SUCCESS", "END_FAIL"]:
+        if node["type"] in WAIT_TYPES:
             break
         next_node_id = node.get("next")
 
     return accumulated_segments, next_node_id, updates
 
 def get_next_possible_responses(current_state, session_data):
-    node = TREE_FLOW_DATA["nodes"].get(current_state)
-    if not node: return []
-    
-    possible_next_ids = []
-    if node["type"] == "INTENT":
-        possible_next_ids = list(node["intents"].values())
-    elif node["type"] == "DECISION" or node["type"] == "CONFIRMATION":
-        possible_next_ids = list(node["options"].values())
-    elif node["type"] == "INPUT":
-        if node.get("next"): possible_next_ids = [node["next"]]
-    else:
-        if node.get("next"): possible_next_ids = [node["next"]]
+    """Segmentos de cada resposta possível ao próximo turno, a partir dos caminhos do índice."""
+    _, index = session_flow(session_data)
+    paths = index.turn_paths.get(current_state)
+    if not paths: return []
 
+    vars = None
     all_possible_segments = []
-    for next_id in possible_next_ids:
+    for path in paths:
         temp_segments = []
-        curr = next_id
-        visited = set()
-        while curr and curr not in visited:
-            visited.add(curr)
-            n = TREE_FLOW_DATA["nodes"].get(curr)
-            if not n: break
-            if "message" in n:
+        for node_id in path:
+            parts = index.parts.get(node_id)
+            if not parts: continue
+            if vars is None and any(kind == "dynamic" for kind, _ in parts):
                 vars = get_template_vars(session_data)
-                text = n["message"]
-                parts = re.split(r'(\{\{.*?\}\})', text)
-                for part in parts:
-                    if not part: continue
-                    if part.startswith("{{") and part.endswith("}}"):
-                        var_name = part[2:-2]
-                        val = vars.get(var_name, part)
-                        temp_segments.append({"type": "dynamic", "text": str(val)})
-                    else:
-                        temp_segments.append({"type": "static", "text": part})
-            
-            if n["type"] in ["INTENT", "DECISION", "INPUT", "CONFIRMATION", "END_SUCCESS", "END_FAIL"]:
-                break
-            
-            if n["type"] == "VALIDATION":
-                curr = n["on_success"]
-            elif n["type"] == "ACTION" and "on_available" in n:
-                curr = n["on_available"]
-            else:
-                curr = n.get("next")
-        
+            temp_segments.extend(render_message(parts, vars or {}))
         if temp_segments:
             all_possible_segments.append(temp_segments)
-            
+
     return all_possible_segments
@@ -1,3 +1,8 @@
+from datetime import date
+
+MESES = ["janeiro", "fevereiro", "março", "abril", "maio", "junho", "julho",
+         "agosto", "setembro", "outubro", "novembro", "dezembro"]
+
 def valor_por_extenso(valor):
     """Converte um valor numérico para uma string por extenso em português."""
     inteiro = int(valor)
@@ -64,3 +69,11 @@ def valor_por_extenso(valor):
         resultado += " centavo" if centavos == 1 else " centavos"
         
     return resultado or "zero reais"
+
+def data_por_extenso(data):
+    """Converte uma data ISO (AAAA-MM-DD) para a forma falada, ex: "15 de novembro"."""
+    try:
+        d = date.fromisoformat(str(data))
+    except ValueError:
+        return str(data)
+    return f"{d.day} de {MESES[d.month - 1]}"
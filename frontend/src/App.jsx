@@ -48,12 +48,78 @@ function App() {
     messagesEndRef.current?.scrollIntoView({ behavior: "smooth" })
   }
 
+  // Protocolo compacto (ver backend/framing.py): texto e áudio de cada trecho chegam numa única mensagem binária
+  const FRAME_JSON = 1
+  const FRAME_AUDIO = 2
+  const FLAG_DEFLATE = 0x01
+  const FRAME_PROTOCOLS = typeof DecompressionStream !== 'undefined'
+    ? ['voicebot.frames-deflate.v1', 'voicebot.frames.v1']
+    : ['voicebot.frames.v1']
+  const textDecoder = new TextDecoder()
+  const nextSeq = useRef(0)
+  const frameChain = useRef(Promise.resolve())
+
+  const inflate = async (bytes) => {
+    const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream('deflate-raw'))
+    return new Uint8Array(await new Response(stream).arrayBuffer())
+  }
+
+  const handleFrames = async (buffer) => {
+    const view = new DataView(buffer)
+    let offset = 0
+    while (offset < buffer.byteLength) {
+      const kind = view.getUint8(offset)
+      const flags = view.getUint8(offset + 1)
+      const seq = view.getUint32(offset + 2)
+      const length = view.getUint32(offset + 6)
+      let payload = new Uint8Array(buffer, offset + 10, length)
+      offset += 10 + length
+      if (seq !== nextSeq.current) console.warn(`Quadro fora de ordem: esperado ${nextSeq.current}, recebido ${seq}`)
+      nextSeq.current = (seq + 1) >>> 0
+      if (kind === FRAME_AUDIO) {
+        handleAudio(new Blob([payload]))
+      } else if (kind === FRAME_JSON) {
+        if (flags & FLAG_DEFLATE) payload = await inflate(payload)
+        handleEvent(JSON.parse(textDecoder.decode(payload)))
+      }
+    }
+  }
+
+  const handleAudio = (blob) => {
+    audioQueue.current.push(blob)
+    processAudioQueue()
+  }
+
+  const handleEvent = (data) => {
+    if (data.type === 'user_transcript') {
+      addMessage('user', data.content)
+      setCurrentAiMessage("")
+    } else if (data.type === 'busy') {
+      // Servidor sem capacidade (controle de admissão): a fala não foi processada
+      addMessage('ai', data.scope === 'sessions' ? 'Todas as linhas estão ocupadas. Tente novamente em instantes.' : 'Não consegui processar agora, pode repetir?')
+    } else if (data.type === 'ai_text_chunk') {
+      setCurrentAiMessage(prev => prev + " " + data.content)
+    } else if (data.type === 'ai_text_complete') {
+      addMessage('ai', data.content)
+      setCurrentAiMessage("")
+      if (!isPlaying.current && audioQueue.current.length === 0) {
+        setStatus('idle')
+      }
+    }
+  }
+
   const connectWebSocket = () => {
-    ws.current = new WebSocket('ws://localhost:8000/ws')
+    // Servidores sem o protocolo compacto ignoram o subprotocolo e seguem no JSON (ws.protocol vazio)
+    ws.current = new WebSocket('ws://localhost:8000/ws', FRAME_PROTOCOLS)
+    ws.current.binaryType = 'arraybuffer'
+    nextSeq.current = 0
 
     ws.current.onopen = () => {
       setStatus('idle')
       ws.current.send(JSON.stringify({ type: 'set_mode', mode: mode }))
+      // Opus é bem menor que MP3 na mesma qualidade de voz; usa se o navegador tocar
+      const formats = new Audio().canPlayType('audio/webm; codecs=opus') ? ['opus_webm', 'mp3'] : ['mp3']
+      ws.current.send(JSON.stringify({ type: 'set_audio_format', formats: formats }))
     }
 
     ws.current.onclose = () => {
@@ -62,25 +128,19 @@ function App() {
       setTimeout(connectWebSocket, 3000)
     }
 
-    ws.current.onmessage = async (event) => {
-      if (event.data instanceof Blob) {
-        audioQueue.current.push(event.data)
-        processAudioQueue()
+    ws.current.onmessage = (event) => {
+      if (event.data instanceof ArrayBuffer) {
+        if (event.target.protocol) {
+          // Mensagens processadas uma de cada vez: a descompressão é assíncrona e a ordem dos quadros importa
+          frameChain.current = frameChain.current
+            .then(() => handleFrames(event.data))
+            .catch(e => console.error("Error decoding frames:", e))
+        } else {
+          handleAudio(new Blob([event.data]))
+        }
       } else {
         try {
-          const data = JSON.parse(event.data)
-          if (data.type === 'user_transcript') {
-            addMessage('user', data.content)
-            setCurrentAiMessage("")
-          } else if (data.type === 'ai_text_chunk') {
-            setCurrentAiMessage(prev => prev + " " + data.content)
-          } else if (data.type === 'ai_text_complete') {
-            addMessage('ai', data.content)
-            setCurrentAiMessage("")
-            if (!isPlaying.current && audioQueue.current.length === 0) {
-              setStatus('idle')
-            }
-          }
+          handleEvent(JSON.parse(event.data))
         } catch (e) {
           console.error("Error parsing JSON:", e)
         }
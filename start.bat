@@ -13,6 +13,7 @@ if not exist venv (
 ) else (
     call venv\Scripts\activate
 )
+set SPAWN_MOCK_API=1
 start /B python main.py
 
 echo Iniciando o Frontend...
@@ -9,7 +9,8 @@ echo "Iniciando o Backend..."
 cd backend
 source venv/bin/activate
 # Usar uvicorn para garantir que o servidor suba corretamente e com reload
-python -m uvicorn main:app --host 0.0.0.0 --port 8000 &
+# SPAWN_MOCK_API=1: o backend sobe junto a API Mock de Dívidas (porta 8001)
+SPAWN_MOCK_API=1 python -m uvicorn main:app --host 0.0.0.0 --port 8000 &
 BACKEND_PID=$!
 
 # Iniciar o Frontend